@@ -0,0 +1,34 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Live admin dashboard (/ws/dashboard): per-domain deltas are coalesced and pushed every tick
+LIVE_DASHBOARD_TICK = float(os.getenv("LIVE_DASHBOARD_TICK", "2.0"))
+
+# Dashboard result cache, keyed by (domain_name, page_name)
+DASHBOARD_CACHE_ENABLED = os.getenv("DASHBOARD_CACHE_ENABLED", "true").lower() == "true"
+DASHBOARD_CACHE_MAX_ENTRIES = int(os.getenv("DASHBOARD_CACHE_MAX_ENTRIES", "1024"))
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "300"))  # hard upper bound on an entry's age
+
+# How long a page may keep being served after ingest has changed its domain (seconds, 0 = never)
+DASHBOARD_CACHE_STALENESS = {
+    "MAIN": float(os.getenv("DASHBOARD_CACHE_STALENESS_MAIN", "5")),
+    "DEVICE_STATS": float(os.getenv("DASHBOARD_CACHE_STALENESS_DEVICE_STATS", "60")),
+    "CONTENT": float(os.getenv("DASHBOARD_CACHE_STALENESS_CONTENT", "30")),
+    "TIMESERIES": float(os.getenv("DASHBOARD_CACHE_STALENESS_TIMESERIES", "60")),
+}
+
+# DEVICE_STATS heatmap: default resolution (index into GEO_BIN_SIZES) and the most cells returned
+GEO_HEATMAP_DEFAULT_RESOLUTION = int(os.getenv("GEO_HEATMAP_DEFAULT_RESOLUTION", "1"))
+GEO_HEATMAP_MAX_CELLS = int(os.getenv("GEO_HEATMAP_MAX_CELLS", "2000"))
+
+# DEVICE_STATS referrers: most (utm_source, utm_medium, utm_campaign) rows returned, busiest first
+REFERRER_TOP_N = int(os.getenv("REFERRER_TOP_N", "50"))
+
+# Time series (/dashboard/timeseries): the most points a single request may ask for
+TIMESERIES_MAX_POINTS = int(os.getenv("TIMESERIES_MAX_POINTS", "2000"))
+
+# CONTENT page: titles per page by default and at most
+CONTENT_PAGE_DEFAULT_LIMIT = int(os.getenv("CONTENT_PAGE_DEFAULT_LIMIT", "50"))
+CONTENT_PAGE_MAX_LIMIT = int(os.getenv("CONTENT_PAGE_MAX_LIMIT", "500"))
@@ -10,7 +10,7 @@ class MongoDB:
     async def connect(self, uri: str, db_name: str):
         self.client = motor.motor_asyncio.AsyncIOMotorClient(uri)   
         self.database = self.client[db_name]
-        collection_names = ['user','session_data','counts','admin','content']
+        collection_names = ['user','session_data','counts','admin','content','content_metrics','domain_users','session_checkpoints','presence','presence_workers','rollups','geo_bins','referrer_counts','domain_changes']
         self.collections = {name: self.database[name] for name in collection_names}
         print("MongoDB connected")
 
@@ -0,0 +1,84 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Write-behind batching of WebSocket session data
+INGEST_BATCH_ENABLED = os.getenv("INGEST_BATCH_ENABLED", "true").lower() == "true"
+INGEST_BATCH_MAX_SESSIONS = int(os.getenv("INGEST_BATCH_MAX_SESSIONS", "500"))
+INGEST_BATCH_FLUSH_INTERVAL = float(os.getenv("INGEST_BATCH_FLUSH_INTERVAL", "1.0"))
+# High-water mark: adding a session waits while this many are buffered or being flushed
+INGEST_BATCH_MAX_PENDING = int(os.getenv("INGEST_BATCH_MAX_PENDING", "5000"))
+# Flushes a failed write is retried for before its sessions are dead-lettered
+INGEST_BATCH_MAX_ATTEMPTS = int(os.getenv("INGEST_BATCH_MAX_ATTEMPTS", "10"))
+# JSON lines file receiving sessions whose writes failed for good
+INGEST_DEAD_LETTER_PATH = os.getenv("INGEST_DEAD_LETTER_PATH", os.path.join(os.getenv("SPOOL_DIR", "spool"), "ingest_dead_letter.jsonl"))
+
+# Content metrics storage: "per_title" keeps one document per (domain_name, type, title)
+# in the content_metrics collection, "embedded" keeps the legacy metrics array per domain
+CONTENT_METRICS_LAYOUT = os.getenv("CONTENT_METRICS_LAYOUT", "per_title")
+
+# Bounded queue between the WebSocket receive loop and the session handler.
+# INGEST_QUEUE_POLICY is one of "block", "drop_oldest" or "reject"; "reject" closes
+# the socket with INGEST_QUEUE_REJECT_CLOSE_CODE (1013 = try again later)
+INGEST_QUEUE_ENABLED = os.getenv("INGEST_QUEUE_ENABLED", "true").lower() == "true"
+INGEST_QUEUE_MAX_SIZE = int(os.getenv("INGEST_QUEUE_MAX_SIZE", "10000"))
+INGEST_QUEUE_WORKERS = int(os.getenv("INGEST_QUEUE_WORKERS", "8"))
+INGEST_QUEUE_POLICY = os.getenv("INGEST_QUEUE_POLICY", "block")
+INGEST_QUEUE_REJECT_CLOSE_CODE = int(os.getenv("INGEST_QUEUE_REJECT_CLOSE_CODE", "1013"))
+# Seconds shutdown waits for the queue to drain; what is left is spilled to SPOOL_DIR
+INGEST_QUEUE_DRAIN_TIMEOUT = float(os.getenv("INGEST_QUEUE_DRAIN_TIMEOUT", "10"))
+
+# Per-process cache of (domain_name, user_id) pairs already registered in domain_users
+DOMAIN_USER_CACHE_SIZE = int(os.getenv("DOMAIN_USER_CACHE_SIZE", "100000"))
+
+# Keep appending every session id to user.session_ids; session_count and last_seen
+# are always maintained, so this can be turned off to stop the array from growing
+STORE_SESSION_IDS = os.getenv("STORE_SESSION_IDS", "true").lower() == "true"
+
+# Session stitching: keep one in-progress session per (domain_name, user_id) connection,
+# merge updates into it and persist once on disconnect or after SESSION_IDLE_TIMEOUT seconds.
+# In-progress sessions are checkpointed every SESSION_CHECKPOINT_INTERVAL seconds
+SESSION_STITCHING_ENABLED = os.getenv("SESSION_STITCHING_ENABLED", "false").lower() == "true"
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "1800"))
+SESSION_CHECKPOINT_INTERVAL = float(os.getenv("SESSION_CHECKPOINT_INTERVAL", "30"))
+# Checkpoints not replayed within this many seconds are expired by a TTL index
+SESSION_CHECKPOINT_TTL = int(os.getenv("SESSION_CHECKPOINT_TTL", str(7 * 24 * 3600)))
+
+# Local append-only spool: sessions are appended to segment files under SPOOL_DIR first
+# and replayed into Mongo in the background from a checkpointed offset
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "false").lower() == "true"
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool")
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", "500"))
+SPOOL_POLL_INTERVAL = float(os.getenv("SPOOL_POLL_INTERVAL", "0.2"))
+SPOOL_MAX_BACKOFF = float(os.getenv("SPOOL_MAX_BACKOFF", "30"))
+SPOOL_FSYNC = os.getenv("SPOOL_FSYNC", "false").lower() == "true"
+# Appends arriving within this many seconds of each other share one fsync
+SPOOL_FSYNC_INTERVAL = float(os.getenv("SPOOL_FSYNC_INTERVAL", "0.005"))
+# Replay attempts for a batch's failed writes before its records go to the dead-letter file
+SPOOL_MAX_ATTEMPTS = int(os.getenv("SPOOL_MAX_ATTEMPTS", "20"))
+
+# HTTP bulk ingest (POST /ingest/batch): limit on the decompressed body size, and number
+# of records written as one bulk batch once the whole body has been validated
+INGEST_HTTP_MAX_BYTES = int(os.getenv("INGEST_HTTP_MAX_BYTES", str(50 * 1024 * 1024)))
+INGEST_HTTP_CHUNK_RECORDS = int(os.getenv("INGEST_HTTP_CHUNK_RECORDS", "1000"))
+
+# Idempotent ingest: frames carrying `seq` or `event_id` are acknowledged in batches of
+# ACK_BATCH_SIZE (or every ACK_INTERVAL seconds) and replays within the last DEDUP_WINDOW
+# keys of a (domain_name, user_id) are dropped, across reconnects
+ACK_BATCH_SIZE = int(os.getenv("ACK_BATCH_SIZE", "50"))
+ACK_INTERVAL = float(os.getenv("ACK_INTERVAL", "1.0"))
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "1024"))
+DEDUP_MAX_CLIENTS = int(os.getenv("DEDUP_MAX_CLIENTS", "100000"))
+
+# Presence (active users) backend: "memory" counts this process only, "mongo" shares
+# presence across workers/pods. Workers publish connect/disconnect events and a liveness
+# heartbeat every PRESENCE_HEARTBEAT_INTERVAL seconds and expire after PRESENCE_TTL
+PRESENCE_BACKEND = os.getenv("PRESENCE_BACKEND", "memory")
+PRESENCE_HEARTBEAT_INTERVAL = float(os.getenv("PRESENCE_HEARTBEAT_INTERVAL", "5"))
+PRESENCE_TTL = float(os.getenv("PRESENCE_TTL", "20"))
+
+# Geo heatmap: each session's location is counted in one lat/long grid cell per
+# resolution; GEO_BIN_SIZES lists the cell size in degrees, coarsest first
+GEO_BIN_SIZES = [float(size) for size in os.getenv("GEO_BIN_SIZES", "10,1,0.1").split(",")]
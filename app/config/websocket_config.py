@@ -0,0 +1,15 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Protocol-level heartbeat: the server pings every WS_PING_INTERVAL seconds and drops
+# connections that do not answer within WS_PING_TIMEOUT (applied when starting uvicorn)
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", "20"))
+
+# Application-level limits for /ws/session
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "300"))  # close sockets that send nothing for this long
+WS_MAX_FRAME_BYTES = int(os.getenv("WS_MAX_FRAME_BYTES", str(256 * 1024)))
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "100000"))  # per process
+WS_MAX_RETAINED_BYTES = int(os.getenv("WS_MAX_RETAINED_BYTES", str(1024 * 1024)))  # delta state kept per connection
@@ -1,10 +1,138 @@
-from fastapi import APIRouter, Depends
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
+from app.config.dashboard_config import CONTENT_PAGE_DEFAULT_LIMIT, GEO_HEATMAP_DEFAULT_RESOLUTION
+from app.service.dashboard_cache import dashboard_cache
 from app.service.dashboard_service import DashboardService
-from app.utils.jwt_utils import feature_access_verification
+from app.service.live_dashboard_service import live_dashboard
+from app.utils.jwt_utils import feature_access_verification, is_super_admin, oauth2_scheme, super_admin_verification
 
 dashboard_route = APIRouter()
 
 @dashboard_route.get("/dashboard")
-async def get_dashboard_data(page_name: str, admin_id: str):
+async def get_dashboard_data(
+    page_name: str,
+    admin_id: str,
+    resolution: int = Query(GEO_HEATMAP_DEFAULT_RESOLUTION, ge=0),
+    bbox: Optional[str] = Query(None),
+    sort: str = Query("views"),
+    order: str = Query("desc"),
+    content_type: Optional[str] = Query(None, alias="type"),
+    limit: int = Query(CONTENT_PAGE_DEFAULT_LIMIT, ge=1),
+    cursor: Optional[str] = Query(None)
+):
+    """
+    Dashboard data of a page.
+
+    Args:
+        resolution (int): DEVICE_STATS heatmap resolution, an index into GEO_BIN_SIZES (0 = coarsest).
+        bbox (str): DEVICE_STATS heatmap bounds as "min_lat,min_lng,max_lat,max_lng".
+        sort (str): CONTENT sort key, e.g. views, avg_completion_rate or like_rate. Stored
+            counters (views, likes, clicks, cta_clicks, subscribers) are served from an index;
+            averages and rates are computed over the domain's whole catalog to sort by.
+        order (str): CONTENT sort order, asc or desc.
+        type (str): CONTENT type filter: VIDEO, CONTENT or BUTTON.
+        limit (int): CONTENT titles per page.
+        cursor (str): CONTENT `next_cursor` of the previous page.
+    """
     await feature_access_verification(page_name)
-    return await DashboardService.get_dashboard_data(page_name, admin_id)
+    return await DashboardService.get_dashboard_data(
+        page_name, admin_id, resolution, parse_bbox(bbox), sort, order, content_type, limit, cursor
+    )
+
+def parse_bbox(bbox: Optional[str]):
+    if bbox is None:
+        return None
+    try:
+        min_lat, min_lng, max_lat, max_lng = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be min_lat,min_lng,max_lat,max_lng")
+    if min_lat > max_lat or min_lng > max_lng:
+        raise HTTPException(status_code=400, detail="bbox minimums must not exceed its maximums")
+    return min_lat, min_lng, max_lat, max_lng
+
+@dashboard_route.get("/dashboard/timeseries")
+async def get_time_series(
+    admin_id: str,
+    start: datetime,
+    end: datetime,
+    granularity: str = Query("day"),
+    timezone: str = Query("UTC"),
+    token: str = Depends(oauth2_scheme)
+):
+    """
+    Visits, visitors, bounces, average session time and page views as a time series.
+
+    Args:
+        start (datetime): Start of the range (inclusive), on a quarter hour; read in `timezone` when it has no offset.
+        end (datetime): End of the range (exclusive), on a quarter hour.
+        granularity (str): hour, day, week (starting Monday) or month.
+        timezone (str): IANA timezone the buckets start in, e.g. "Europe/Berlin" or "Asia/Kathmandu".
+            Series are built from UTC quarter-hour rollups (or coarser ones where they line up),
+            so only historical offsets that are not a whole number of quarter hours are rejected.
+    """
+    payload = await feature_access_verification("MAIN", token)
+    if not is_super_admin(payload):
+        admin_id = payload.get("admin_id", admin_id)
+    return await DashboardService.get_time_series(admin_id, start, end, granularity, timezone)
+
+@dashboard_route.get("/dashboard/cache")
+async def get_dashboard_cache_stats(payload = Depends(super_admin_verification)):
+    """Expose dashboard cache hit/miss counters and the per-page staleness bounds."""
+    return dashboard_cache.stats()
+
+@dashboard_route.put("/dashboard/cache/staleness")
+async def set_dashboard_cache_staleness(
+    page_name: str,
+    seconds: float = Query(..., ge=0),
+    payload = Depends(super_admin_verification)
+):
+    """
+    Set how long a dashboard page may be served after ingest has changed its domain.
+
+    Args:
+        page_name (str): MAIN, DEVICE_STATS or CONTENT.
+        seconds (float): Staleness bound; 0 recomputes the page after every write.
+    """
+    if page_name not in dashboard_cache.staleness:
+        raise HTTPException(status_code=404, detail=f"Unknown dashboard page: {page_name}")
+    dashboard_cache.set_staleness(page_name, seconds)
+    return dashboard_cache.stats()
+
+@dashboard_route.websocket("/ws/dashboard")
+async def live_dashboard_session(
+    websocket: WebSocket,
+    token: str = Query(...),
+    admin_id: Optional[str] = Query(None)
+):
+    """
+    Live MAIN dashboard for admins.
+
+    Sends a {"type": "snapshot"} with the full MAIN data on connect, then a
+    {"type": "delta"} every tick with the visits, bounces, page counts and content
+    metrics ingested since the previous tick, plus the current active user count.
+
+    Args:
+        token (str): Access token (browsers cannot set headers on WebSocket requests).
+        admin_id (str): Admin whose domain to watch; only honoured for the SUPERADMIN.
+    """
+    try:
+        payload = await feature_access_verification("MAIN", token)
+        if not is_super_admin(payload) or not admin_id:
+            admin_id = payload.get("admin_id")
+        domain_name = await DashboardService.get_domain_name(admin_id)
+    except HTTPException:
+        # 1008: policy violation
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+
+    try:
+        await live_dashboard.subscribe(domain_name, websocket, admin_id)
+        while True:
+            await websocket.receive_text()  # Keep the connection open; client messages are ignored
+    except WebSocketDisconnect:
+        pass
+    finally:
+        live_dashboard.unsubscribe(domain_name, websocket)
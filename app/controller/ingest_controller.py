@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Request
+from app.service.ingest_service import IngestService
+
+ingest_route = APIRouter()
+
+@ingest_route.post("/ingest/batch")
+async def ingest_batch(request: Request):
+    """
+    Bulk session ingest for navigator.sendBeacon and server-side collectors.
+
+    The body is NDJSON (one SessionData per line) or a JSON array of SessionData,
+    optionally gzip-compressed. The whole body is validated before anything is written.
+    Returns the number of accepted and rejected records; see IngestService.ingest_batch
+    for the 503 returned when a write fails.
+    """
+    return await IngestService.ingest_batch(request.stream(), request.headers.get("content-encoding"))
@@ -15,7 +15,7 @@ async def register_user(user: User):
 
 @user_route.get("/create_user")
 async def get_id():
-    user = await mongodb.collections["user"].insert_one({"session_ids": []})  
+    user = await mongodb.collections["user"].insert_one({"session_ids": [], "session_count": 0})  
     return {"user_id": str(user.inserted_id)}  
 
 @user_route.get("/get_top_users/{admin_id}")
@@ -1,11 +1,23 @@
+import functools
+import uuid
 from datetime import datetime, timezone
 from typing import Optional
 from bson import ObjectId
-from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
-from app.model.session_data import SessionData
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
+from app.config.ingest_config import INGEST_QUEUE_REJECT_CLOSE_CODE
+from app.config.websocket_config import WS_MAX_CONNECTIONS
+from app.service.ingest_buffer import ingest_dead_letters
+from app.service.ingest_queue import IngestQueueFull, ingest_queue
+from app.service.ingest_spool import ingest_spool
+from app.service.presence_service import presence
+from app.service.session_stitcher import session_stitcher
 from app.service.websocket_service import WebsocketService
-from app.utils.shared_state import active_connections
 from app.config.db_config import mongodb
+from app.utils.ack_tracker import AckTracker, dedup_key, is_duplicate
+from app.utils.connection_guard import CLOSE_POLICY_VIOLATION, CLOSE_TRY_AGAIN_LATER, ConnectionClosed, ConnectionGuard, connection_stats
+from app.utils.frame_codec import FRAME_ERRORS, decode_frame, merge_delta, negotiate_encoding, parse_session_data, session_data_adapter
+from app.utils.jwt_utils import super_admin_verification
+from app.utils.loop_monitor import loop_monitor
 
 websocket_route = APIRouter()
 
@@ -13,7 +25,10 @@ websocket_route = APIRouter()
 async def websocket_session(
     websocket: WebSocket,
     domain_name: str = Query(...),
-    user_id: str = Query(...)
+    user_id: str = Query(...),
+    encoding: Optional[str] = Query(None),
+    delta: bool = Query(False),
+    client_session: Optional[str] = Query(None)
 ):
     """
     WebSocket endpoint that tracks active users by domain.
@@ -22,36 +37,137 @@ async def websocket_session(
         websocket (WebSocket): The WebSocket connection object.
         domain_name (str): Domain name passed as a query parameter.
         user_id (str): User ID passed as a query parameter.
+        encoding (str): Frame encoding: "json" (default), "msgpack" or "cbor".
+            Binary encodings can also be negotiated with the matching subprotocol.
+        delta (bool): If true, each frame carries only the fields changed since the previous frame.
+        client_session (str): Client-generated id of the frame stream `seq` numbers belong to.
+            Reuse it when reconnecting to resend unacknowledged frames; without it `seq`
+            numbers only count within this connection.
+
+    Frames may carry a `seq` number or `event_id`. Keys are acknowledged in batches with
+    {"type": "ack", "ids": [...], "duplicates": n} once their frame is durable: written to
+    the database (writes that failed for good are dead-lettered), appended to the spool or,
+    with session stitching, checkpointed. Replays of recently written keys are acknowledged
+    without being processed again. Frames that are dropped are not acknowledged, so the
+    client can resend them. A frame that cannot be decoded or validated is skipped
+    without closing the connection; a frame without a valid `user_id` is attributed to
+    the connection's `user_id`.
     """
     if not domain_name or not user_id:
         raise HTTPException(status_code=400, detail="Missing domain_name or user_id")
 
+    if not ObjectId.is_valid(user_id):
+        await websocket.close(code=CLOSE_POLICY_VIOLATION)
+        return
+
+    frame_encoding, subprotocol = negotiate_encoding(encoding, websocket.scope.get("subprotocols", []))
+    if frame_encoding is None:
+        # 1003: the requested encoding is not supported by this server
+        await websocket.close(code=1003)
+        return
+
+    if connection_stats.open_connections >= WS_MAX_CONNECTIONS:
+        connection_stats.rejected_capacity += 1
+        await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+        return
+
     # Accept the WebSocket connection
-    await websocket.accept()
+    await websocket.accept(subprotocol=subprotocol)
 
-    # Add the user_id to the active_connections dictionary for the specific domain
-    if domain_name not in active_connections:
-        active_connections[domain_name] = []
-    if user_id not in active_connections[domain_name]:
-        active_connections[domain_name].append(user_id)
+    # Register the connection; a user stays active until their last connection closes
+    presence.connect(domain_name, user_id)
 
     print(f"Connected: {domain_name} - {user_id}")
-    print(f"Active connections: {active_connections}")
+
+    stream_id = client_session or uuid.uuid4().hex
+    last_frame = {}
+    guard = ConnectionGuard(websocket)
+    acks = AckTracker(websocket, frame_encoding)
+    acks.start()
 
     try:
         while True:
-            data = await websocket.receive_json()
-            session_data =  SessionData(**data)
-            await WebsocketService.handle_session_data(session_data)
-            print(f"Received message from {user_id} on {domain_name}: {data}")
+            raw = await guard.receive()
+            try:
+                if delta:
+                    frame = decode_frame(raw, frame_encoding)
+                    if not isinstance(frame, dict):
+                        raise ValueError("delta frame is not an object")
+                    key = dedup_key(domain_name, user_id, stream_id, frame.pop("seq", None), frame.pop("event_id", None))
+                    merged = merge_delta(last_frame, frame)
+                    session_data = session_data_adapter.validate_python(merged)
+                    # Only a valid frame becomes the base for the next delta
+                    last_frame = merged
+                    guard.retain(last_frame, len(raw))
+                else:
+                    session_data = parse_session_data(raw, frame_encoding)
+                    key = dedup_key(domain_name, user_id, stream_id, session_data.seq, session_data.event_id)
+            except FRAME_ERRORS as e:
+                # Malformed JSON/msgpack/CBOR or a failed validation: drop this frame, keep the connection
+                connection_stats.rejected_frames += 1
+                print(f"Skipping invalid frame from {domain_name} - {user_id}: {e}")
+                continue
+
+            if not ObjectId.is_valid(session_data.user_id):
+                session_data.user_id = user_id
+
+            if key is not None and is_duplicate(*key):
+                # Replay of a frame we already wrote: acknowledge again, write nothing
+                await acks.ack(key[1], duplicate=True)
+                continue
+
+            # Frames are remembered and acknowledged only once durable, whichever path writes them
+            on_written = functools.partial(acks.written, *key) if key is not None else None
+            if session_stitcher.running:
+                # Accumulate into the connection's in-progress session, persisted on disconnect
+                session_stitcher.update(session_data, on_written)
+            elif ingest_spool.running:
+                # Durable first: replayed into Mongo in the background
+                ingest_spool.append(session_data)
+                await ingest_spool.sync()
+                if on_written is not None:
+                    on_written()
+            elif ingest_queue.running:
+                await ingest_queue.put(session_data, on_written)
+            else:
+                await WebsocketService.handle_session_data(session_data, on_written)
 
     except WebSocketDisconnect:
-        # Remove user from the active connections on disconnect
-        if domain_name in active_connections and user_id in active_connections[domain_name]:
-            active_connections[domain_name].remove(user_id)
-            if not active_connections[domain_name]:  # Remove domain if no users are left
-                del active_connections[domain_name]
+        pass
+
+    except ConnectionClosed as e:
+        print(f"Closing connection: {domain_name} - {user_id}: {e.reason}")
+        await websocket.close(code=e.code)
+
+    except IngestQueueFull:
+        # Shed load: ask the client to back off and reconnect later
+        print(f"Ingest queue full. Closing connection: {domain_name} - {user_id}")
+        await websocket.close(code=INGEST_QUEUE_REJECT_CLOSE_CODE)
+
+    finally:
+        guard.close()
+        await acks.stop()
+        if session_stitcher.running:
+            await session_stitcher.close(domain_name, user_id)
+
+        # Release the connection on disconnect
+        presence.disconnect(domain_name, user_id)
 
         print(f"Disconnected: {domain_name} - {user_id}")
-        print(f"Remaining connections: {active_connections}")
 
+
+@websocket_route.get("/ws/connection_stats")
+async def get_connection_stats(payload = Depends(super_admin_verification)):
+    """Expose connection counts, traffic, retained bytes and event-loop latency."""
+    return {**connection_stats.to_dict(), **loop_monitor.stats()}
+
+
+@websocket_route.get("/ws/ingest_stats")
+async def get_ingest_stats(payload = Depends(super_admin_verification)):
+    """Expose ingest queue depth, wait times and overload counters."""
+    stats = ingest_queue.stats()
+    stats["dead_letters"] = ingest_dead_letters.count
+    if ingest_spool.running:
+        stats["spool_pending_bytes"] = ingest_spool.pending_bytes()
+        stats["spool_dead_letters"] = ingest_spool.dead_letters
+    return stats
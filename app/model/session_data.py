@@ -60,6 +60,8 @@ class Referrer(BaseModel):
     utm_campaign: Optional[str] = None
 
 class SessionData(BaseModel):
+    seq: Optional[int] = None  # client sequence number, used for acks and dedup only
+    event_id: Optional[str] = None  # alternative client-chosen idempotency key
     event: Optional[str] = None
     user_id: Optional[str] = None
     username: Optional[str] = None
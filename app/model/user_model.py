@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel
 
@@ -5,4 +6,6 @@ class User(BaseModel):
     user_id: str
     username: str
     domain_name: str
-    session_ids : Optional[List[str]] = None
\ No newline at end of file
+    session_ids : Optional[List[str]] = None
+    session_count: Optional[int] = 0
+    last_seen: Optional[datetime] = None
\ No newline at end of file
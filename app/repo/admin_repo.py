@@ -11,12 +11,12 @@ class AdminRepo:
     
     @staticmethod
     async def find_admin(username: str):
-        result = await mongodb.collections["admin"].find_one({"username":username})
+        result = await mongodb.collections["admin"].find_one({"username":username}, {"users_list": 0})
         return result
     
     @staticmethod
     async def find_admin_by_id(admin_id: str):
-        result = await mongodb.collections["admin"].find_one({"_id":ObjectId(admin_id)})
+        result = await mongodb.collections["admin"].find_one({"_id":ObjectId(admin_id)}, {"users_list": 0})
         return result
     
     @staticmethod
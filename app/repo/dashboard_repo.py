@@ -1,71 +1,210 @@
 from bson import ObjectId
 from app.config.db_config import mongodb
+from app.config.ingest_config import CONTENT_METRICS_LAYOUT
 from datetime import datetime
+from typing import Optional, Tuple
 
+# Content counters stored on each metric; content_metrics has a
+# (domain_name, <counter>, type, title) index for each of them
+CONTENT_COUNTERS = ("views", "likes", "clicks", "cta_clicks", "subscribers")
 
-class DashboardRepo:
-    @staticmethod
-    async def get_total_visitors(domain_name: str):
-        return await mongodb.collections["user"].count_documents({"domain_name":domain_name})
 
+class DashboardRepo:
     @staticmethod
-    async def get_total_visits(domain_name: str):
-        return await mongodb.collections["session_data"].count_documents({"domain_name": domain_name})
+    async def get_main_counts(domain_name: str):
+        """
+        Everything MAIN reads from the counts layer in one round trip: the counts fields
+        it needs plus the domain's monthly rollups, joined in as `monthly_rollups`.
+        """
+        result = await mongodb.collections["counts"].aggregate([
+            {"$match": {"domain_name": domain_name}},
+            {"$limit": 1},
+            {"$project": {
+                "_id": 0,
+                "page_counts": 1,
+                "bounce_counts": 1,
+                "bounce_counts_per_page": 1,
+                "session_count": 1,
+                "session_duration_sum": 1
+            }},
+            {"$lookup": {
+                "from": "rollups",
+                "pipeline": [
+                    {"$match": {"domain_name": domain_name, "granularity": "month"}},
+                    {"$sort": {"bucket": 1}},
+                    {"$project": {"_id": 0, "domain_name": 0, "granularity": 0, "referrers": 0}}
+                ],
+                "as": "monthly_rollups"
+            }}
+        ]).to_list(length=1)
+        return result[0] if result else None
 
     @staticmethod
-    async def get_session_data(domain_name: str):
-        return await mongodb.collections["session_data"].find({"domain_name": domain_name}).to_list(length=None)
+    async def get_session_duration_stats(domain_name: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+        """Session count and summed duration (seconds), aggregated in Mongo."""
+        match = {"domain_name": domain_name}
+        if start_date is not None:
+            match["session_start"] = {"$gte": start_date}
+        if end_date is not None:
+            match["session_end"] = {"$lte": end_date}
+        result = await mongodb.collections["session_data"].aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": None,
+                "session_count": {"$sum": 1},
+                # Date subtraction yields milliseconds
+                "session_duration_sum": {"$sum": {"$divide": [{"$subtract": ["$session_end", "$session_start"]}, 1000]}}
+            }}
+        ]).to_list(length=1)
+        return result[0] if result else {"session_count": 0, "session_duration_sum": 0}
 
     @staticmethod
-    async def get_page_view_analysis(domain_name: str):
-        return await mongodb.collections["counts"].find_one({"domain_name": domain_name}, {"page_counts": 1, "_id": 0})
+    async def get_count_data(domain_name: str):
+        return await mongodb.collections["counts"].find_one(
+            {"domain_name":domain_name},
+            {"_id": 0, "os_counts": 1, "browser_counts": 1, "device_counts": 1}
+        )
 
     @staticmethod
-    async def get_bounce_count(domain_name: str):
-        return await mongodb.collections["counts"].find_one({"domain_name": domain_name}, {"bounce_counts": 1, "_id": 0})
+    async def get_top_referrers(domain_name: str, limit: int):
+        """The domain's busiest (utm_source, utm_medium, utm_campaign) referrers with their session counts."""
+        return await mongodb.collections["referrer_counts"].find(
+            {"domain_name": domain_name},
+            {"_id": 0, "utm_source": 1, "utm_medium": 1, "utm_campaign": 1, "count": 1}
+        ).sort("count", -1).limit(limit).to_list(length=limit)
     
     @staticmethod
-    async def get_bounce_counts_per_page(domain_name: str):
-        return await mongodb.collections["counts"].find_one({"domain_name": domain_name}, {"bounce_counts_per_page": 1, "_id": 0})
-    
-    @staticmethod
-    async def get_count_data(domain_name: str):
-        return await mongodb.collections["counts"].find_one({"domain_name":domain_name})
-    
-    @staticmethod
-    async def get_content_data(domain_name: str):
-        return await mongodb.collections["content"].find_one({"domain_name":domain_name})
+    async def get_content_page(
+        domain_name: str,
+        metric_type: Optional[str],
+        sort_key: str,
+        descending: bool,
+        limit: int,
+        after: Optional[Tuple[float, str, str]] = None
+    ):
+        """
+        One page of content metrics in either storage layout, with the per-view averages and
+        rates computed in Mongo, ordered by `sort_key` then (type, title), all in the same
+        direction. `after` is the (sort value, type, title) of the last row of the previous page.
 
-    @staticmethod
-    async def get_total_visits_in_range(start_date: datetime, end_date: datetime, domain_name: str):
-        return await mongodb.collections["session_data"].count_documents({
-            "session_start": {"$gte": start_date},
-            "session_end": {"$lte": end_date},
-            "domain_name": domain_name
-        })
+        A stored counter is sorted and matched on the raw field, which the registered
+        index serves without reading the rest of the domain's metrics, and the rates are
+        computed for the returned page only. Metrics missing the counter sort as null,
+        which comes before any number. Sorting by a rate computes it for every metric
+        of the domain, then sorts them all.
+        """
+        if CONTENT_METRICS_LAYOUT == "embedded":
+            collection = mongodb.collections["content"]
+            pipeline = [
+                {"$match": {"domain_name": domain_name}},
+                {"$unwind": "$metrics"},
+                {"$replaceRoot": {"newRoot": "$metrics"}},
+            ]
+            if metric_type:
+                pipeline.append({"$match": {"type": metric_type}})
+        else:
+            collection = mongodb.collections["content_metrics"]
+            match = {"domain_name": domain_name}
+            if metric_type:
+                match["type"] = metric_type
+            pipeline = [{"$match": match}]
 
-    @staticmethod
-    async def get_session_data_in_range(start_date: datetime, end_date: datetime, domain_name: str):
-        return await mongodb.collections["session_data"].find({
-            "session_start": {"$gte": start_date},
-            "session_end": {"$lte": end_date},
-            "domain_name": domain_name
-        }).to_list(length=None)
-    
-    @staticmethod
-    async def get_users_joined_in_range(start_date, end_date, domain_name):
-        return await mongodb.collections["user"].count_documents(
-            {
-                "date_joined": {"$gte": start_date, "$lte": end_date},
-                "domain_name": domain_name
-            }
+        def per_view(field: str):
+            return {"$cond": [
+                {"$gt": [{"$ifNull": ["$views", 0]}, 0]},
+                {"$divide": [{"$ifNull": [f"${field}", 0]}, "$views"]},
+                0
+            ]}
+
+        rates = {"$addFields": {
+            "avg_watch_time": per_view("sum_watch_time"),
+            "avg_completion_rate": per_view("sum_completion_rate"),
+            "avg_scroll_depth": per_view("sum_scroll_depth"),
+            "subscription_rate": per_view("subscribers"),
+            "like_rate": per_view("likes"),
+        }}
+
+        if sort_key in CONTENT_COUNTERS:
+            sort_field = sort_key
+        else:
+            sort_field = "sort_value"
+            pipeline += [rates, {"$addFields": {"sort_value": f"${sort_key}"}}]
+
+        if after is not None:
+            pipeline.append({"$match": DashboardRepo.keyset_after(sort_field, descending, after)})
+
+        direction = -1 if descending else 1
+        pipeline += [
+            {"$sort": {sort_field: direction, "type": direction, "title": direction}},
+            {"$limit": limit},
+        ]
+        if sort_field != "sort_value":
+            pipeline += [rates, {"$addFields": {"sort_value": f"${sort_key}"}}]
+        pipeline.append(
+            {"$project": {"_id": 0, "domain_name": 0, "sum_watch_time": 0, "sum_completion_rate": 0, "sum_scroll_depth": 0}}
         )
-    
+        return await collection.aggregate(pipeline, allowDiskUse=True).to_list(length=limit)
+
     @staticmethod
-    async def get_location_and_referrer_data(domain_name: str):
-        return await mongodb.collections["session_data"].find(
-            {"domain_name": domain_name},  # Filter by domain_name
-            {"_id": 0, "location": 1,"referrer": 1}      # Project only the location field
-        ).to_list(length=None)
+    def keyset_after(field: str, descending: bool, after: Tuple[Optional[float], str, str]) -> dict:
+        """Match the rows after (value, type, title) in (field, type, title) order, nulls first when ascending."""
+        value, last_type, last_title = after
+        later = "$lt" if descending else "$gt"
+        clauses = [
+            {field: value, "type": {later: last_type}},
+            {field: value, "type": last_type, "title": {later: last_title}},
+        ]
+        if value is None:
+            if not descending:
+                clauses.append({field: {"$ne": None}})
+        else:
+            clauses.append({field: {later: value}})
+            if descending:
+                clauses.append({field: None})
+        return {"$or": clauses}
 
+    @staticmethod
+    async def get_geo_heatmap(domain_name: str, resolution: int, bbox: Optional[Tuple[float, float, float, float]], limit: int):
+        """The busiest heatmap cells of a resolution, optionally within (min_lat, min_lng, max_lat, max_lng)."""
+        query = {"domain_name": domain_name, "resolution": resolution}
+        if bbox is not None:
+            min_lat, min_lng, max_lat, max_lng = bbox
+            query["latitude"] = {"$gte": min_lat, "$lte": max_lat}
+            query["longitude"] = {"$gte": min_lng, "$lte": max_lng}
+        return await mongodb.collections["geo_bins"].find(
+            query,
+            {"_id": 0, "latitude": 1, "longitude": 1, "count": 1}
+        ).sort("count", -1).limit(limit).to_list(length=limit)
 
+    @staticmethod
+    async def get_rollup_series(
+        domain_name: str,
+        source_granularity: str,
+        start_date: datetime,
+        end_date: datetime,
+        unit: str,
+        timezone: str
+    ):
+        """
+        Sum the domain's `source_granularity` rollups in [start_date, end_date) into
+        `unit` buckets (hour, day, week or month) that start at local midnight in `timezone`.
+        """
+        truncate = {"date": "$bucket", "unit": unit, "timezone": timezone}
+        if unit == "week":
+            truncate["startOfWeek"] = "monday"
+        return await mongodb.collections["rollups"].aggregate([
+            {"$match": {
+                "domain_name": domain_name,
+                "granularity": source_granularity,
+                "bucket": {"$gte": start_date, "$lt": end_date}
+            }},
+            {"$group": {
+                "_id": {"$dateTrunc": truncate},
+                "visits": {"$sum": "$visits"},
+                "new_users": {"$sum": "$new_users"},
+                "bounces": {"$sum": "$bounces"},
+                "session_duration_sum": {"$sum": "$session_duration_sum"},
+                "page_views": {"$sum": "$page_views"}
+            }},
+            {"$sort": {"_id": 1}}
+        ]).to_list(length=None)
@@ -0,0 +1,32 @@
+from datetime import datetime
+from typing import List, Optional
+from pymongo import UpdateOne
+from app.config.db_config import mongodb
+
+
+class DomainChangeRepo:
+
+    @staticmethod
+    async def publish_changes(worker_id: str, domain_names: List[str]):
+        """Record that this worker ingested sessions for the domains, one document per (domain, worker)."""
+        if not domain_names:
+            return None
+        operations = [
+            UpdateOne(
+                {"_id": f"{domain_name}|{worker_id}"},
+                {"$set": {"domain_name": domain_name, "worker": worker_id}, "$currentDate": {"updated_at": True}},
+                upsert=True
+            )
+            for domain_name in domain_names
+        ]
+        return await mongodb.collections["domain_changes"].bulk_write(operations, ordered=False)
+
+    @staticmethod
+    async def find_changes_since(worker_id: str, since: Optional[datetime]) -> List[dict]:
+        """Changes published by other workers at or after `since` (server time), oldest first."""
+        query = {"worker": {"$ne": worker_id}}
+        if since is not None:
+            query["updated_at"] = {"$gte": since}
+        return await mongodb.collections["domain_changes"].find(
+            query, {"domain_name": 1, "updated_at": 1}
+        ).sort("updated_at", 1).to_list(length=None)
@@ -0,0 +1,89 @@
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+from app.config.db_config import mongodb
+from app.config.ingest_config import SESSION_CHECKPOINT_TTL
+
+# Every index the repos rely on, per collection. Creating an index that already exists
+# with the same keys and options is a no-op, so this is applied on every startup.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "session_data": [
+        # Dashboard range aggregations and the per-domain backfills
+        IndexModel([("domain_name", ASCENDING), ("session_start", ASCENDING), ("session_end", ASCENDING)]),
+        # UserRepo.find_session_by_user_id, optionally within a month
+        IndexModel([("user_id", ASCENDING), ("session_start", ASCENDING)]),
+    ],
+    "user": [
+        IndexModel([("domain_name", ASCENDING), ("session_count", DESCENDING)]),
+        IndexModel([("domain_name", ASCENDING), ("date_joined", ASCENDING)]),
+    ],
+    "admin": [
+        IndexModel([("username", ASCENDING)]),
+        IndexModel([("domain_name", ASCENDING)]),
+    ],
+    "counts": [
+        IndexModel([("domain_name", ASCENDING)]),
+    ],
+    "content": [
+        IndexModel([("domain_name", ASCENDING)]),
+    ],
+    "content_metrics": [
+        IndexModel([("domain_name", ASCENDING), ("type", ASCENDING), ("title", ASCENDING)], unique=True),
+        # DashboardRepo.get_content_page sorted by a stored counter (CONTENT_COUNTERS)
+        *[
+            IndexModel([("domain_name", ASCENDING), (counter, ASCENDING), ("type", ASCENDING), ("title", ASCENDING)])
+            for counter in ("views", "likes", "clicks", "cta_clicks", "subscribers")
+        ],
+    ],
+    "domain_users": [
+        IndexModel([("domain_name", ASCENDING), ("user_id", ASCENDING)], unique=True),
+    ],
+    "rollups": [
+        IndexModel([("domain_name", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)], unique=True),
+    ],
+    "geo_bins": [
+        IndexModel([("domain_name", ASCENDING), ("resolution", ASCENDING), ("latitude", ASCENDING), ("longitude", ASCENDING)], unique=True),
+        # Busiest cells of a resolution when no bounding box is given
+        IndexModel([("domain_name", ASCENDING), ("resolution", ASCENDING), ("count", DESCENDING)]),
+    ],
+    "referrer_counts": [
+        IndexModel([("domain_name", ASCENDING), ("utm_source", ASCENDING), ("utm_medium", ASCENDING), ("utm_campaign", ASCENDING)], unique=True),
+        # DashboardRepo.get_top_referrers
+        IndexModel([("domain_name", ASCENDING), ("count", DESCENDING)]),
+    ],
+    "domain_changes": [
+        # DomainChangeRepo.find_changes_since; a stopped worker's documents expire after a day
+        IndexModel([("updated_at", ASCENDING)], expireAfterSeconds=24 * 3600),
+    ],
+    "session_checkpoints": [
+        # Orphan sweeps; also expires checkpoints that never get replayed
+        IndexModel([("updated_at", ASCENDING)], expireAfterSeconds=SESSION_CHECKPOINT_TTL),
+    ],
+    "presence": [
+        IndexModel([("domain_name", ASCENDING), ("workers", ASCENDING)]),
+    ],
+    "presence_workers": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+
+async def ensure_indexes(unique: Optional[bool] = None) -> List[str]:
+    """
+    Create the registered indexes, only the unique or only the non-unique ones when
+    `unique` is given. A failing collection is logged and does not stop the others.
+    Returns the names of the collections whose indexes failed.
+    """
+    failed = []
+    for collection_name, indexes in INDEXES.items():
+        if unique is not None:
+            indexes = [index for index in indexes if index.document.get("unique", False) == unique]
+        if not indexes:
+            continue
+        try:
+            await mongodb.collections[collection_name].create_indexes(indexes)
+        except PyMongoError as e:
+            failed.append(collection_name)
+            print(f"Error creating indexes on {collection_name}: {e}")
+    print("Indexes ensured")
+    return failed
@@ -0,0 +1,324 @@
+from datetime import datetime
+from typing import Dict, Hashable, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from app.config.db_config import mongodb
+from app.config.ingest_config import CONTENT_METRICS_LAYOUT, STORE_SESSION_IDS
+
+DUPLICATE_KEY_ERROR = 11000
+# Write errors caused by the server's state rather than the operation itself: retrying the
+# operation can succeed. A duplicate key on an upsert is a lost race with a concurrent insert.
+RETRYABLE_WRITE_ERRORS = {
+    DUPLICATE_KEY_ERROR, 50, 91, 112, 189, 262, 6, 7, 89, 9001, 10107, 11600, 11602, 13435, 13436
+}
+
+
+class PartialWriteError(Exception):
+    """
+    Some operations of an unordered bulk write failed and the others were applied.
+    `failed` maps the key of each failed operation to its write error code, or None
+    when the code is unknown.
+    """
+
+    def __init__(self, failed: Dict[Hashable, Optional[int]], details: Optional[dict] = None):
+        self.failed = failed
+        self.details = details or {}
+        messages = [error.get("errmsg", "") for error in self.details.get("writeErrors", [])[:1]]
+        super().__init__(f"{len(failed)} operations failed" + (f": {messages[0]}" if messages else ""))
+
+
+async def bulk_write_keyed(collection_name: str, keys: list, operations: list, ignored_codes=()):
+    """
+    Unordered bulk write where operations[i] belongs to keys[i]. Write errors are raised
+    as a PartialWriteError naming the failed keys, so only those are retried. Write
+    concern errors leave every operation's outcome unknown and are raised as they are.
+    """
+    try:
+        return await mongodb.collections[collection_name].bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        if e.details.get("writeConcernErrors"):
+            raise
+        failed = {
+            keys[error["index"]]: error.get("code")
+            for error in e.details["writeErrors"]
+            if error.get("code") not in ignored_codes
+        }
+        if failed:
+            raise PartialWriteError(failed, e.details) from e
+        return None
+
+
+class IngestRepo:
+
+    @staticmethod
+    async def insert_sessions(documents: List[dict]):
+        """
+        Insert session documents. Their _id is assigned before the insert, so
+        documents already stored by an earlier attempt are skipped on retry.
+        Failures are keyed by the documents' _id.
+        """
+        if not documents:
+            return None
+        try:
+            return await mongodb.collections["session_data"].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            if e.details.get("writeConcernErrors"):
+                raise
+            failed = {
+                documents[error["index"]]["_id"]: error.get("code")
+                for error in e.details["writeErrors"]
+                if error.get("code") != DUPLICATE_KEY_ERROR
+            }
+            if failed:
+                raise PartialWriteError(failed, e.details) from e
+            return None
+
+    @staticmethod
+    async def upsert_user_sessions(domain_name: str, user_sessions: Dict[str, dict]):
+        """
+        Link new sessions to each user with a single upsert per user, creating the
+        user on first sight and maintaining session_count and last_seen.
+        Each entry carries `username`, `session_ids` and `last_seen`. Failures are keyed by user_id.
+        """
+        if not user_sessions:
+            return None
+        keys = []
+        operations = []
+        for user_id, entry in user_sessions.items():
+            if not ObjectId.is_valid(user_id):
+                print(f"Skipping sessions of invalid user_id: {user_id!r}")
+                continue
+            update_data = {
+                "$setOnInsert": {
+                    "username": entry["username"],
+                    "domain_name": domain_name,
+                    "date_joined": datetime.utcnow(),
+                },
+                "$inc": {"session_count": len(entry["session_ids"])},
+                "$max": {"last_seen": entry["last_seen"]},
+            }
+            if STORE_SESSION_IDS:
+                update_data["$push"] = {"session_ids": {"$each": entry["session_ids"]}}
+            keys.append(user_id)
+            operations.append(UpdateOne({"_id": ObjectId(user_id)}, update_data, upsert=True))
+        if not operations:
+            return None
+        return await bulk_write_keyed("user", keys, operations)
+
+    @staticmethod
+    async def inc_rollups(domain_name: str, rollups: Dict[datetime, Dict[str, float]]):
+        """
+        Apply increments to the domain's quarter-hour rollups, keyed by the start of the
+        UTC quarter hour, and to the hourly, daily and monthly rollups containing them.
+        """
+        return await IngestRepo.inc_rollup_buckets(domain_name, IngestRepo.rollup_buckets(rollups))
+
+    @staticmethod
+    def rollup_slot(moment: datetime) -> datetime:
+        """
+        Start of the UTC quarter hour containing `moment`. Quarter hours are the finest
+        rollups, so zones offset from UTC by 30 or 45 minutes can be bucketed exactly.
+        """
+        return moment.replace(minute=moment.minute - moment.minute % 15, second=0, microsecond=0)
+
+    @staticmethod
+    def rollup_buckets(rollups: Dict[datetime, Dict[str, float]]) -> Dict[Tuple[str, datetime], Dict[str, float]]:
+        """
+        Spread increments keyed by quarter hour (see rollup_slot) over the quarter-hour,
+        hour, day and month rollups, keyed by (granularity, bucket).
+        """
+        buckets: Dict[Tuple[str, datetime], Dict[str, float]] = {}
+        for slot, increments in rollups.items():
+            hour = slot.replace(minute=0)
+            day = hour.replace(hour=0)
+            for granularity, bucket in (
+                ("quarter_hour", slot), ("hour", hour), ("day", day), ("month", day.replace(day=1))
+            ):
+                merged = buckets.setdefault((granularity, bucket), {})
+                for field, value in increments.items():
+                    # Referrer counters are kept per day and month only
+                    if granularity in ("quarter_hour", "hour") and field.startswith("referrers."):
+                        continue
+                    merged[field] = merged.get(field, 0) + value
+        return buckets
+
+    @staticmethod
+    async def inc_rollup_buckets(domain_name: str, buckets: Dict[Tuple[str, datetime], Dict[str, float]]):
+        """Apply increments to rollups keyed by (granularity, bucket); failures are keyed the same way."""
+        keys = [key for key, increments in buckets.items() if increments]
+        operations = [
+            UpdateOne(
+                {"domain_name": domain_name, "granularity": granularity, "bucket": bucket},
+                {"$inc": buckets[(granularity, bucket)]},
+                upsert=True
+            )
+            for granularity, bucket in keys
+        ]
+        if not operations:
+            return None
+        return await bulk_write_keyed("rollups", keys, operations)
+
+    @staticmethod
+    async def inc_geo_bins(domain_name: str, geo_bins: Dict[Tuple[int, float, float], int]):
+        """Add session counts to heatmap cells keyed by (resolution, cell latitude, cell longitude)."""
+        operations = [
+            UpdateOne(
+                {"domain_name": domain_name, "resolution": resolution, "latitude": latitude, "longitude": longitude},
+                {"$inc": {"count": count}},
+                upsert=True
+            )
+            for (resolution, latitude, longitude), count in geo_bins.items()
+        ]
+        if not operations:
+            return None
+        return await bulk_write_keyed("geo_bins", list(geo_bins), operations)
+
+    @staticmethod
+    async def inc_referrer_counts(domain_name: str, referrers: Dict[Tuple[str, str, str], int]):
+        """Add session counts to the domain's referrers, one document per (utm_source, utm_medium, utm_campaign)."""
+        operations = [
+            UpdateOne(
+                {"domain_name": domain_name, "utm_source": utm_source, "utm_medium": utm_medium, "utm_campaign": utm_campaign},
+                {"$inc": {"count": count}},
+                upsert=True
+            )
+            for (utm_source, utm_medium, utm_campaign), count in referrers.items()
+        ]
+        if not operations:
+            return None
+        return await bulk_write_keyed("referrer_counts", list(referrers), operations)
+
+    @staticmethod
+    async def add_domain_users(domain_name: str, user_ids: List[str]):
+        """Register users as visitors of a domain; already registered users are left untouched."""
+        if not user_ids:
+            return None
+        keys = [user_id for user_id in user_ids if ObjectId.is_valid(user_id)]
+        operations = [
+            UpdateOne(
+                {"domain_name": domain_name, "user_id": ObjectId(user_id)},
+                {"$setOnInsert": {"first_seen": datetime.utcnow()}},
+                upsert=True
+            )
+            for user_id in keys
+        ]
+        if not operations:
+            return None
+        return await bulk_write_keyed("domain_users", keys, operations)
+
+    @staticmethod
+    async def inc_counts(counts_by_domain: Dict[str, Dict[str, float]]):
+        keys = [domain_name for domain_name, increments in counts_by_domain.items() if increments]
+        operations = [
+            UpdateOne({"domain_name": domain_name}, {"$inc": counts_by_domain[domain_name]}, upsert=True)
+            for domain_name in keys
+        ]
+        if not operations:
+            return None
+        return await bulk_write_keyed("counts", keys, operations)
+
+    @staticmethod
+    async def save_checkpoints(checkpoints: Dict[str, dict]):
+        """Replace the stored snapshot of each in-progress session, keyed by "<domain_name>:<user_id>"."""
+        if not checkpoints:
+            return None
+        operations = [
+            ReplaceOne({"_id": key}, {"data": data, "updated_at": datetime.utcnow()}, upsert=True)
+            for key, data in checkpoints.items()
+        ]
+        return await mongodb.collections["session_checkpoints"].bulk_write(operations, ordered=False)
+
+    @staticmethod
+    async def delete_checkpoint(key: str):
+        return await mongodb.collections["session_checkpoints"].delete_one({"_id": key})
+
+    @staticmethod
+    async def claim_checkpoint_before(updated_before: datetime):
+        """Atomically take one checkpoint last updated before `updated_before`, so only one worker replays it."""
+        return await mongodb.collections["session_checkpoints"].find_one_and_delete(
+            {"updated_at": {"$lt": updated_before}}
+        )
+
+    @staticmethod
+    async def apply_content_increments(domain_name: str, increments: Dict[Tuple[str, str], dict]):
+        """
+        Apply merged content metric increments, one entry per (type, title).
+        Each entry carries an `inc` map, a `child_buttons` map and an optional `referrer`.
+        Failures are keyed by (type, title).
+        """
+        if not increments:
+            return None
+        if CONTENT_METRICS_LAYOUT == "embedded":
+            return await IngestRepo.apply_embedded_content_increments(domain_name, increments)
+
+        keys = list(increments)
+        operations = []
+        for (metric_type, title), entry in increments.items():
+            inc = dict(entry["inc"])
+            for button_name, clicks in entry["child_buttons"].items():
+                inc[f"child_buttons.{button_name}"] = clicks
+
+            update_data = {"$inc": inc}
+            if metric_type != "BUTTON":
+                if entry.get("referrer"):
+                    update_data["$set"] = {"referrer": entry["referrer"]}
+                else:
+                    update_data["$setOnInsert"] = {"referrer": ""}
+
+            operations.append(UpdateOne(
+                {"domain_name": domain_name, "type": metric_type, "title": title},
+                update_data,
+                upsert=True
+            ))
+        return await bulk_write_keyed("content_metrics", keys, operations)
+
+    @staticmethod
+    async def apply_embedded_content_increments(domain_name: str, increments: Dict[Tuple[str, str], dict]):
+        """
+        Legacy layout: every metric lives in the `metrics` array of one document per domain.
+        Metrics are updated one by one; if one fails, it and the ones after it were not applied.
+        """
+        keys = list(increments)
+        for index, key in enumerate(keys):
+            try:
+                await IngestRepo.apply_embedded_content_increment(domain_name, key, increments[key])
+            except Exception as e:
+                raise PartialWriteError({failed_key: getattr(e, "code", None) for failed_key in keys[index:]}) from e
+
+    @staticmethod
+    async def apply_embedded_content_increment(domain_name: str, key: Tuple[str, str], entry: dict):
+        collection = mongodb.collections["content"]
+        metric_type, title = key
+        update_query = {
+            "domain_name": domain_name,
+            "metrics": {"$elemMatch": {"title": title, "type": metric_type}}
+        }
+        existing_doc = await collection.find_one(update_query)
+
+        if existing_doc:
+            update_data = {"$inc": {f"metrics.$.{field}": value for field, value in entry["inc"].items()}}
+            if metric_type != "BUTTON":
+                # Merge existing and new child_buttons
+                child_buttons = dict(entry["child_buttons"])
+                existing_child_buttons = next(
+                    (metric.get("child_buttons", {}) for metric in existing_doc.get("metrics", [])
+                    if metric["title"] == title and metric["type"] == metric_type),
+                    {}
+                )
+                for button_name, clicks in existing_child_buttons.items():
+                    child_buttons[button_name] = child_buttons.get(button_name, 0) + clicks
+                update_data["$set"] = {"metrics.$.child_buttons": child_buttons}
+                if entry.get("referrer"):
+                    update_data["$set"]["metrics.$.referrer"] = entry["referrer"]
+            await collection.update_one(update_query, update_data)
+        else:
+            metric = {"title": title, "type": metric_type, **entry["inc"]}
+            if metric_type != "BUTTON":
+                metric["referrer"] = entry.get("referrer") or ""
+                metric["child_buttons"] = dict(entry["child_buttons"])
+            await collection.update_one(
+                {"domain_name": domain_name},
+                {"$push": {"metrics": metric}},
+                upsert=True
+            )
@@ -0,0 +1,63 @@
+from datetime import datetime
+from typing import Dict, List, Tuple
+from pymongo import UpdateOne
+from app.config.db_config import mongodb
+
+
+class PresenceRepo:
+
+    @staticmethod
+    async def publish_events(worker_id: str, events: Dict[Tuple[str, str], bool]):
+        """Apply coalesced presence events: True adds this worker to the user's document, False removes it."""
+        if not events:
+            return None
+        operations = [
+            UpdateOne(
+                {"_id": f"{domain_name}:{user_id}"},
+                {"$addToSet": {"workers": worker_id}, "$set": {"domain_name": domain_name, "user_id": user_id}}
+                if connected else {"$pull": {"workers": worker_id}},
+                upsert=connected
+            )
+            for (domain_name, user_id), connected in events.items()
+        ]
+        return await mongodb.collections["presence"].bulk_write(operations, ordered=False)
+
+    @staticmethod
+    async def heartbeat(worker_id: str, expires_at: datetime):
+        return await mongodb.collections["presence_workers"].update_one(
+            {"_id": worker_id},
+            {"$set": {"expires_at": expires_at}},
+            upsert=True
+        )
+
+    @staticmethod
+    async def find_live_workers(now: datetime) -> List[str]:
+        workers = await mongodb.collections["presence_workers"].find(
+            {"expires_at": {"$gt": now}}, {"_id": 1}
+        ).to_list(length=None)
+        return [worker["_id"] for worker in workers]
+
+    @staticmethod
+    async def count_active_users(domain_name: str, live_workers: List[str]) -> int:
+        if not live_workers:
+            return 0
+        return await mongodb.collections["presence"].count_documents(
+            {"domain_name": domain_name, "workers": {"$in": live_workers}}
+        )
+
+    @staticmethod
+    async def remove_dead_workers(live_workers: List[str]):
+        """Drop entries of workers that stopped heart-beating, and documents nobody references."""
+        if not live_workers:
+            return
+        await mongodb.collections["presence"].update_many(
+            {"workers": {"$elemMatch": {"$nin": live_workers}}},
+            {"$pull": {"workers": {"$nin": live_workers}}}
+        )
+        await mongodb.collections["presence"].delete_many({"workers": {"$size": 0}})
+
+    @staticmethod
+    async def remove_worker(worker_id: str):
+        await mongodb.collections["presence"].update_many({"workers": worker_id}, {"$pull": {"workers": worker_id}})
+        await mongodb.collections["presence"].delete_many({"workers": {"$size": 0}})
+        await mongodb.collections["presence_workers"].delete_one({"_id": worker_id})
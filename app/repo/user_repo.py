@@ -12,38 +12,12 @@ class UserRepo:
         return result
     
     @staticmethod
-    async def find_users(domain_name: str):
-        pipeline = [
-            {
-                "$match": {
-                    "domain_name": domain_name  # Filter by the given domain_name
-                }
-            },
-            {
-                "$project": {
-                    "user_id": 1,
-                    "username": 1,
-                    "domain_name": 1,
-                    "session_count": {
-                        "$size": {
-                            "$ifNull": ["$session_ids", []]  # Handle users with no session_ids
-                        }
-                    }
-                }
-            },
-            {
-                "$sort": {
-                    "session_count": -1  # Sort in descending order of session_count
-                }
-            },
-            {
-                "$limit": 10  # Limit to top 10 users
-            }
-        ]
-
-        result = mongodb.collections["user"].aggregate(pipeline)
-        users = [user async for user in result]  # Convert the cursor to a list
-        return users
+    async def find_users(domain_name: str, limit: int = 10):
+        """Top users of a domain by session_count, served by the (domain_name, session_count) index."""
+        return await mongodb.collections["user"].find(
+            {"domain_name": domain_name},
+            {"user_id": 1, "username": 1, "domain_name": 1, "session_count": 1}
+        ).sort("session_count", DESCENDING).limit(limit).to_list(length=limit)
     
     @staticmethod
     async def find_session_by_user_id(user_id: str, year: Optional[int], month: Optional[int]):
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+from app.config.dashboard_config import (
+    DASHBOARD_CACHE_ENABLED, DASHBOARD_CACHE_MAX_ENTRIES, DASHBOARD_CACHE_STALENESS, DASHBOARD_CACHE_TTL
+)
+from app.utils.lru_cache import LRUCache
+
+
+class CacheEntry:
+    def __init__(self, value: Any, version: int):
+        self.value = value
+        self.version = version
+        self.computed_at = time.monotonic()
+
+
+class DashboardCache:
+    """
+    Caches dashboard pages per (domain_name, page_name, options).
+
+    Every ingest write bumps the domain's version. An entry is served while it
+    is younger than `ttl` and either its domain has not changed since it was
+    computed, or it is still within the page's staleness bound. Concurrent
+    misses for the same key share one computation.
+
+    With `track_changes` on, the domains changed by this process are collected
+    in `changes` for the domain change feed to share with the other workers.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, staleness: Dict[str, float], enabled: bool = True):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.staleness = dict(staleness)
+        self.entries = LRUCache(max_entries)
+        self.versions: Dict[str, int] = {}
+        self.track_changes = False
+        self.changes: Set[str] = set()
+        self._inflight: Dict[Tuple[str, str, Hashable], asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def invalidate(self, domain_name: str, local: bool = True):
+        """Bump the domain's version; `local` is False for changes reported by other workers."""
+        self.versions[domain_name] = self.versions.get(domain_name, 0) + 1
+        if local and self.track_changes:
+            self.changes.add(domain_name)
+
+    def take_changes(self) -> Set[str]:
+        changes, self.changes = self.changes, set()
+        return changes
+
+    def set_staleness(self, page_name: str, seconds: float):
+        self.staleness[page_name] = seconds
+
+    def is_fresh(self, domain_name: str, page_name: str, entry: CacheEntry) -> bool:
+        age = time.monotonic() - entry.computed_at
+        if age >= self.ttl:
+            return False
+        if entry.version == self.versions.get(domain_name, 0):
+            return True
+        return age < self.staleness.get(page_name, 0)
+
+    async def get_or_compute(self, domain_name: str, page_name: str, compute: Callable[[], Awaitable[Any]], options: Hashable = ()) -> Any:
+        if not self.enabled:
+            return await compute()
+
+        key = (domain_name, page_name, options)
+        entry: Optional[CacheEntry] = self.entries.get(key)
+        if entry is not None and self.is_fresh(domain_name, page_name, entry):
+            self.hits += 1
+            return entry.value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.create_task(self._compute(key, compute))
+            self._inflight[key] = task
+        # Shielded so a caller that goes away does not cancel the shared computation
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: Tuple[str, str, Hashable], compute: Callable[[], Awaitable[Any]]) -> Any:
+        # Taken before computing: a write that lands meanwhile leaves the entry already outdated
+        version = self.versions.get(key[0], 0)
+        try:
+            value = await compute()
+            self.entries.put(key, CacheEntry(value, version))
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "ttl": self.ttl,
+            "staleness": dict(self.staleness),
+        }
+
+
+dashboard_cache = DashboardCache(DASHBOARD_CACHE_MAX_ENTRIES, DASHBOARD_CACHE_TTL, DASHBOARD_CACHE_STALENESS, DASHBOARD_CACHE_ENABLED)
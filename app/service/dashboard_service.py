@@ -1,25 +1,72 @@
 import asyncio
-from typing import Dict
+import base64
+import json
+from typing import Dict, List, Optional, Tuple
 from fastapi import HTTPException
+from app.config.dashboard_config import (
+    CONTENT_PAGE_DEFAULT_LIMIT, CONTENT_PAGE_MAX_LIMIT, GEO_HEATMAP_DEFAULT_RESOLUTION, GEO_HEATMAP_MAX_CELLS,
+    REFERRER_TOP_N, TIMESERIES_MAX_POINTS
+)
+from app.config.ingest_config import GEO_BIN_SIZES
 from app.model.content_model import Content
 from app.repo.admin_repo import AdminRepo
 from app.repo.dashboard_repo import DashboardRepo
-from datetime import datetime, timedelta
-from app.utils.shared_state import active_connections
-from collections import Counter, defaultdict
+from app.repo.ingest_repo import IngestRepo
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from app.service.dashboard_cache import dashboard_cache
+from app.service.presence_service import presence
+from app.utils.counter_keys import decode_field_names
+from collections import defaultdict
+
+# Nominal length of each time-series granularity, used to bound the number of points
+TIMESERIES_STEPS = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "month": timedelta(days=30),
+}
+# CONTENT page sort keys: stored counters and per-view averages/rates
+CONTENT_SORT_KEYS = (
+    "views", "likes", "cta_clicks", "subscribers", "clicks",
+    "avg_watch_time", "avg_completion_rate", "avg_scroll_depth", "subscription_rate", "like_rate"
+)
+CONTENT_TYPES = ("VIDEO", "CONTENT", "BUTTON")
+# Length of the finest stored rollups; every current zone's offset is a multiple of it
+QUARTER_HOUR = timedelta(minutes=15)
+UTC_ZONES = {"UTC", "Etc/UTC", "Etc/GMT", "GMT", "Etc/Universal", "Universal", "Zulu", "Etc/Zulu"}
 
 class DashboardService:
     @staticmethod
-    async def get_dashboard_data(page_name: str, admin_id: str):
+    async def get_dashboard_data(
+        page_name: str,
+        admin_id: str,
+        resolution: int = GEO_HEATMAP_DEFAULT_RESOLUTION,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+        sort: str = "views",
+        order: str = "desc",
+        metric_type: Optional[str] = None,
+        limit: int = CONTENT_PAGE_DEFAULT_LIMIT,
+        cursor: Optional[str] = None
+    ):
+        # Each page with the options it takes; the options are part of the cache key
+        pages = {
+            "MAIN": (DashboardService.get_main_data, {}),
+            "DEVICE_STATS": (DashboardService.get_device_stats_data, {"resolution": resolution, "bbox": bbox}),
+            "CONTENT": (DashboardService.get_content_metrics_data, {
+                "sort": sort, "order": order, "metric_type": metric_type, "limit": limit, "cursor": cursor
+            }),
+        }
+        if page_name not in pages:
+            return None
+        loader, options = pages[page_name]
+        domain_name = await DashboardService.get_domain_name(admin_id)
+        data = await dashboard_cache.get_or_compute(
+            domain_name, page_name, lambda: loader(admin_id, **options), tuple(options.items())
+        )
         if page_name == "MAIN":
-            result = await DashboardService.get_main_data(admin_id)
-            return result
-        elif page_name == "DEVICE_STATS":
-            result = await DashboardService.get_device_stats_data(admin_id)
-            return result
-        elif page_name == "CONTENT":
-            result = await DashboardService.get_content_metrics_data(admin_id)
-            return result
+            data = await DashboardService.with_active_users(domain_name, data)
+        return data
 
     ####### HELPER METHODS #############
     @staticmethod
@@ -27,108 +74,105 @@ class DashboardService:
         # Fetch domain name
         domain_name = await DashboardService.get_domain_name(admin_id)
 
-        # Use asyncio.gather to fetch data concurrently
-        total_visitors, total_visits, average_session_time, page_view_analysis, bounce_count, total_visits_change_rate, avg_session_time_change_rate, user_joined_change_rate, bounce_counts_per_page = await asyncio.gather(
-            DashboardRepo.get_total_visitors(domain_name),
-            DashboardRepo.get_total_visits(domain_name),
-            DashboardService.get_avg_session_time(domain_name),
-            DashboardRepo.get_page_view_analysis(domain_name),
-            DashboardRepo.get_bounce_count(domain_name),
-            DashboardService.get_total_visits_change_rate(domain_name),
-            DashboardService.get_avg_session_time_change_rate(domain_name),
-            DashboardService.get_user_joined_change_rate(domain_name),
-            DashboardRepo.get_bounce_counts_per_page(domain_name)
-        )
+        # One consolidated counts/rollups read
+        counts_data = await DashboardRepo.get_main_counts(domain_name) or {}
+        average_session_time = await DashboardService.get_avg_session_time(domain_name, counts_data)
 
-        # Fetch active users for the domain
-        active_users_count = len(active_connections.get(domain_name, []))
+        # Totals and month-over-month rates all come from the monthly rollups
+        monthly_rollups = counts_data.get("monthly_rollups", [])
+        total_visits = sum(rollup.get("visits", 0) for rollup in monthly_rollups)
+        total_visitors = sum(rollup.get("new_users", 0) for rollup in monthly_rollups)
+        this_month, last_month = DashboardService.get_current_and_last_month_rollups(monthly_rollups)
+        total_visits_change_rate = DashboardService.get_total_visits_change_rate(this_month, last_month)
+        avg_session_time_change_rate = DashboardService.get_avg_session_time_change_rate(this_month, last_month)
+        user_joined_change_rate = DashboardService.get_user_joined_change_rate(this_month, last_month)
 
         # Calculate bounce rate
-        if bounce_count:
-            bounce_rate = (bounce_count["bounce_counts"] / total_visits) * 100 if total_visits else 0  # Avoid division by zero
-        else:
-            bounce_rate = 0
+        bounce_rate = (counts_data.get("bounce_counts", 0) / total_visits) * 100 if total_visits else 0  # Avoid division by zero
 
         # Return data in a structured dictionary
         return {
             "total_visits": total_visits,
             "total_visitors": total_visitors,
             "avg_session_time": average_session_time,
-            "page_view_analysis": page_view_analysis["page_counts"],
+            "page_view_analysis": decode_field_names(counts_data.get("page_counts", {})),
             "bounce_rate": bounce_rate,
-            "bounce_counts_per_page": bounce_counts_per_page["bounce_counts_per_page"],
+            "bounce_counts_per_page": decode_field_names(counts_data.get("bounce_counts_per_page", {})),
             "total_visits_change_rate": total_visits_change_rate,
             "avg_session_time_change_rate": avg_session_time_change_rate,
-            "total_visitors_change_rate": user_joined_change_rate,
-            "total_active_users": active_users_count
+            "total_visitors_change_rate": user_joined_change_rate
         }
+
+    @staticmethod
+    async def with_active_users(domain_name: str, main_data: dict) -> dict:
+        """
+        Add the live active user count to MAIN data. Presence changes with every connection,
+        so it is read on each request instead of being cached with the rest of the page.
+        """
+        # Aggregated across workers with the mongo backend
+        return {**main_data, "total_active_users": await presence.active_users(domain_name)}
     
     @staticmethod
-    async def get_device_stats_data(admin_id: str):
+    async def get_device_stats_data(
+        admin_id: str,
+        resolution: int = GEO_HEATMAP_DEFAULT_RESOLUTION,
+        bbox: Optional[Tuple[float, float, float, float]] = None
+    ):
         domain_name = await DashboardService.get_domain_name(admin_id)
-        
-        counts_data = await DashboardRepo.get_count_data(domain_name)
-        
-        location_and_referrer_data = await DashboardRepo.get_location_and_referrer_data(domain_name)
-        
-        # Extract locations and referrers
-        locations = [item.get("location") for item in location_and_referrer_data if "location" in item]
-        referrers = [
-            (
-                referrer.get("utm_source"), 
-                referrer.get("utm_medium"), 
-                referrer.get("utm_campaign")
-            )
-            for item in location_and_referrer_data if "referrer" in item
-            for referrer in [item.get("referrer")]
-            if referrer and all(field is not None for field in (referrer.get("utm_source"), referrer.get("utm_medium"), referrer.get("utm_campaign")))
-        ]
-        
-        # Count referrers grouped by (utm_source, utm_medium, utm_campaign)
-        referrer_counts = Counter(referrers)
-        
-        # Format the results as a list of dictionaries for easier consumption
-        formatted_referrer_counts = [
-            {
-                "utm_source": key[0],
-                "utm_medium": key[1],
-                "utm_campaign": key[2],
-                "count": count
-            }
-            for key, count in referrer_counts.items()
-        ]
-        
+        if not 0 <= resolution < len(GEO_BIN_SIZES):
+            raise HTTPException(status_code=400, detail=f"resolution must be between 0 and {len(GEO_BIN_SIZES) - 1}")
+
+        # Referrers are counted per (utm_source, utm_medium, utm_campaign) at ingest
+        counts_data, heatmap, top_referrers = await asyncio.gather(
+            DashboardRepo.get_count_data(domain_name),
+            DashboardRepo.get_geo_heatmap(domain_name, resolution, bbox, GEO_HEATMAP_MAX_CELLS),
+            DashboardRepo.get_top_referrers(domain_name, REFERRER_TOP_N)
+        )
+        counts_data = counts_data or {}
+
         return {
-            "os_counts": counts_data.get("os_counts", {}),
-            "browser_counts": counts_data.get("browser_counts", {}),
-            "device_counts": counts_data.get("device_counts", {}),
-            "location_data": locations,
-            "referrers": formatted_referrer_counts  # List of dictionaries with counts
+            "os_counts": decode_field_names(counts_data.get("os_counts", {})),
+            "browser_counts": decode_field_names(counts_data.get("browser_counts", {})),
+            "device_counts": decode_field_names(counts_data.get("device_counts", {})),
+            "location_data": heatmap,  # Heatmap cells: cell center latitude/longitude and session count
+            "location_cell_size": GEO_BIN_SIZES[resolution],  # Degrees
+            "referrers": top_referrers  # List of dictionaries with counts, busiest first
         }
 
 
     @staticmethod
-    async def get_content_metrics_data(admin_id: str) -> Dict:
+    async def get_content_metrics_data(
+        admin_id: str,
+        sort: str = "views",
+        order: str = "desc",
+        metric_type: Optional[str] = None,
+        limit: int = CONTENT_PAGE_DEFAULT_LIMIT,
+        cursor: Optional[str] = None
+    ) -> Dict:
         # Get the domain name using the admin_id
         domain_name = await DashboardService.get_domain_name(admin_id)
 
-        # Fetch the content data as a dictionary
-        content_data = await DashboardRepo.get_content_data(domain_name)
+        if sort not in CONTENT_SORT_KEYS:
+            raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(CONTENT_SORT_KEYS)}")
+        if order not in ("asc", "desc"):
+            raise HTTPException(status_code=400, detail="order must be asc or desc")
+        if metric_type is not None and metric_type not in CONTENT_TYPES:
+            raise HTTPException(status_code=400, detail=f"type must be one of: {', '.join(CONTENT_TYPES)}")
+        limit = max(1, min(limit, CONTENT_PAGE_MAX_LIMIT))
 
-        if not content_data or not content_data.get("metrics"):
-            return {
-                "video_metrics": {},
-                "content_metrics": {},
-                "button_clicks": {}
-            }
+        # Fetch one more row than requested to know whether there is a next page
+        metrics = await DashboardRepo.get_content_page(
+            domain_name, metric_type, sort, order == "desc", limit + 1, DashboardService.decode_content_cursor(cursor)
+        )
+        has_more = len(metrics) > limit
+        metrics = metrics[:limit]
 
-        # Initialize data structures for metrics
-        video_metrics = defaultdict(dict)
-        content_metrics = defaultdict(dict)
+        # Initialize data structures for metrics; each keeps the requested order
+        video_metrics = {}
+        content_metrics = {}
         button_clicks = defaultdict(int)
 
-        # Process the metrics from the content data
-        metrics = content_data["metrics"]
+        # Process the metrics from the content data; averages and rates come from the pipeline
         for metric in metrics:
             if metric["type"] == "VIDEO":
                 video_metrics[metric["title"]] = {
@@ -136,11 +180,11 @@ class DashboardService:
                     "likes": metric.get("likes", 0),
                     "cta_clicks": metric.get("cta_clicks", 0),
                     "subscribers": metric.get("subscribers", 0),
-                    "child_buttons": metric.get("child_buttons",{}),
-                    "avg_watch_time": (metric.get("sum_watch_time", 0) / metric["views"]) if metric.get("views") else 0,
-                    "avg_completion_rate": (metric.get("sum_completion_rate", 0) / metric["views"]) if metric.get("views") else 0,
-                    "subscription_rate": (metric.get("subscribers", 0) / metric["views"]) if metric.get("views") else 0,
-                    "like_rate": (metric.get("likes", 0) / metric["views"]) if metric.get("views") else 0
+                    "child_buttons": decode_field_names(metric.get("child_buttons", {})),
+                    "avg_watch_time": metric["avg_watch_time"],
+                    "avg_completion_rate": metric["avg_completion_rate"],
+                    "subscription_rate": metric["subscription_rate"],
+                    "like_rate": metric["like_rate"]
                 }
             elif metric["type"] == "CONTENT":
                 content_metrics[metric["title"]] = {
@@ -148,25 +192,127 @@ class DashboardService:
                     "likes": metric.get("likes", 0),
                     "cta_clicks": metric.get("cta_clicks", 0),
                     "subscribers": metric.get("subscribers", 0),
-                    "child_buttons": metric.get("child_buttons",{}),
-                    "avg_scroll_depth": (metric.get("sum_scroll_depth", 0) / metric["views"]) if metric.get("views") else 0,
-                    "avg_watch_time": (metric.get("sum_watch_time", 0) / metric["views"]) if metric.get("views") else 0,
-                    "avg_completion_rate": (metric.get("sum_completion_rate", 0) / metric["views"]) if metric.get("views") else 0,
-                    "subscription_rate": (metric.get("subscribers", 0) / metric["views"]) if metric.get("views") else 0,
-                    "like_rate": (metric.get("likes", 0) / metric["views"]) if metric.get("views") else 0
+                    "child_buttons": decode_field_names(metric.get("child_buttons", {})),
+                    "avg_scroll_depth": metric["avg_scroll_depth"],
+                    "avg_watch_time": metric["avg_watch_time"],
+                    "avg_completion_rate": metric["avg_completion_rate"],
+                    "subscription_rate": metric["subscription_rate"],
+                    "like_rate": metric["like_rate"]
                 }
             elif metric["type"] == "BUTTON":
                 button_clicks[metric["title"]] += metric.get("clicks", 0)
 
         # Return structured metrics
         return {
-            "video_metrics": dict(video_metrics),
-            "content_metrics": dict(content_metrics),
-            "button_clicks": dict(button_clicks)
+            "video_metrics": video_metrics,
+            "content_metrics": content_metrics,
+            "button_clicks": dict(button_clicks),
+            "next_cursor": DashboardService.encode_content_cursor(metrics[-1]) if has_more else None
         }
 
+    @staticmethod
+    def encode_content_cursor(metric: dict) -> str:
+        position = [metric.get("sort_value"), metric["type"], metric["title"]]
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    @staticmethod
+    def decode_content_cursor(cursor: Optional[str]) -> Optional[Tuple[float, str, str]]:
+        if not cursor:
+            return None
+        try:
+            value, metric_type, title = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return value, metric_type, title
+
+    @staticmethod
+    async def get_time_series(admin_id: str, start_date: datetime, end_date: datetime, granularity: str, timezone_name: str):
+        """
+        Visits, first-time visitors, bounces, average session time and page views per
+        `granularity` bucket in [start_date, end_date), with buckets starting at local
+        midnight in `timezone_name`. Naive dates are read in that timezone.
+        """
+        if granularity not in TIMESERIES_STEPS:
+            raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(TIMESERIES_STEPS)}")
+        try:
+            zone = ZoneInfo(timezone_name)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Unknown timezone: {timezone_name}")
+
+        start_utc = DashboardService.to_naive_utc(start_date, zone)
+        end_utc = DashboardService.to_naive_utc(end_date, zone)
+        if end_utc <= start_utc:
+            raise HTTPException(status_code=400, detail="end must be after start")
+        # The finest stored rollups are UTC quarter hours: a partial quarter hour or a local
+        # bucket boundary inside one cannot be answered exactly
+        if any(value != IngestRepo.rollup_slot(value) for value in (start_utc, end_utc)):
+            raise HTTPException(status_code=400, detail="start and end must fall on a quarter hour")
+        if not DashboardService.has_offsets_in_steps(start_utc, end_utc, zone, QUARTER_HOUR):
+            raise HTTPException(
+                status_code=400,
+                detail=f"{zone.key} is not a whole number of quarter hours from UTC within the range; rollups cannot be split into its buckets"
+            )
+        if (end_utc - start_utc) / TIMESERIES_STEPS[granularity] > TIMESERIES_MAX_POINTS:
+            raise HTTPException(status_code=400, detail=f"Range exceeds {TIMESERIES_MAX_POINTS} {granularity} points")
+
+        domain_name = await DashboardService.get_domain_name(admin_id)
+        return await dashboard_cache.get_or_compute(
+            domain_name,
+            "TIMESERIES",
+            lambda: DashboardService.get_time_series_points(domain_name, start_utc, end_utc, granularity, zone),
+            (start_utc, end_utc, granularity, timezone_name)
+        )
+
+    @staticmethod
+    async def get_time_series_points(domain_name: str, start_utc: datetime, end_utc: datetime, granularity: str, zone: ZoneInfo):
+        source_granularity = DashboardService.get_source_granularity(start_utc, end_utc, granularity, zone)
+        rows = await DashboardRepo.get_rollup_series(domain_name, source_granularity, start_utc, end_utc, granularity, zone.key)
+
+        points = []
+        for row in rows:
+            visits = row.get("visits", 0)
+            points.append({
+                "start": row["_id"].replace(tzinfo=timezone.utc).astimezone(zone).isoformat(),
+                "visits": visits,
+                "visitors": row.get("new_users", 0),  # First-time visitors, as total_visitors on MAIN
+                "bounces": row.get("bounces", 0),
+                "avg_session_time": row.get("session_duration_sum", 0) / visits if visits else 0,  # Seconds
+                "page_views": row.get("page_views", 0)
+            })
+        return {"granularity": granularity, "timezone": zone.key, "points": points}
+
+    @staticmethod
+    def get_source_granularity(start_utc: datetime, end_utc: datetime, granularity: str, zone: ZoneInfo) -> str:
+        """The coarsest stored rollups that add up exactly to the requested buckets and range."""
+        if start_utc.minute or end_utc.minute or not DashboardService.has_offsets_in_steps(start_utc, end_utc, zone, timedelta(hours=1)):
+            return "quarter_hour"  # e.g. Asia/Kathmandu (+05:45): local hours start inside UTC hours
+        if zone.key not in UTC_ZONES:
+            return "hour"  # Local days do not line up with UTC day buckets
+        start_of_day = start_utc.replace(hour=0, minute=0, second=0, microsecond=0)
+        end_of_day = end_utc.replace(hour=0, minute=0, second=0, microsecond=0)
+        if granularity == "hour" or start_utc != start_of_day or end_utc != end_of_day:
+            return "hour"
+        if granularity == "month" and start_utc.day == 1 and end_utc.day == 1:
+            return "month"
+        return "day"
+
+    @staticmethod
+    def has_offsets_in_steps(start_utc: datetime, end_utc: datetime, zone: ZoneInfo, step: timedelta) -> bool:
+        """Whether the zone's UTC offset stays a whole number of `step`s in [start_utc, end_utc], checked daily."""
+        moment = start_utc
+        while True:
+            if moment.replace(tzinfo=timezone.utc).astimezone(zone).utcoffset() % step:
+                return False
+            if moment >= end_utc:
+                return True
+            moment = min(moment + timedelta(days=1), end_utc)
+
+    @staticmethod
+    def to_naive_utc(value: datetime, zone: ZoneInfo) -> datetime:
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=zone)
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
 
-    
     @staticmethod
     async def get_domain_name(admin_id: str):
         admin_data = await AdminRepo.find_admin_by_id(admin_id)
@@ -178,15 +324,15 @@ class DashboardService:
 
 
     @staticmethod
-    async def get_avg_session_time(domain_name: str):
-        session_data = await DashboardRepo.get_session_data(domain_name)
-        total_duration = sum(
-            (session["session_end"] - session["session_start"]).total_seconds()
-            for session in session_data
-        )
+    async def get_avg_session_time(domain_name: str, totals: dict):
+        """Average session time from the running totals of the counts document."""
+        if "session_count" not in totals:
+            # Counts written before the running sums existed: aggregate once in Mongo
+            totals = await DashboardRepo.get_session_duration_stats(domain_name)
 
-        if len(session_data) > 0:
-            average_duration = total_duration / len(session_data)
+        session_count = totals.get("session_count", 0)
+        if session_count > 0:
+            average_duration = totals.get("session_duration_sum", 0) / session_count
             avg_minutes, avg_seconds = divmod(average_duration, 60)
             avg_hours, avg_minutes = divmod(avg_minutes, 60)
             return f"{int(avg_hours)} hours, {int(avg_minutes)} minutes, {int(avg_seconds)} seconds"
@@ -194,57 +340,39 @@ class DashboardService:
             return "No Session Data Available"
 
     @staticmethod
-    async def get_total_visits_change_rate(domain_name: str):
-        now, start_of_this_month, start_of_last_month, end_of_last_month = DashboardService.get_month_range()
-
-        # Get current and last month's total visits
-        current_month_visits = await DashboardRepo.get_total_visits_in_range(start_of_this_month, now, domain_name)
-        last_month_visits = await DashboardRepo.get_total_visits_in_range(start_of_last_month, end_of_last_month, domain_name)
+    def get_current_and_last_month_rollups(monthly_rollups: List[dict]):
+        _, start_of_this_month, start_of_last_month, _ = DashboardService.get_month_range()
+        by_month = {rollup["bucket"]: rollup for rollup in monthly_rollups}
+        return by_month.get(start_of_this_month, {}), by_month.get(start_of_last_month, {})
 
-        if last_month_visits == 0:
-            return 0
-        change_rate = ((current_month_visits - last_month_visits) / last_month_visits) * 100
-        return change_rate
-    
     @staticmethod
-    async def get_user_joined_change_rate(domain_name: str):
-        now, start_of_this_month, start_of_last_month, end_of_last_month = DashboardService.get_month_range()
-
-        # Fetch current and previous month user join counts
-        users_joined_this_month = await DashboardRepo.get_users_joined_in_range(start_of_this_month, now, domain_name)
-        users_joined_last_month = await DashboardRepo.get_users_joined_in_range(start_of_last_month, end_of_last_month, domain_name)
-
-        if users_joined_last_month == 0:
+    def get_change_rate(current: float, last: float):
+        if last == 0:
             return 0
-        change_rate = ((users_joined_this_month - users_joined_last_month) / users_joined_last_month) * 100
-        return change_rate
+        return ((current - last) / last) * 100
 
     @staticmethod
-    async def get_avg_session_time_change_rate(domain_name: str):
-        now, start_of_this_month, start_of_last_month, end_of_last_month = DashboardService.get_month_range()
+    def get_total_visits_change_rate(this_month: dict, last_month: dict):
+        return DashboardService.get_change_rate(this_month.get("visits", 0), last_month.get("visits", 0))
 
-        # Get average session time for current and last month
-        current_avg_time = await DashboardService.get_avg_session_time_in_range(start_of_this_month, now, domain_name)
-        last_avg_time = await DashboardService.get_avg_session_time_in_range(start_of_last_month, end_of_last_month, domain_name)
-
-        if last_avg_time == 0:
-            return 0
-        change_rate = ((current_avg_time - last_avg_time) / last_avg_time) * 100
-        return change_rate
+    @staticmethod
+    def get_user_joined_change_rate(this_month: dict, last_month: dict):
+        return DashboardService.get_change_rate(this_month.get("new_users", 0), last_month.get("new_users", 0))
 
     @staticmethod
-    async def get_avg_session_time_in_range(start_date, end_date, domain_name):
-        session_data = await DashboardRepo.get_session_data_in_range(start_date, end_date, domain_name)
-        total_duration = sum(
-            (session["session_end"] - session["session_start"]).total_seconds()
-            for session in session_data
+    def get_avg_session_time_change_rate(this_month: dict, last_month: dict):
+        return DashboardService.get_change_rate(
+            DashboardService.get_avg_session_time_of_rollup(this_month),
+            DashboardService.get_avg_session_time_of_rollup(last_month)
         )
 
-        if len(session_data) > 0:
-            return total_duration / len(session_data)
+    @staticmethod
+    def get_avg_session_time_of_rollup(rollup: dict):
+        if rollup.get("visits", 0) > 0:
+            return rollup.get("session_duration_sum", 0) / rollup["visits"]
         else:
             return 0
-        
+
     @staticmethod
     def get_month_range():
         now = datetime.utcnow()
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from app.config.ingest_config import PRESENCE_HEARTBEAT_INTERVAL
+from app.repo.domain_change_repo import DomainChangeRepo
+from app.service.dashboard_cache import dashboard_cache
+from app.service.live_dashboard_service import live_dashboard
+
+
+class DomainChangeFeed:
+    """
+    Tells every worker about the domains the other workers ingested sessions for.
+
+    The dashboard cache and the live dashboard hub only see the writes of their
+    own process. Once per `interval` this worker publishes the domains its
+    ingest changed and reads back the ones other workers changed, which are
+    then invalidated in the local cache and get a fresh snapshot on the live
+    dashboard. Cross-worker staleness is therefore bounded by about two
+    intervals instead of the cache TTL.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._since: Optional[datetime] = None
+        self._seen: Dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            dashboard_cache.track_changes = True
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        dashboard_cache.track_changes = False
+
+    async def sync(self):
+        changed = dashboard_cache.take_changes()
+        try:
+            await DomainChangeRepo.publish_changes(self.worker_id, sorted(changed))
+        except Exception as e:
+            dashboard_cache.changes.update(changed)
+            print(f"Error publishing domain changes for worker {self.worker_id}: {e}")
+
+        changes = await DomainChangeRepo.find_changes_since(self.worker_id, self._since)
+        for change in changes:
+            # Re-read with an overlap below, so skip the changes already applied
+            if self._seen.get(change["_id"]) == change["updated_at"]:
+                continue
+            self._seen[change["_id"]] = change["updated_at"]
+            dashboard_cache.invalidate(change["domain_name"], local=False)
+            live_dashboard.refresh(change["domain_name"])
+        if changes:
+            # Writes stamped just before the newest one we read may commit after it
+            self._since = changes[-1]["updated_at"] - timedelta(seconds=self.interval)
+            self._seen = {key: updated_at for key, updated_at in self._seen.items() if updated_at >= self._since}
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"Error reading domain changes: {e}")
+            await asyncio.sleep(self.interval)
+
+
+domain_change_feed = DomainChangeFeed(PRESENCE_HEARTBEAT_INTERVAL)
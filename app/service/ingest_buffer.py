@@ -0,0 +1,441 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+from bson import ObjectId
+from app.config.ingest_config import (
+    INGEST_BATCH_FLUSH_INTERVAL, INGEST_BATCH_MAX_ATTEMPTS, INGEST_BATCH_MAX_PENDING, INGEST_BATCH_MAX_SESSIONS,
+    INGEST_DEAD_LETTER_PATH
+)
+from app.repo.ingest_repo import RETRYABLE_WRITE_ERRORS, IngestRepo, PartialWriteError
+from app.service.dashboard_cache import dashboard_cache
+from app.utils.dead_letter import DeadLetterFile
+from app.utils.shared_state import registered_domain_users
+
+
+def _merge_increments(merged: Optional[dict], increments: dict) -> dict:
+    if merged is None:
+        return dict(increments)
+    for field, value in increments.items():
+        merged[field] = merged.get(field, 0) + value
+    return merged
+
+
+def _merge_count(merged: Optional[int], count: int) -> int:
+    return (merged or 0) + count
+
+
+def _merge_user(merged: Optional[dict], entry: dict) -> dict:
+    if merged is None:
+        return {"username": entry["username"], "session_ids": list(entry["session_ids"]), "last_seen": entry["last_seen"]}
+    merged["session_ids"].extend(entry["session_ids"])
+    merged["last_seen"] = max(merged["last_seen"], entry["last_seen"])
+    return merged
+
+
+def _merge_content(merged: Optional[dict], entry: dict) -> dict:
+    if merged is None:
+        merged = {"inc": {}, "child_buttons": {}, "referrer": None}
+    _merge_increments(merged["inc"], entry["inc"])
+    _merge_increments(merged["child_buttons"], entry["child_buttons"])
+    if entry.get("referrer"):
+        merged["referrer"] = entry["referrer"]
+    return merged
+
+
+def _keep(merged, value):
+    return value
+
+
+class DomainBatch:
+    """
+    Pending writes for one domain, merged across many sessions.
+
+    Every component is written by its own bulk write in write_batches, with one
+    operation per key of `writes[component]`. For each (component, key) the
+    batch remembers which sessions contributed, so an operation that fails for
+    good can be traced back to the sessions behind it. A session's optional
+    `on_written` callback runs once none of its writes are pending any more:
+    they were all applied, or what failed was dead-lettered.
+    """
+
+    COMPONENTS = (
+        "session_data", "counts", "user", "new_users", "rollups", "admin_user_list", "content_metrics", "geo_bins",
+        "referrer_counts"
+    )
+    MERGE = {
+        "session_data": _keep,  # keyed by session _id
+        "counts": _merge_increments,  # keyed by domain_name
+        "user": _merge_user,  # keyed by user_id
+        "new_users": _merge_increments,  # keyed by (granularity, bucket), added once the user upsert reports them
+        "rollups": _merge_increments,  # keyed by (granularity, bucket)
+        "admin_user_list": _keep,  # keyed by user_id
+        "content_metrics": _merge_content,  # keyed by (type, title)
+        "geo_bins": _merge_count,  # keyed by (resolution, latitude, longitude)
+        "referrer_counts": _merge_count,  # keyed by (utm_source, utm_medium, utm_campaign)
+    }
+
+    def __init__(self, domain_name: str):
+        self.domain_name = domain_name
+        self.attempts = 0
+        self.writes: Dict[str, Dict[Hashable, Any]] = {component: {} for component in DomainBatch.COMPONENTS}
+        self.sources: Dict[Tuple[str, Hashable], List[ObjectId]] = {}
+        self.documents: Dict[ObjectId, dict] = {}
+        self.callbacks: Dict[ObjectId, Callable[[], None]] = {}
+
+    @property
+    def components(self) -> List[str]:
+        """Components with writes pending."""
+        return [component for component in DomainBatch.COMPONENTS if self.writes[component]]
+
+    @property
+    def session_count(self) -> int:
+        return len(self.writes["session_data"])
+
+    def add(
+        self,
+        user_id: str,
+        username: Optional[str],
+        document: dict,
+        counts: Dict[str, float],
+        content: Dict[Tuple[str, str], dict],
+        rollups: Dict[datetime, Dict[str, float]],
+        geo_bins: Dict[Tuple[int, float, float], int],
+        referrers: Dict[Tuple[str, str, str], int],
+        on_written: Optional[Callable[[], None]] = None
+    ):
+        session_id = document["_id"]
+        sources = [session_id]
+        self.documents[session_id] = document
+        if on_written is not None:
+            self.callbacks[session_id] = on_written
+        self._add("session_data", session_id, document, sources)
+        self._add("counts", self.domain_name, counts, sources)
+        self._add("user", user_id, {"username": username, "session_ids": [session_id], "last_seen": document["session_end"]}, sources)
+        self._add("admin_user_list", user_id, True, sources)
+        for key, value in content.items():
+            self._add("content_metrics", key, value, sources)
+        for key, value in IngestRepo.rollup_buckets(rollups).items():
+            self._add("rollups", key, value, sources)
+        for key, value in geo_bins.items():
+            self._add("geo_bins", key, value, sources)
+        for key, value in referrers.items():
+            self._add("referrer_counts", key, value, sources)
+
+    def add_new_users(self, count: int):
+        """Count users the user upsert created, so a failed count is retried without redoing the upsert."""
+        if not count:
+            return
+        slot = IngestRepo.rollup_slot(datetime.utcnow())
+        sources = list(self.session_ids("user"))
+        for key, value in IngestRepo.rollup_buckets({slot: {"new_users": count}}).items():
+            self._add("new_users", key, value, sources)
+
+    def subset(self, failed: Dict[str, Optional[Iterable[Hashable]]]) -> "DomainBatch":
+        """
+        Copy only the given writes, e.g. to retry the operations of a flush that failed.
+        `failed` maps a component to the keys to copy, or to None for all of them.
+        """
+        batch = DomainBatch(self.domain_name)
+        batch.attempts = self.attempts
+        for component, keys in failed.items():
+            pending = self.writes[component]
+            for key in (list(pending) if keys is None else keys):
+                if key in pending:
+                    batch._add(component, key, pending[key], self.sources.get((component, key), []))
+        for session_id in batch.session_ids():
+            batch.documents[session_id] = self.documents[session_id]
+            if session_id in self.callbacks:
+                batch.callbacks[session_id] = self.callbacks[session_id]
+        return batch
+
+    def merge(self, other: "DomainBatch"):
+        """Fold another batch of the same domain into this one."""
+        self.attempts = max(self.attempts, other.attempts)
+        for component, pending in other.writes.items():
+            for key, value in pending.items():
+                self._add(component, key, value, other.sources.get((component, key), []))
+        self.documents.update(other.documents)
+        self.callbacks.update(other.callbacks)
+
+    def notify_written(self, pending: Set[ObjectId] = frozenset()):
+        """Run the callbacks of the sessions that have no writes in `pending`."""
+        for session_id, on_written in self.callbacks.items():
+            if session_id in pending:
+                continue
+            try:
+                on_written()
+            except Exception as e:
+                print(f"Error in write callback of session {session_id}: {e}")
+
+    def session_ids(self, component: Optional[str] = None, keys: Optional[Iterable[Hashable]] = None) -> Set[ObjectId]:
+        """The sessions behind the given writes; all pending writes by default."""
+        session_ids = set()
+        for (source_component, key), sources in self.sources.items():
+            if component is not None and source_component != component:
+                continue
+            if keys is not None and key not in keys:
+                continue
+            if key in self.writes[source_component]:
+                session_ids.update(sources)
+        return session_ids
+
+    def _add(self, component: str, key: Hashable, value: Any, sources: List[ObjectId]):
+        pending = self.writes[component]
+        pending[key] = DomainBatch.MERGE[component](pending.get(key), value)
+        self.sources.setdefault((component, key), []).extend(sources)
+
+
+class IngestBuffer:
+    """
+    Write-behind stage for session data. Sessions are merged per domain and
+    flushed with bulk writes once `max_sessions` are pending or every
+    `flush_interval` seconds, whichever comes first. While `max_pending`
+    sessions are buffered or being flushed, add() waits, so a slow database
+    pushes back on the ingest queue instead of growing the buffer.
+    """
+
+    def __init__(self, max_sessions: int, flush_interval: float, max_pending: int):
+        self.max_sessions = max_sessions
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.batches: Dict[str, DomainBatch] = {}
+        self.pending = 0
+        self.flushing = 0
+        self.failed_flushes = 0
+        self.waits = 0
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the background flusher and drain everything still buffered. The loop
+        is signalled rather than cancelled so a flush already in flight completes.
+        """
+        if self._task:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        batches, self.batches = self.batches, {}
+        self.pending = 0
+        self._space.set()
+        for batch in batches.values():
+            give_up(batch, "Unwritten when the ingest buffer stopped")
+
+    async def add(
+        self,
+        domain_name: str,
+        user_id: str,
+        username: Optional[str],
+        document: dict,
+        counts: Dict[str, float],
+        content: Dict[Tuple[str, str], dict],
+        rollups: Dict[datetime, Dict[str, float]],
+        geo_bins: Dict[Tuple[int, float, float], int],
+        referrers: Dict[Tuple[str, str, str], int],
+        on_written: Optional[Callable[[], None]] = None
+    ):
+        while self.pending + self.flushing >= self.max_pending:
+            self.waits += 1
+            self._space.clear()
+            self._wakeup.set()
+            await self._space.wait()
+
+        batch = self.batches.get(domain_name)
+        if batch is None:
+            batch = self.batches[domain_name] = DomainBatch(domain_name)
+        batch.add(user_id, username, document, counts, content, rollups, geo_bins, referrers, on_written)
+
+        self.pending += 1
+        if self.pending >= self.max_sessions:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self.batches:
+                return
+            batches, self.batches = self.batches, {}
+            flushed, self.pending = self.pending, 0
+            # Sessions being written still count against max_pending until the write returns
+            self.flushing = flushed
+
+            try:
+                retries = await write_batches(batches)
+            finally:
+                self.flushing = 0
+            if retries:
+                self.failed_flushes += 1
+                self.requeue(retries)
+            self._space.set()
+
+            print(f"Flushed {flushed} sessions across {len(batches)} domains")
+
+    def requeue(self, retries: Dict[str, DomainBatch]):
+        """
+        Put the writes that failed back into the buffer so the next flush retries them.
+        `retries` holds only the failed operations (see write_batches), so writes that
+        were applied are not applied again. After `INGEST_BATCH_MAX_ATTEMPTS` flushes the
+        sessions behind what still fails are dead-lettered instead.
+        """
+        for domain_name, retry in retries.items():
+            retry.attempts += 1
+            if retry.attempts >= INGEST_BATCH_MAX_ATTEMPTS:
+                give_up(retry, f"Still failing after {retry.attempts} flushes")
+                continue
+            batch = self.batches.get(domain_name)
+            if batch is None:
+                self.batches[domain_name] = retry
+            else:
+                batch.merge(retry)
+            self.pending += retry.session_count
+
+
+def dead_letter_sessions(batch: DomainBatch, session_ids: Iterable[ObjectId], write: str, error: str):
+    """Set aside the sessions behind a write that failed for good."""
+    print(f"Dead-lettering sessions of failed write {write}: {error}")
+    for session_id in session_ids:
+        ingest_dead_letters.write({"write": write, "error": error, "session": batch.documents.get(session_id, {"_id": session_id})})
+
+
+def give_up(batch: DomainBatch, error: str):
+    """Dead-letter the sessions behind every write still pending in the batch; they then count as written."""
+    for component in batch.components:
+        dead_letter_sessions(batch, batch.session_ids(component), f"{component}:{batch.domain_name}", error)
+    batch.notify_written()
+
+
+async def write_retrying(batches: Dict[str, DomainBatch], max_attempts: int = INGEST_BATCH_MAX_ATTEMPTS, delay: float = INGEST_BATCH_FLUSH_INTERVAL):
+    """
+    Write batches without the buffer: failed operations are retried every `delay`
+    seconds, as the buffer would on its next flushes, and dead-lettered after
+    `max_attempts` attempts.
+    """
+    for attempt in range(1, max_attempts + 1):
+        batches = await write_batches(batches)
+        if not batches:
+            return
+        if attempt < max_attempts:
+            await asyncio.sleep(delay)
+    for batch in batches.values():
+        give_up(batch, f"Still failing after {max_attempts} attempts")
+
+
+async def upsert_users(batch: DomainBatch):
+    """
+    Upsert the users' session links. The users it created, including those of the
+    operations that succeeded when others failed, become the batch's new_users writes.
+    """
+    try:
+        result = await IngestRepo.upsert_user_sessions(batch.domain_name, batch.writes["user"])
+    except PartialWriteError as e:
+        batch.add_new_users(e.details.get("nUpserted", 0))
+        raise
+    if result is not None:
+        batch.add_new_users(result.upserted_count)
+    return result
+
+
+async def register_domain_users(domain_name: str, user_ids: List[str]):
+    new_user_ids = [user_id for user_id in user_ids if (domain_name, user_id) not in registered_domain_users]
+    await IngestRepo.add_domain_users(domain_name, new_user_ids)
+    for user_id in new_user_ids:
+        registered_domain_users.put((domain_name, user_id))
+
+
+async def write_batches(
+    batches: Dict[str, DomainBatch],
+    dead_letter: Callable[[DomainBatch, Iterable[ObjectId], str, str], None] = dead_letter_sessions
+) -> Dict[str, DomainBatch]:
+    """
+    Persist merged domain batches with bulk writes. Returns, per domain, a batch
+    holding only the operations that failed and can be retried. Operations the
+    database rejected for good are not retried; the sessions behind them are
+    passed to `dead_letter(batch, session_ids, write_name, error)`. Sessions
+    with nothing left to retry have their `on_written` callback run.
+    """
+    # Every write below is independent, so they all go out concurrently. Each one
+    # covers a single component of a single domain so a failure can be retried alone.
+    operations = {}
+    for domain_name, batch in batches.items():
+        writes = batch.writes
+        operations[("session_data", domain_name)] = IngestRepo.insert_sessions(list(writes["session_data"].values()))
+        operations[("counts", domain_name)] = IngestRepo.inc_counts(writes["counts"])
+        operations[("user", domain_name)] = upsert_users(batch)
+        operations[("rollups", domain_name)] = IngestRepo.inc_rollup_buckets(domain_name, writes["rollups"])
+        operations[("admin_user_list", domain_name)] = register_domain_users(domain_name, list(writes["admin_user_list"]))
+        operations[("content_metrics", domain_name)] = IngestRepo.apply_content_increments(domain_name, writes["content_metrics"])
+        operations[("geo_bins", domain_name)] = IngestRepo.inc_geo_bins(domain_name, writes["geo_bins"])
+        operations[("referrer_counts", domain_name)] = IngestRepo.inc_referrer_counts(domain_name, writes["referrer_counts"])
+
+    results = await asyncio.gather(*operations.values(), return_exceptions=True)
+    failed: Dict[str, Dict[str, Optional[Set[Hashable]]]] = defaultdict(dict)
+    collect_failures(batches, operations, results, failed, dead_letter)
+
+    # New users are known once the user upserts are done; a retry carries the count it found
+    operations = {
+        ("new_users", domain_name): IngestRepo.inc_rollup_buckets(domain_name, batch.writes["new_users"])
+        for domain_name, batch in batches.items()
+        if batch.writes["new_users"]
+    }
+    results = await asyncio.gather(*operations.values(), return_exceptions=True)
+    collect_failures(batches, operations, results, failed, dead_letter)
+
+    for domain_name in batches:
+        dashboard_cache.invalidate(domain_name)
+    retries = {domain_name: batches[domain_name].subset(components) for domain_name, components in failed.items()}
+    for domain_name, batch in batches.items():
+        batch.notify_written(set(retries[domain_name].documents) if domain_name in retries else set())
+    return retries
+
+
+def collect_failures(
+    batches: Dict[str, DomainBatch],
+    operations: Dict[Tuple[str, str], Any],
+    results: list,
+    failed: Dict[str, Dict[str, Optional[Set[Hashable]]]],
+    dead_letter: Callable[[DomainBatch, Iterable[ObjectId], str, str], None]
+):
+    """Record in `failed` which operations of each (component, domain) can be retried; dead-letter the rest."""
+    for (component, domain_name), result in zip(operations, results):
+        if not isinstance(result, Exception):
+            continue
+        name = f"{component}:{domain_name}"
+        print(f"Error writing buffered {name}: {result}")
+        if not isinstance(result, PartialWriteError):
+            failed[domain_name][component] = None  # nothing is known to be applied: retry every operation
+            continue
+        rejected = {key for key, code in result.failed.items() if code is not None and code not in RETRYABLE_WRITE_ERRORS}
+        if rejected:
+            batch = batches[domain_name]
+            dead_letter(batch, batch.session_ids(component, rejected), name, str(result))
+        retry = set(result.failed) - rejected
+        if retry:
+            failed[domain_name][component] = retry
+
+
+ingest_buffer = IngestBuffer(INGEST_BATCH_MAX_SESSIONS, INGEST_BATCH_FLUSH_INTERVAL, INGEST_BATCH_MAX_PENDING)
+ingest_dead_letters = DeadLetterFile(INGEST_DEAD_LETTER_PATH)
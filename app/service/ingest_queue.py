@@ -0,0 +1,142 @@
+import asyncio
+import time
+from typing import Callable, List, Optional, Set
+from app.config.ingest_config import (
+    INGEST_QUEUE_DRAIN_TIMEOUT, INGEST_QUEUE_MAX_SIZE, INGEST_QUEUE_POLICY, INGEST_QUEUE_WORKERS
+)
+from app.model.session_data import SessionData
+from app.service.ingest_spool import ingest_spool
+from app.service.websocket_service import WebsocketService
+
+QUEUE_POLICIES = ("block", "drop_oldest", "reject")
+
+
+class IngestQueueFull(Exception):
+    """Raised by the "reject" policy when the ingest queue is at capacity."""
+
+
+class IngestQueue:
+    """
+    Bounded queue with a worker pool between the WebSocket receive loop and
+    WebsocketService.handle_session_data, so slow writes apply backpressure
+    instead of piling up unbounded work.
+    """
+
+    def __init__(self, max_size: int, workers: int, policy: str, drain_timeout: float):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Invalid ingest queue policy: {policy}. Allowed policies: {', '.join(QUEUE_POLICIES)}")
+        self.max_size = max_size
+        self.workers = workers
+        self.policy = policy
+        self.drain_timeout = drain_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._tasks: List[asyncio.Task] = []
+        self._busy: Set[asyncio.Task] = set()
+        self._stopping = False
+        self.processed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    def start(self):
+        if not self.running:
+            self._stopping = False
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Process what is already queued for up to `drain_timeout` seconds, so a stalled
+        database cannot hang shutdown, then stop the workers and spill whatever is
+        still queued to the spool. Idle workers are cancelled; a worker in the middle
+        of a session finishes it, since cancelling it would lose the session it holds.
+        """
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"Ingest queue not drained after {self.drain_timeout}s; {self.queue.qsize()} sessions left")
+        self._stopping = True
+        for task in self._tasks:
+            if task not in self._busy:
+                task.cancel()
+        if self._busy:
+            print(f"Waiting for {len(self._busy)} ingest workers to finish their current session")
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        remaining = []
+        while not self.queue.empty():
+            _, session_data, on_written = self.queue.get_nowait()
+            self.queue.task_done()
+            remaining.append((session_data, on_written))
+        if remaining:
+            await ingest_spool.spill([session_data for session_data, _ in remaining])
+            print(f"Spilled {len(remaining)} queued sessions to {ingest_spool.directory}")
+            for _, on_written in remaining:
+                if on_written is not None:
+                    on_written()
+
+    async def put(self, session_data: SessionData, on_written: Optional[Callable[[], None]] = None):
+        """Queue a session; `on_written` is passed on to handle_session_data, so it runs once the session is written."""
+        item = (time.monotonic(), session_data, on_written)
+
+        if self.policy == "block":
+            await self.queue.put(item)
+            return
+
+        if self.queue.full():
+            if self.policy == "reject":
+                self.rejected += 1
+                raise IngestQueueFull()
+            # drop_oldest: make room by discarding the longest-waiting session
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(item)
+
+    async def _worker(self):
+        task = asyncio.current_task()
+        while not self._stopping:
+            # A worker cancelled while waiting here leaves the item in the queue for stop() to spill
+            enqueued_at, session_data, on_written = await self.queue.get()
+            self._busy.add(task)
+            wait = time.monotonic() - enqueued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            try:
+                await WebsocketService.handle_session_data(session_data, on_written)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Error processing queued session for domain: {session_data.domain_name}: {e}")
+            finally:
+                self._busy.discard(task)
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        dequeued = self.processed + self.failed
+        return {
+            "depth": self.queue.qsize(),
+            "max_size": self.max_size,
+            "workers": self.workers,
+            "policy": self.policy,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.total_wait / dequeued if dequeued else 0,
+            "max_wait_seconds": self.max_wait,
+        }
+
+
+ingest_queue = IngestQueue(INGEST_QUEUE_MAX_SIZE, INGEST_QUEUE_WORKERS, INGEST_QUEUE_POLICY, INGEST_QUEUE_DRAIN_TIMEOUT)
@@ -0,0 +1,212 @@
+import json
+import zlib
+from typing import AsyncIterator, List, Optional, Tuple
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from app.config.ingest_config import INGEST_HTTP_CHUNK_RECORDS, INGEST_HTTP_MAX_BYTES
+from app.model.session_data import SessionData
+from app.service.ingest_buffer import ingest_buffer, write_batches
+from app.service.ingest_spool import ingest_spool
+from app.service.websocket_service import WebsocketService
+from app.utils.frame_codec import session_data_adapter
+
+GZIP_MAGIC = b"\x1f\x8b"
+MAX_REPORTED_ERRORS = 20
+
+
+class BatchIngest:
+    """Validates every record of a body, then writes the accepted ones in bulk chunks."""
+
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = []
+        self.sessions: List[Tuple[int, SessionData]] = []
+        self.record_index = 0
+        self.written = 0
+        self.failure: Optional[dict] = None
+
+    def add_json(self, raw: bytes):
+        if not raw.strip():
+            return
+        index = self.record_index
+        self.record_index += 1
+        try:
+            session_data = session_data_adapter.validate_json(raw)
+        except ValidationError as e:
+            self.reject(index, e.errors(include_url=False, include_input=False, include_context=False))
+            return
+        self.add(index, session_data)
+
+    def add_python(self, record):
+        index = self.record_index
+        self.record_index += 1
+        try:
+            session_data = session_data_adapter.validate_python(record)
+        except ValidationError as e:
+            self.reject(index, e.errors(include_url=False, include_input=False, include_context=False))
+            return
+        self.add(index, session_data)
+
+    def add(self, index: int, session_data: SessionData):
+        if not session_data.user_id or not session_data.domain_name:
+            self.reject(index, "Missing domain_name or user_id")
+            return
+        if not ObjectId.is_valid(session_data.user_id):
+            self.reject(index, "Invalid user_id")
+            return
+        self.accepted += 1
+        self.sessions.append((index, session_data))
+
+    def reject(self, index: int, error):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"record": index, "error": error})
+
+    async def write(self):
+        """
+        Write the accepted records chunk by chunk. Writes that fail are handed to the
+        write-behind buffer to retry when it runs; otherwise writing stops at the
+        failed chunk and `failure` describes which records were written.
+        """
+        if ingest_spool.running:
+            for _, session_data in self.sessions:
+                ingest_spool.append(session_data)
+            await ingest_spool.sync()
+            self.written = len(self.sessions)
+            return
+
+        for start in range(0, len(self.sessions), INGEST_HTTP_CHUNK_RECORDS):
+            chunk = self.sessions[start:start + INGEST_HTTP_CHUNK_RECORDS]
+            batches = WebsocketService.build_batches([session_data for _, session_data in chunk])
+            retries = await write_batches(batches)
+            if retries and ingest_buffer.running:
+                ingest_buffer.requeue(retries)
+            elif retries:
+                self.failure = {
+                    "failed_writes": [f"{component}:{domain_name}" for domain_name, retry in retries.items() for component in retry.components],
+                    # Records before this one were fully written
+                    "partially_written_from": chunk[0][0],
+                    # Records from this one on were not written at all and can be resent
+                    "resend_from": self.sessions[start + len(chunk)][0] if start + len(chunk) < len(self.sessions) else None,
+                }
+                return
+            self.written += len(chunk)
+
+
+class IngestService:
+
+    @staticmethod
+    async def ingest_batch(chunks: AsyncIterator[bytes], content_encoding: Optional[str]):
+        """
+        Ingest a body of SessionData records, either NDJSON (one record per line) or a
+        JSON array, optionally gzip-compressed. NDJSON is validated line by line as it
+        arrives; a JSON array is parsed once fully received. Nothing is written until the
+        whole body has been read and validated, so a 400 or 413 leaves nothing behind.
+
+        If a write fails and cannot be retried in the background, the 503 says which
+        records were written: those before `partially_written_from` fully, those from
+        it up to `resend_from` in part (do not resend them), and none from
+        `resend_from` on.
+        """
+        ingest = BatchIngest()
+        decompressor = None
+        first_chunk = True
+        body_format = None
+        pending = b""
+        received = 0
+
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if first_chunk:
+                first_chunk = False
+                if (content_encoding or "").lower() == "gzip" or chunk[:2] == GZIP_MAGIC:
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+            data = IngestService.inflate(decompressor, chunk, INGEST_HTTP_MAX_BYTES - received) if decompressor else chunk
+            received += len(data)
+            IngestService.check_size(received)
+
+            pending += data
+            if body_format is None and pending.lstrip():
+                body_format = "array" if pending.lstrip()[:1] == b"[" else "ndjson"
+
+            if body_format == "ndjson":
+                lines = pending.split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    ingest.add_json(line)
+
+        if decompressor:
+            try:
+                data = decompressor.flush()
+            except zlib.error:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid gzip body.")
+            received += len(data)
+            IngestService.check_size(received)
+            pending += data
+        if body_format is None:
+            body_format = "array" if pending.lstrip()[:1] == b"[" else "ndjson"
+
+        if body_format == "array":
+            try:
+                records = json.loads(pending)
+            except json.JSONDecodeError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid JSON array: {e}")
+            if not isinstance(records, list):
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a JSON array of sessions.")
+            for record in records:
+                ingest.add_python(record)
+        else:
+            for line in pending.split(b"\n"):
+                ingest.add_json(line)
+
+        await ingest.write()
+
+        if ingest.failure:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail={
+                    "message": f"Failed to write: {', '.join(sorted(ingest.failure['failed_writes']))}.",
+                    "written": ingest.written,
+                    "partially_written_from": ingest.failure["partially_written_from"],
+                    "resend_from": ingest.failure["resend_from"],
+                }
+            )
+
+        return {
+            "accepted": ingest.accepted,
+            "rejected": ingest.rejected,
+            "errors": ingest.errors
+        }
+
+    @staticmethod
+    def inflate(decompressor, chunk: bytes, budget: int) -> bytes:
+        """
+        Decompress a chunk into at most `budget` + 1 bytes, so a body that inflates past
+        the size limit (a gzip bomb) is rejected without being expanded in memory.
+        """
+        output = []
+        produced = 0
+        try:
+            while True:
+                # max_length=0 would mean unlimited, so always ask for at least one byte
+                data = decompressor.decompress(chunk, budget - produced + 1)
+                output.append(data)
+                produced += len(data)
+                chunk = decompressor.unconsumed_tail
+                if not chunk or produced > budget:
+                    break
+        except zlib.error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid gzip body.")
+        return b"".join(output)
+
+    @staticmethod
+    def check_size(received: int):
+        if received > INGEST_HTTP_MAX_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Batch exceeds {INGEST_HTTP_MAX_BYTES} bytes."
+            )
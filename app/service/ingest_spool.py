@@ -0,0 +1,373 @@
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+from pydantic import ValidationError
+from app.config.ingest_config import (
+    SPOOL_DIR, SPOOL_FSYNC, SPOOL_FSYNC_INTERVAL, SPOOL_MAX_ATTEMPTS, SPOOL_MAX_BACKOFF, SPOOL_POLL_INTERVAL,
+    SPOOL_REPLAY_BATCH, SPOOL_SEGMENT_BYTES
+)
+from app.model.session_data import SessionData
+from app.service.ingest_buffer import DomainBatch, write_batches
+from app.service.websocket_service import WebsocketService
+from app.utils.dead_letter import DeadLetterFile
+
+# Every record is a 4-byte little-endian length followed by the session's JSON
+RECORD_HEADER = struct.Struct("<I")
+CHECKPOINT_FILE = "checkpoint.json"
+DEAD_LETTER_FILE = "dead_letter.jsonl"
+
+
+def spooled_session_id(record: bytes) -> ObjectId:
+    """Derive a session's _id from its record, so replaying the record again does not insert it twice."""
+    return ObjectId(hashlib.sha256(record).digest()[:12])
+
+
+class SpoolReplay:
+    """A batch of records being replayed, narrowed to its failed writes between attempts."""
+
+    def __init__(self, position: Tuple[int, int], count: int, batches: Dict[str, DomainBatch], records: Dict[ObjectId, bytes]):
+        self.position = position
+        self.count = count
+        self.batches = batches
+        self.records = records
+        self.attempts = 0
+
+
+class IngestSpool:
+    """
+    Append-only on-disk spool in front of the Mongo writes.
+
+    Incoming sessions are appended to numbered segment files. A background
+    replayer memory-maps the segments, merges records per domain and writes
+    them in bulk, and only advances the checkpointed (segment, offset) once a
+    batch has been written, so a slow or unreachable database delays replay
+    instead of losing sessions, and whatever was not replayed before a restart
+    is replayed on startup.
+
+    Only the operations of a batch that failed are retried, so increments that
+    were applied are not applied again. Records that do not validate, records
+    behind an operation the database rejects, and records whose writes still
+    fail after `max_attempts` are appended to the dead-letter file and the
+    checkpoint moves past them. Session documents get
+    an _id derived from their record, so a batch replayed again after a crash
+    does not insert its sessions twice; the counter increments of such a batch
+    are applied again.
+
+    With `fsync` on, callers await sync() after appending; appends that arrive
+    within `fsync_interval` of each other share one fsync, run off the event loop.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int,
+        batch_size: int,
+        poll_interval: float,
+        max_backoff: float,
+        fsync: bool,
+        fsync_interval: float,
+        max_attempts: int
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_attempts = max_attempts
+        self.active_segment = 0
+        self.checkpoint: Tuple[int, int] = (0, 0)
+        self._dead_letter_file = DeadLetterFile(os.path.join(directory, DEAD_LETTER_FILE))
+        self._file = None
+        self._unsynced_files = []
+        self._sync_waiter: Optional[asyncio.Future] = None
+        self._sync_task: Optional[asyncio.Task] = None
+        self._sync_lock = asyncio.Lock()
+        self._replay: Optional[SpoolReplay] = None
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def dead_letters(self) -> int:
+        return self._dead_letter_file.count
+
+    def start(self):
+        if self.running:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segments()
+        self.checkpoint = self._load_checkpoint(segments)
+        # Always append to a fresh segment so a torn tail from a crash is never written after
+        self.active_segment = (segments[-1] + 1) if segments else 0
+        self._open_segment(self.active_segment)
+        self._stopping = False
+        self._wakeup.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the replayer, try to drain what is left, and close the active segment. The
+        replayer is signalled rather than cancelled, so a batch it is writing completes
+        and is checkpointed instead of being written again.
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        while True:
+            replayed, ok = await self._replay_once()
+            if not replayed or not ok:
+                break
+        await self.sync()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def append(self, session_data: SessionData):
+        payload = session_data.model_dump_json().encode()
+        self._file.write(RECORD_HEADER.pack(len(payload)) + payload)
+        if self._file.tell() >= self.segment_bytes:
+            if self.fsync:
+                # Closed by the next group sync, once its records are on disk
+                self._unsynced_files.append(self._file)
+            else:
+                self._file.close()
+            self.active_segment += 1
+            self._open_segment(self.active_segment)
+
+    async def sync(self):
+        """Wait until everything appended so far is on disk. A no-op unless fsync is on."""
+        if not self.fsync or self._file is None:
+            return
+        if self._sync_waiter is None:
+            self._sync_waiter = asyncio.get_running_loop().create_future()
+            self._sync_task = asyncio.create_task(self._group_sync())
+        await asyncio.shield(self._sync_waiter)
+
+    async def _group_sync(self):
+        # Let the appends arriving meanwhile join this fsync
+        await asyncio.sleep(self.fsync_interval)
+        async with self._sync_lock:
+            waiter, self._sync_waiter = self._sync_waiter, None
+            closing, self._unsynced_files = self._unsynced_files, []
+            try:
+                await asyncio.to_thread(IngestSpool._sync_files, closing, self._file)
+            except OSError as e:
+                waiter.set_exception(e)
+                return
+            waiter.set_result(None)
+
+    @staticmethod
+    def _sync_files(closing: list, current):
+        for segment_file in closing:
+            try:
+                os.fsync(segment_file.fileno())
+            finally:
+                segment_file.close()
+        os.fsync(current.fileno())
+
+    async def spill(self, sessions: List[SessionData]):
+        """
+        Write sessions that could not be processed before shutdown to disk. When the
+        spool is not running they go to a new segment, replayed by replay_spilled()
+        on the next start.
+        """
+        if self._file is not None:
+            for session_data in sessions:
+                self.append(session_data)
+            await self.sync()
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segments()
+        self.active_segment = (segments[-1] + 1) if segments else 0
+        self._open_segment(self.active_segment)
+        try:
+            for session_data in sessions:
+                self.append(session_data)
+            os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+            self._file = None
+
+    async def replay_spilled(self):
+        """With the spool disabled, replay what an earlier shutdown spilled, as far as the database takes it."""
+        if not os.path.isdir(self.directory):
+            return
+        segments = self._segments()
+        if not segments:
+            return
+        self.checkpoint = self._load_checkpoint(segments)
+        # Nothing is appended meanwhile, so every existing segment is complete
+        self.active_segment = segments[-1] + 1
+        while True:
+            replayed, ok = await self._replay_once()
+            if not replayed or not ok:
+                break
+        if self.pending_bytes():
+            print(f"{self.pending_bytes()} spilled bytes left in {self.directory} for the next start")
+
+    def pending_bytes(self) -> int:
+        segment, offset = self.checkpoint
+        total = 0
+        for number in self._segments():
+            if number >= segment:
+                total += os.path.getsize(self._segment_path(number))
+        return max(total - offset, 0)
+
+    async def _run(self):
+        backoff = self.poll_interval
+        while not self._stopping:
+            replayed, ok = await self._replay_once()
+            if not ok:
+                # The database is struggling: keep the records and retry later
+                await self._sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = self.poll_interval
+            if not replayed:
+                await self._sleep(self.poll_interval)
+
+    async def _sleep(self, seconds: float):
+        """Sleep, waking up early when stop() is called."""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _replay_once(self) -> Tuple[int, bool]:
+        if self._replay is None:
+            records, position = self._read_batch()
+            if not records and position == self.checkpoint:
+                return 0, True
+            self._replay = self._prepare(records, position)
+
+        replay = self._replay
+
+        def dead_letter(batch: DomainBatch, session_ids, write: str, error: str):
+            for session_id in session_ids:
+                self._dead_letter(replay.records[session_id], f"{write}: {error}")
+
+        replay.batches = await write_batches(replay.batches, dead_letter) if replay.batches else {}
+        replay.attempts += 1
+        if replay.batches:
+            if replay.attempts < self.max_attempts:
+                # The database is struggling: retry only what failed, later
+                return replay.count, False
+            for domain_name, batch in replay.batches.items():
+                for component in batch.components:
+                    dead_letter(batch, batch.session_ids(component), f"{component}:{domain_name}", f"Still failing after {replay.attempts} attempts")
+
+        self._replay = None
+        self._commit(replay.position)
+        return replay.count, True
+
+    def _prepare(self, records: List[bytes], position: Tuple[int, int]) -> SpoolReplay:
+        sessions: List[SessionData] = []
+        session_ids: List[ObjectId] = []
+        records_by_id: Dict[ObjectId, bytes] = {}
+        for record in records:
+            try:
+                session_data = SessionData.model_validate_json(record)
+            except ValidationError as e:
+                self._dead_letter(record, str(e))
+                continue
+            if not session_data.domain_name or not ObjectId.is_valid(session_data.user_id):
+                self._dead_letter(record, "Missing domain_name or invalid user_id")
+                continue
+            session_id = spooled_session_id(record)
+            sessions.append(session_data)
+            session_ids.append(session_id)
+            records_by_id[session_id] = record
+        batches = WebsocketService.build_batches(sessions, session_ids)
+        return SpoolReplay(position, len(records), batches, records_by_id)
+
+    def _dead_letter(self, record: bytes, error: str):
+        """Set a record aside for inspection; it can be re-spooled once the cause is fixed."""
+        print(f"Dead-lettering spooled session: {error}")
+        self._dead_letter_file.write({"error": error, "record": record.decode(errors="replace")})
+
+    def _read_batch(self) -> Tuple[List[bytes], Tuple[int, int]]:
+        """Read up to batch_size records after the checkpoint. Returns the records and the position after them."""
+        records: List[bytes] = []
+        segment, offset = self.checkpoint
+
+        while len(records) < self.batch_size:
+            path = self._segment_path(segment)
+            if not os.path.exists(path):
+                if segment >= self.active_segment:
+                    break
+                segment, offset = segment + 1, 0
+                continue
+
+            size = os.path.getsize(path)
+            if offset < size:
+                with open(path, "rb") as segment_file, mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    size = len(view)
+                    while len(records) < self.batch_size and offset + RECORD_HEADER.size <= size:
+                        (length,) = RECORD_HEADER.unpack_from(view, offset)
+                        end = offset + RECORD_HEADER.size + length
+                        if end > size:
+                            break  # record still being written, or a torn tail
+                        records.append(view[offset + RECORD_HEADER.size:end])
+                        offset = end
+
+            if len(records) >= self.batch_size or segment >= self.active_segment:
+                break
+            # Older segments are complete: anything left unread is a torn tail from a crash
+            segment, offset = segment + 1, 0
+
+        return records, (segment, offset)
+
+    def _commit(self, position: Tuple[int, int]):
+        self.checkpoint = position
+        checkpoint_path = os.path.join(self.directory, CHECKPOINT_FILE)
+        temp_path = checkpoint_path + ".tmp"
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump({"segment": position[0], "offset": position[1]}, checkpoint_file)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_path, checkpoint_path)
+
+        # Segments before the checkpoint have been fully replayed
+        for number in self._segments():
+            if number < position[0]:
+                os.remove(self._segment_path(number))
+
+    def _load_checkpoint(self, segments: List[int]) -> Tuple[int, int]:
+        checkpoint_path = os.path.join(self.directory, CHECKPOINT_FILE)
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint_file:
+                data = json.load(checkpoint_file)
+            return data["segment"], data["offset"]
+        return (segments[0] if segments else 0), 0
+
+    def _open_segment(self, number: int):
+        self._file = open(self._segment_path(number), "ab", buffering=0)
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{number:020d}.log")
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(name[:-4]) for name in os.listdir(self.directory)
+            if name.endswith(".log") and name[:-4].isdigit()
+        )
+
+
+ingest_spool = IngestSpool(
+    SPOOL_DIR, SPOOL_SEGMENT_BYTES, SPOOL_REPLAY_BATCH, SPOOL_POLL_INTERVAL, SPOOL_MAX_BACKOFF,
+    SPOOL_FSYNC, SPOOL_FSYNC_INTERVAL, SPOOL_MAX_ATTEMPTS
+)
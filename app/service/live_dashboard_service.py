@@ -0,0 +1,148 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, Optional, Set, Tuple
+from fastapi import WebSocket
+from app.config.dashboard_config import LIVE_DASHBOARD_TICK
+from app.service.dashboard_service import DashboardService
+from app.service.presence_service import presence
+from app.utils.counter_keys import decode_field_name
+
+
+class DomainDelta:
+    """Changes to a domain's MAIN/CONTENT numbers since the last tick."""
+
+    def __init__(self):
+        self.visits = 0
+        self.bounces = 0
+        self.page_counts: Dict[str, int] = defaultdict(int)
+        self.bounce_counts_per_page: Dict[str, int] = defaultdict(int)
+        self.content: Dict[str, Dict[str, Dict[str, float]]] = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+
+    def add(self, counts: Dict[str, float], content: Dict[Tuple[str, str], dict]):
+        self.visits += 1
+        for field, value in counts.items():
+            if field == "bounce_counts":
+                self.bounces += value
+            elif field.startswith("page_counts."):
+                self.page_counts[decode_field_name(field[len("page_counts."):])] += value
+            elif field.startswith("bounce_counts_per_page."):
+                self.bounce_counts_per_page[decode_field_name(field[len("bounce_counts_per_page."):])] += value
+        for (metric_type, title), entry in content.items():
+            for field, value in entry["inc"].items():
+                self.content[metric_type][title][field] += value
+
+    def to_dict(self) -> dict:
+        return {
+            "visits": self.visits,
+            "bounces": self.bounces,
+            "page_counts": dict(self.page_counts),
+            "bounce_counts_per_page": dict(self.bounce_counts_per_page),
+            "content_metrics": {
+                metric_type: {title: dict(fields) for title, fields in titles.items()}
+                for metric_type, titles in self.content.items()
+            },
+        }
+
+
+class LiveDashboardHub:
+    """
+    Fans ingest-driven dashboard updates out to subscribed admin sockets.
+    Deltas are coalesced per domain and sent once per `tick` seconds, so the
+    cost per tick is one payload per domain regardless of how many dashboards
+    are open on it. Deltas only cover this worker's ingest; a domain other
+    workers ingested for is marked with refresh() and gets a new snapshot on
+    the next tick instead.
+    """
+
+    def __init__(self, tick: float):
+        self.tick = tick
+        self.subscribers: Dict[str, Set[WebSocket]] = {}
+        self.deltas: Dict[str, DomainDelta] = {}
+        self.admins: Dict[str, str] = {}
+        self.refreshes: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def subscribe(self, domain_name: str, websocket: WebSocket, admin_id: str):
+        """Send the current MAIN snapshot, then register the socket for deltas."""
+        snapshot = await DashboardService.with_active_users(domain_name, await DashboardService.get_main_data(admin_id))
+        await websocket.send_json({"type": "snapshot", "data": snapshot})
+        self.subscribers.setdefault(domain_name, set()).add(websocket)
+        self.admins[domain_name] = admin_id
+
+    def unsubscribe(self, domain_name: str, websocket: WebSocket):
+        sockets = self.subscribers.get(domain_name)
+        if sockets is None:
+            return
+        sockets.discard(websocket)
+        if not sockets:
+            del self.subscribers[domain_name]
+            self.deltas.pop(domain_name, None)
+            self.admins.pop(domain_name, None)
+            self.refreshes.discard(domain_name)
+
+    def refresh(self, domain_name: str):
+        """Send the domain's subscribers a new snapshot on the next tick."""
+        if domain_name in self.subscribers:
+            self.refreshes.add(domain_name)
+
+    def record(self, domain_name: str, counts: Dict[str, float], content: Dict[Tuple[str, str], dict]):
+        """Called from the ingest path for every persisted session; free when nobody is watching."""
+        if domain_name not in self.subscribers:
+            return
+        delta = self.deltas.get(domain_name)
+        if delta is None:
+            delta = self.deltas[domain_name] = DomainDelta()
+        delta.add(counts, content)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            deltas, self.deltas = self.deltas, {}
+            refreshes, self.refreshes = self.refreshes, set()
+            for domain_name in list(self.subscribers):
+                try:
+                    if domain_name in refreshes:
+                        await self._send_snapshot(domain_name)
+                    else:
+                        await self._broadcast(domain_name, deltas.get(domain_name))
+                except Exception as e:
+                    print(f"Error broadcasting live dashboard update for domain: {domain_name}: {e}")
+
+    async def _send_snapshot(self, domain_name: str):
+        # A snapshot replaces the client's numbers, so this tick's delta is not sent on top of it
+        main_data = await DashboardService.get_main_data(self.admins[domain_name])
+        await self._send(domain_name, {"type": "snapshot", "data": await DashboardService.with_active_users(domain_name, main_data)})
+
+    async def _broadcast(self, domain_name: str, delta: Optional[DomainDelta]):
+        if not self.subscribers.get(domain_name):
+            return
+        await self._send(domain_name, {
+            "type": "delta",
+            "total_active_users": await presence.active_users(domain_name),
+            **(delta or DomainDelta()).to_dict()
+        })
+
+    async def _send(self, domain_name: str, message: dict):
+        sockets = list(self.subscribers.get(domain_name, ()))
+        if not sockets:
+            return
+        results = await asyncio.gather(*(socket.send_json(message) for socket in sockets), return_exceptions=True)
+        for socket, result in zip(sockets, results):
+            if isinstance(result, Exception):
+                self.unsubscribe(domain_name, socket)
+
+
+live_dashboard = LiveDashboardHub(LIVE_DASHBOARD_TICK)
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from app.config.ingest_config import PRESENCE_BACKEND, PRESENCE_HEARTBEAT_INTERVAL, PRESENCE_TTL
+from app.repo.presence_repo import PresenceRepo
+from app.utils.shared_state import active_connections
+
+
+class InProcessPresence:
+    """Presence of this process only, straight from the local connection registry."""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def connect(self, domain_name: str, user_id: str) -> bool:
+        return active_connections.connect(domain_name, user_id)
+
+    def disconnect(self, domain_name: str, user_id: str) -> bool:
+        return active_connections.disconnect(domain_name, user_id)
+
+    async def active_users(self, domain_name: str) -> int:
+        return active_connections.active_users(domain_name)
+
+
+class MongoPresence(InProcessPresence):
+    """
+    Presence shared by every worker through Mongo.
+
+    Each user has one presence document listing the workers it is connected
+    to. A worker records its users' first-connect / last-disconnect events
+    locally and publishes them coalesced, in one bulk write per heartbeat
+    interval, along with a liveness document that expires after `ttl`
+    seconds. A user is active if any live worker lists it, so a crashed
+    worker's users drop out once its heartbeat expires, and the dashboard
+    count is a single indexed count_documents.
+    """
+
+    def __init__(self, heartbeat_interval: float, ttl: float):
+        self.heartbeat_interval = heartbeat_interval
+        self.ttl = ttl
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._events: Dict[Tuple[str, str], bool] = {}
+        self._live_workers: List[str] = []
+        self._live_workers_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.publish()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await PresenceRepo.remove_worker(self.worker_id)
+
+    def connect(self, domain_name: str, user_id: str) -> bool:
+        first = super().connect(domain_name, user_id)
+        if first:
+            self._events[(domain_name, user_id)] = True
+        return first
+
+    def disconnect(self, domain_name: str, user_id: str) -> bool:
+        last = super().disconnect(domain_name, user_id)
+        if last:
+            self._events[(domain_name, user_id)] = False
+        return last
+
+    async def active_users(self, domain_name: str) -> int:
+        now = datetime.utcnow()
+        # The live worker list changes at most once per heartbeat, so it is reused in between
+        if self._live_workers_at is None or (now - self._live_workers_at).total_seconds() >= self.heartbeat_interval:
+            self._live_workers = await PresenceRepo.find_live_workers(now)
+            self._live_workers_at = now
+        return await PresenceRepo.count_active_users(domain_name, self._live_workers)
+
+    async def publish(self):
+        events, self._events = self._events, {}
+        try:
+            await PresenceRepo.publish_events(self.worker_id, events)
+            await PresenceRepo.heartbeat(self.worker_id, datetime.utcnow() + timedelta(seconds=self.ttl))
+        except Exception as e:
+            # Keep unpublished events; newer events for the same user win
+            self._events = {**events, **self._events}
+            print(f"Error publishing presence for worker {self.worker_id}: {e}")
+
+    async def _run(self):
+        ticks = 0
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await self.publish()
+            ticks += 1
+            if ticks % 10 == 0:
+                try:
+                    await PresenceRepo.remove_dead_workers(await PresenceRepo.find_live_workers(datetime.utcnow()))
+                except Exception as e:
+                    print(f"Error removing dead presence workers: {e}")
+
+
+def create_presence_backend(backend: str) -> InProcessPresence:
+    if backend == "mongo":
+        return MongoPresence(PRESENCE_HEARTBEAT_INTERVAL, PRESENCE_TTL)
+    return InProcessPresence()
+
+
+presence = create_presence_backend(PRESENCE_BACKEND)
@@ -0,0 +1,212 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from app.config.ingest_config import SESSION_CHECKPOINT_INTERVAL, SESSION_IDLE_TIMEOUT
+from app.model.session_data import Interaction, SessionData
+from app.repo.ingest_repo import IngestRepo
+from app.service.ingest_spool import ingest_spool
+from app.service.websocket_service import WebsocketService
+
+
+class StitchedSession:
+    def __init__(self, session_data: SessionData):
+        self.session_data = session_data
+        self.last_update = time.monotonic()
+        self.dirty = True
+        self.updates = 1
+        # Write callbacks of the updates merged since the last checkpoint
+        self.callbacks: List[Callable[[], None]] = []
+
+    def notify_written(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for on_written in callbacks:
+            on_written()
+
+
+class SessionStitcher:
+    """
+    Accumulates the updates of a connection into one in-progress session per
+    (domain_name, user_id) and persists it once, on disconnect or after the
+    session has been idle for `idle_timeout` seconds. Open sessions are
+    checkpointed every `checkpoint_interval` seconds so a crash loses at most
+    one interval of updates. An update's `on_written` callback runs once it is
+    durable: when the checkpoint holding it is saved, or when the session is
+    written. A live session's checkpoint is never older than
+    the idle timeout, so checkpoints older than idle timeout plus one interval
+    were left behind by a stopped worker; every worker sweeps and replays them
+    on startup and at each checkpoint.
+    """
+
+    def __init__(self, idle_timeout: float, checkpoint_interval: float):
+        self.idle_timeout = idle_timeout
+        self.checkpoint_interval = checkpoint_interval
+        self.sessions: Dict[Tuple[str, str], StitchedSession] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Persist every open session; one that fails to persist does not stop the others."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for key in list(self.sessions):
+            try:
+                await self.close(*key)
+            except Exception as e:
+                print(f"Error persisting session for {key[0]} - {key[1]} on shutdown: {e}")
+
+    def update(self, session_data: SessionData, on_written: Optional[Callable[[], None]] = None):
+        key = (session_data.domain_name, session_data.user_id)
+        stitched = self.sessions.get(key)
+        if stitched is None:
+            stitched = self.sessions[key] = StitchedSession(session_data)
+        else:
+            SessionStitcher.merge(stitched.session_data, session_data)
+            stitched.last_update = time.monotonic()
+            stitched.dirty = True
+            stitched.updates += 1
+        if on_written is not None:
+            stitched.callbacks.append(on_written)
+
+    async def close(self, domain_name: str, user_id: str):
+        stitched = self.sessions.pop((domain_name, user_id), None)
+        if stitched is None:
+            return
+        await SessionStitcher.persist(stitched.session_data, stitched.notify_written)
+        try:
+            await IngestRepo.delete_checkpoint(SessionStitcher.checkpoint_key(domain_name, user_id))
+        except Exception as e:
+            print(f"Error deleting session checkpoint for {domain_name} - {user_id}: {e}")
+
+    async def recover(self):
+        """Replay checkpoints left behind by a crashed or stopped worker."""
+        updated_before = datetime.utcnow() - timedelta(seconds=self.idle_timeout + self.checkpoint_interval)
+        recovered = 0
+        while True:
+            checkpoint = await IngestRepo.claim_checkpoint_before(updated_before)
+            if checkpoint is None:
+                break
+            try:
+                await SessionStitcher.persist(SessionData.model_validate(checkpoint["data"]))
+            except Exception:
+                # Put it back for a later sweep
+                await IngestRepo.save_checkpoints({checkpoint["_id"]: checkpoint["data"]})
+                raise
+            recovered += 1
+        if recovered:
+            print(f"Recovered {recovered} checkpointed sessions")
+
+    async def _run(self):
+        last_checkpoint = time.monotonic()
+        tick = min(self.idle_timeout, self.checkpoint_interval) / 2
+        while True:
+            await asyncio.sleep(tick)
+            now = time.monotonic()
+
+            idle_keys = [key for key, stitched in self.sessions.items() if now - stitched.last_update >= self.idle_timeout]
+            for key in idle_keys:
+                try:
+                    await self.close(*key)
+                except Exception as e:
+                    print(f"Error persisting idle session for {key[0]} - {key[1]}: {e}")
+
+            if now - last_checkpoint >= self.checkpoint_interval:
+                last_checkpoint = now
+                await self.checkpoint()
+                try:
+                    await self.recover()
+                except Exception as e:
+                    print(f"Error recovering orphaned session checkpoints: {e}")
+
+    async def checkpoint(self):
+        dirty = [(key, stitched) for key, stitched in self.sessions.items() if stitched.dirty]
+        if not dirty:
+            return
+        # Updates merged while the checkpoint is being saved are not in it
+        callbacks = [(stitched, stitched.callbacks) for _, stitched in dirty]
+        updates = [stitched.updates for _, stitched in dirty]
+        for _, stitched in dirty:
+            stitched.callbacks = []
+        try:
+            await IngestRepo.save_checkpoints({
+                SessionStitcher.checkpoint_key(*key): stitched.session_data.model_dump(mode="json")
+                for key, stitched in dirty
+            })
+        except Exception as e:
+            print(f"Error checkpointing {len(dirty)} in-progress sessions: {e}")
+            for stitched, pending in callbacks:
+                stitched.callbacks[:0] = pending
+            return
+        for (_, stitched), checkpointed_updates in zip(dirty, updates):
+            stitched.dirty = stitched.updates != checkpointed_updates
+        for _, pending in callbacks:
+            for on_written in pending:
+                on_written()
+
+    @staticmethod
+    async def persist(session_data: SessionData, on_written: Optional[Callable[[], None]] = None):
+        if ingest_spool.running:
+            ingest_spool.append(session_data)
+            await ingest_spool.sync()
+            if on_written is not None:
+                on_written()
+        else:
+            await WebsocketService.handle_session_data(session_data, on_written)
+
+    @staticmethod
+    def checkpoint_key(domain_name: str, user_id: str) -> str:
+        return f"{domain_name}:{user_id}"
+
+    @staticmethod
+    def merge(current: SessionData, update: SessionData):
+        """Merge an update into the in-progress session in place."""
+        if update.path_history:
+            current.path_history = SessionStitcher.merge_history(current.path_history or [], update.path_history)
+
+        if update.interaction:
+            if current.interaction is None:
+                current.interaction = Interaction()
+            for field in Interaction.model_fields:
+                items = getattr(update.interaction, field)
+                if items:
+                    setattr(current.interaction, field, SessionStitcher.merge_history(getattr(current.interaction, field) or [], items))
+
+        if update.session_start and (
+            not current.session_start
+            or WebsocketService.to_naive_utc(update.session_start) < WebsocketService.to_naive_utc(current.session_start)
+        ):
+            current.session_start = update.session_start
+        if update.session_end and (
+            not current.session_end
+            or WebsocketService.to_naive_utc(update.session_end) > WebsocketService.to_naive_utc(current.session_end)
+        ):
+            current.session_end = update.session_end
+
+        # Everything else: the latest reported value wins
+        for field in ("event", "username", "bounce", "location", "device_stats", "referrer"):
+            value = getattr(update, field)
+            if value is not None:
+                setattr(current, field, value)
+
+    @staticmethod
+    def merge_history(current: List, update: List) -> List:
+        # Clients that resend their full history (paths or interactions) send a list that
+        # extends what we already have; anything else is new and appended
+        if update[:len(current)] == current:
+            return list(update)
+        return current + update
+
+
+session_stitcher = SessionStitcher(SESSION_IDLE_TIMEOUT, SESSION_CHECKPOINT_INTERVAL)
@@ -1,14 +1,22 @@
+import math
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from bson import ObjectId
 from app.model.session_data import SessionData
-from app.config.db_config import mongodb
+from app.config.ingest_config import GEO_BIN_SIZES
+from app.repo.ingest_repo import IngestRepo
+from app.service.ingest_buffer import DomainBatch, ingest_buffer, write_retrying
+from app.service.live_dashboard_service import live_dashboard
+from app.utils.counter_keys import encode_counter_key, encode_field_name
 
 class WebsocketService:
 
     @staticmethod
-    async def handle_session_data(session_data: SessionData):
-        """Main handler for session data processing."""
+    async def handle_session_data(session_data: SessionData, on_written: Optional[Callable[[], None]] = None):
+        """
+        Main handler for session data processing. `on_written` runs once every write of the
+        session was applied or, having failed for good, was dead-lettered.
+        """
         user_id = session_data.user_id
         domain_name = session_data.domain_name
 
@@ -16,304 +24,222 @@ class WebsocketService:
             print("Invalid session data. Skipping...")
             return
 
-        # Process content metrics
-        await WebsocketService.save_content_metrics(session_data)
+        counts = WebsocketService.build_counts_increment(session_data)
+        content = WebsocketService.build_content_increments(session_data)
+        document = WebsocketService.build_session_document(session_data)
+        referrers = WebsocketService.build_referrer_increment(session_data)
+        rollups = WebsocketService.build_rollup_increment(document, counts, referrers)
+        geo_bins = WebsocketService.build_geo_bins(session_data)
+        live_dashboard.record(domain_name, counts, content)
+
+        if ingest_buffer.running:
+            # Write-behind: merge into the per-domain batch and let the flusher persist it;
+            # waits while the buffer is at its high-water mark
+            await ingest_buffer.add(domain_name, user_id, session_data.username, document, counts, content, rollups, geo_bins, referrers, on_written)
+            return
 
-        # Update admin user list
-        await WebsocketService.update_admin_user_list(user_id, domain_name)
-        
-        # Save session data and update counts
-        session_id = await WebsocketService.save_session_data(session_data, user_id)
-        await WebsocketService.update_counts(session_data, domain_name)
-        
-        print(f"Processed session for user: {user_id}, domain: {domain_name}")
+        # Without the buffer the session is written as a batch of one, so it goes through the same
+        # per-operation failure handling, and the operations that fail are retried here instead
+        batch = DomainBatch(domain_name)
+        batch.add(user_id, session_data.username, document, counts, content, rollups, geo_bins, referrers, on_written)
+        await write_retrying({domain_name: batch})
 
     @staticmethod
-    async def save_content_metrics(session_data: SessionData):
-        """Save or update content metrics based on the session data."""
-        domain_name = session_data.domain_name
+    def build_batches(sessions: List[SessionData], session_ids: Optional[List[ObjectId]] = None) -> Dict[str, DomainBatch]:
+        """Merge sessions per domain. `session_ids` optionally fixes the _id of each session document."""
+        batches: Dict[str, DomainBatch] = {}
+        for index, session_data in enumerate(sessions):
+            batch = batches.get(session_data.domain_name)
+            if batch is None:
+                batch = batches[session_data.domain_name] = DomainBatch(session_data.domain_name)
+            counts = WebsocketService.build_counts_increment(session_data)
+            content = WebsocketService.build_content_increments(session_data)
+            document = WebsocketService.build_session_document(session_data, session_ids[index] if session_ids else None)
+            referrers = WebsocketService.build_referrer_increment(session_data)
+            live_dashboard.record(session_data.domain_name, counts, content)
+            batch.add(
+                session_data.user_id,
+                session_data.username,
+                document,
+                counts,
+                content,
+                WebsocketService.build_rollup_increment(document, counts, referrers),
+                WebsocketService.build_geo_bins(session_data),
+                referrers
+            )
+        return batches
+
+    @staticmethod
+    def build_content_increments(session_data: SessionData) -> Dict[Tuple[str, str], dict]:
+        """Collect the content metric increments of a session keyed by (type, title)."""
         interaction = session_data.interaction
         referrer_source = session_data.referrer.utm_source if session_data.referrer else None
+        increments: Dict[Tuple[str, str], dict] = {}
+
+        if not interaction:
+            return increments
+
+        def add(metric_type: str, title: str, inc: Dict[str, float], child_buttons: Optional[Dict[str, int]] = None):
+            entry = increments.setdefault((metric_type, title), {"inc": {}, "child_buttons": {}, "referrer": referrer_source})
+            for field, value in inc.items():
+                entry["inc"][field] = entry["inc"].get(field, 0) + value
+            for button_name, clicks in (child_buttons or {}).items():
+                entry["child_buttons"][button_name] = entry["child_buttons"].get(button_name, 0) + clicks
+
+        # Process video metrics
+        for video in interaction.video_data or []:
+            cta_clicks, likes, subscribers, child_buttons = WebsocketService.process_child_buttons(
+                interaction.child_buttons_data, video.title
+            )
+            add("VIDEO", video.title, {
+                "views": 1,
+                "likes": likes,
+                "subscribers": subscribers,
+                "cta_clicks": cta_clicks,
+                "sum_watch_time": video.total_watch_time or 0,
+                "sum_completion_rate": 100 if video.ended else 0,
+            }, child_buttons)
+
+        # Process button metrics
+        for button in interaction.button_data or []:
+            add("BUTTON", button.content_title, {"clicks": button.click or 1})
 
-        try:
-            # Process video metrics
-            if interaction.video_data:
-                for video in interaction.video_data:
-                    cta_clicks, likes, subscribers, child_buttons = WebsocketService.process_child_buttons(
-                        interaction.child_buttons_data, video.title
-                    )
-
-                    update_query = {
-                        "domain_name": domain_name,
-                        "metrics": {
-                            "$elemMatch": {
-                                "title": video.title,
-                                "type": "VIDEO"
-                            }
-                        }
-                    }
-                    existing_doc = await mongodb.collections["content"].find_one(update_query)
-
-                    if existing_doc:
-                        # Retrieve the existing child_buttons dictionary or initialize it
-                        existing_child_buttons = next(
-                            (metric.get("child_buttons", {}) for metric in existing_doc.get("metrics", [])
-                            if metric["title"] == video.title and metric["type"] == "VIDEO"),
-                            {}
-                        )
-
-                        # Merge existing and new child_buttons
-                        for button_name, clicks in child_buttons.items():
-                            child_buttons[button_name] = (
-                                existing_child_buttons.get(button_name, 0) + clicks
-                            )
-
-                        update_data = {
-                            "$inc": {
-                                "metrics.$.views": 1,
-                                "metrics.$.sum_watch_time": video.total_watch_time or 0,
-                                "metrics.$.sum_completion_rate": 100 if video.ended else 0,
-                                "metrics.$.cta_clicks": cta_clicks,
-                                "metrics.$.likes": likes,
-                                "metrics.$.subscribers": subscribers,
-                            },
-                            "$set": {"metrics.$.child_buttons": child_buttons}
-                        }
-                        if referrer_source:
-                            update_data["$set"] = {
-                                "metrics.$.referrer": referrer_source
-                            }
-                        await mongodb.collections["content"].update_one(update_query, update_data)
-                    else:
-                        update_data = {
-                            "$push": {
-                                "metrics": {
-                                    "title": video.title,
-                                    "type": "VIDEO",
-                                    "views": 1,
-                                    "likes": likes,
-                                    "subscribers": subscribers,
-                                    "cta_clicks": cta_clicks,
-                                    "sum_watch_time": video.total_watch_time or 0,
-                                    "sum_completion_rate": 100 if video.ended else 0,
-                                    "referrer": referrer_source or "",
-                                    "child_buttons": child_buttons
-                                }
-                            }
-                        }
-                        await mongodb.collections["content"].update_one(
-                            {"domain_name": domain_name},
-                            update_data,
-                            upsert=True
-                        )
-
-            # Process button metrics
-            if interaction.button_data:
-                for button in interaction.button_data:
-                    update_query = {
-                        "domain_name": domain_name,
-                        "metrics": {
-                            "$elemMatch": {
-                                "title": button.content_title,
-                                "type": "BUTTON"
-                            }
-                        }
-                    }
-                    existing_doc = await mongodb.collections["content"].find_one(update_query)
-
-                    if existing_doc:
-                        update_data = {
-                            "$inc": {"metrics.$.clicks": button.click or 1}
-                        }
-                        await mongodb.collections["content"].update_one(update_query, update_data)
-                    else:
-                        update_data = {
-                            "$push": {
-                                "metrics": {
-                                    "title": button.content_title,
-                                    "type": "BUTTON",
-                                    "clicks": button.click or 1
-                                }
-                            }
-                        }
-                        await mongodb.collections["content"].update_one(
-                            {"domain_name": domain_name},
-                            update_data,
-                            upsert=True
-                        )
-
-            # Process content metrics
-            if interaction.contents_data:
-                for content in interaction.contents_data:
-                    watch_time = (
-                        (content.ended_watch_time - content.start_watch_time).total_seconds()
-                        if content.start_watch_time and content.ended_watch_time
-                        else 0
-                    )
-                    completion_rate = WebsocketService.calculate_content_completion_rate(
-                        word_count=content.word_count,
-                        scrolled_depth=content.scrolled_depth,
-                        watch_time=watch_time
-                    )
-
-                    cta_clicks, likes, subscribers, child_buttons = WebsocketService.process_child_buttons(
-                        interaction.child_buttons_data, content.content_title
-                    )
-
-                    update_query = {
-                        "domain_name": domain_name,
-                        "metrics": {
-                            "$elemMatch": {
-                                "title": content.content_title,
-                                "type": "CONTENT"
-                            }
-                        }
-                    }
-                    existing_doc = await mongodb.collections["content"].find_one(update_query)
-
-                    if existing_doc:
-                        # Retrieve the existing child_buttons dictionary or initialize it
-                        existing_child_buttons = next(
-                            (metric.get("child_buttons", {}) for metric in existing_doc.get("metrics", [])
-                            if metric["title"] == content.content_title and metric["type"] == "CONTENT"),
-                            {}
-                        )
-
-                        # Merge existing and new child_buttons
-                        for button_name, clicks in child_buttons.items():
-                            child_buttons[button_name] = (
-                                existing_child_buttons.get(button_name, 0) + clicks
-                            )
-
-                        update_data = {
-                            "$inc": {
-                                "metrics.$.views": 1,
-                                "metrics.$.sum_scroll_depth": content.scrolled_depth or 0,
-                                "metrics.$.sum_watch_time": watch_time,
-                                "metrics.$.sum_completion_rate": completion_rate,
-                                "metrics.$.cta_clicks": cta_clicks,
-                                "metrics.$.likes": likes,
-                                "metrics.$.subscribers": subscribers,
-                            },
-                            "$set": {"metrics.$.child_buttons": child_buttons}
-                        }
-                        if referrer_source:
-                            update_data["$set"]["metrics.$.referrer"] = referrer_source
-
-                        await mongodb.collections["content"].update_one(update_query, update_data)
-                    else:
-                        # Create a new document with all the necessary fields
-                        update_data = {
-                            "$push": {
-                                "metrics": {
-                                    "title": content.content_title,
-                                    "type": "CONTENT",
-                                    "views": 1,
-                                    "sum_scroll_depth": content.scrolled_depth or 0,
-                                    "sum_watch_time": watch_time,
-                                    "sum_completion_rate": completion_rate,
-                                    "cta_clicks": cta_clicks,
-                                    "likes": likes,
-                                    "subscribers": subscribers,
-                                    "referrer": referrer_source or "",
-                                    "child_buttons": child_buttons
-                                }
-                            }
-                        }
-                        await mongodb.collections["content"].update_one(
-                            {"domain_name": domain_name},
-                            update_data,
-                            upsert=True
-                        )
-
-
-        except Exception as e:
-            print(f"Error updating content metrics for domain: {domain_name}: {e}")
+        # Process content metrics
+        for content in interaction.contents_data or []:
+            watch_time = (
+                (content.ended_watch_time - content.start_watch_time).total_seconds()
+                if content.start_watch_time and content.ended_watch_time
+                else 0
+            )
+            completion_rate = WebsocketService.calculate_content_completion_rate(
+                word_count=content.word_count,
+                scrolled_depth=content.scrolled_depth,
+                watch_time=watch_time
+            )
+            cta_clicks, likes, subscribers, child_buttons = WebsocketService.process_child_buttons(
+                interaction.child_buttons_data, content.content_title
+            )
+            add("CONTENT", content.content_title, {
+                "views": 1,
+                "sum_scroll_depth": content.scrolled_depth or 0,
+                "sum_watch_time": watch_time,
+                "sum_completion_rate": completion_rate,
+                "cta_clicks": cta_clicks,
+                "likes": likes,
+                "subscribers": subscribers,
+            }, child_buttons)
+
+        return increments
 
     @staticmethod
-    async def update_admin_user_list(user_id: str, domain_name: str):
-        """Update the users_list of the Admin document."""
-        admin_doc = await mongodb.collections["admin"].find_one({"domain_name": domain_name})
-        if admin_doc:
-            existing_users = set(admin_doc.get("users_list", []))
-            existing_users.add(ObjectId(user_id))
-            await mongodb.collections["admin"].update_one(
-                {"domain_name": domain_name},
-                {"$set": {"users_list": list(existing_users)}}
-            )
-        else:
-            print(f"Admin document for domain {domain_name} not found. Skipping user update.")
+    def build_session_document(session_data: SessionData, session_id: Optional[ObjectId] = None) -> dict:
+        """Build the session_data document with a pre-allocated _id."""
+        document = session_data.model_dump(exclude={"username", "seq", "event_id"})
+        document["_id"] = session_id or ObjectId()
+        document["session_start"] = WebsocketService.to_naive_utc(document["session_start"] or datetime.now(timezone.utc))
+        document["session_end"] = WebsocketService.to_naive_utc(document["session_end"] or datetime.now(timezone.utc))
+        return document
 
     @staticmethod
-    async def save_session_data(session_data: SessionData, user_id: str) -> ObjectId:
-        """Save the session data to the database and handle the user's session IDs."""
-        # Prepare the session document
-        document = session_data.dict(exclude={"username"})
-        document["session_start"] = document["session_start"] or datetime.now(timezone.utc)
-        document["session_end"] = document["session_end"] or datetime.now(timezone.utc)
-
-        # Insert the session document into the "session_data" collection
-        session_result = await mongodb.collections["session_data"].insert_one(document)
-        session_id = session_result.inserted_id
-
-        # Check if the user exists in the "user" collection
-        existing_user = await mongodb.collections["user"].find_one({"_id": ObjectId(user_id)})
-
-        if existing_user:
-            # If user exists, push the session ID into their "session_ids"
-            await mongodb.collections["user"].update_one(
-                {"_id": ObjectId(user_id)},
-                {"$push": {"session_ids": session_id}}
-            )
-        else:
-            # If user does not exist, create a new user document
-            new_user = {
-                "_id": ObjectId(user_id),
-                "username": session_data.username,
-                "domain_name": session_data.domain_name,
-                "date_joined": datetime.utcnow(),
-                "session_ids": [session_id],
-            }
-            await mongodb.collections["user"].insert_one(new_user)
-
-        return session_id
+    def to_naive_utc(value: datetime) -> datetime:
+        """Mongo stores naive UTC datetimes; normalise so timestamps stay comparable in Python."""
+        if value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
 
     @staticmethod
-    async def update_counts(session_data: SessionData, domain_name: str):
-        """Update or insert counts in the counts collection."""
-        update_query = {
-            "$inc": {
-                f"page_counts.{path}": 1 for path in session_data.path_history or []
-            }
-        }
+    def build_counts_increment(session_data: SessionData) -> Dict[str, int]:
+        """Build the $inc map applied to the counts document for a session."""
+        # Paths and device names become field names, so they are encoded and empty ones skipped
+        increments = {}
+        for path in session_data.path_history or []:
+            name = encode_field_name(path)
+            if name is not None:
+                increments[f"page_counts.{name}"] = 1
+
+        # Running totals behind the average session time
+        increments["session_count"] = 1
+        increments["session_duration_sum"] = WebsocketService.session_duration(session_data)
 
         if session_data.bounce:
             # Increment overall bounce counts
-            update_query["$inc"]["bounce_counts"] = 1
+            increments["bounce_counts"] = 1
 
             # Increment bounce count for the single page in path_history
             if session_data.path_history:
-                bounce_page = session_data.path_history[0]
-                update_query["$inc"][f"bounce_counts_per_page.{bounce_page}"] = 1
+                bounce_page = encode_field_name(session_data.path_history[0])
+                if bounce_page is not None:
+                    increments[f"bounce_counts_per_page.{bounce_page}"] = 1
 
         if session_data.device_stats:
-            os_name = session_data.device_stats.os
-            browser_name = session_data.device_stats.browser
-            device_name = session_data.device_stats.deviceType
+            os_name = encode_field_name(session_data.device_stats.os)
+            browser_name = encode_field_name(session_data.device_stats.browser)
+            device_name = encode_field_name(session_data.device_stats.deviceType)
 
             if os_name:
-                update_query["$inc"][f"os_counts.{os_name}"] = 1
+                increments[f"os_counts.{os_name}"] = 1
             if browser_name:
-                update_query["$inc"][f"browser_counts.{browser_name}"] = 1
+                increments[f"browser_counts.{browser_name}"] = 1
             if device_name:
-                update_query["$inc"][f"device_counts.{device_name}"] = 1
+                increments[f"device_counts.{device_name}"] = 1
+
+        return increments
+
+    @staticmethod
+    def build_referrer_increment(session_data: SessionData) -> Dict[Tuple[str, str, str], int]:
+        """Referrers are counted per (utm_source, utm_medium, utm_campaign) when all three are set."""
+        referrer = session_data.referrer
+        if referrer and None not in (referrer.utm_source, referrer.utm_medium, referrer.utm_campaign):
+            return {(referrer.utm_source, referrer.utm_medium, referrer.utm_campaign): 1}
+        return {}
+
+    @staticmethod
+    def build_rollup_increment(
+        document: dict,
+        counts: Dict[str, float],
+        referrers: Dict[Tuple[str, str, str], int]
+    ) -> Dict[datetime, Dict[str, float]]:
+        """Build the rollup increments of a session, keyed by the UTC quarter hour it started."""
+        slot = IngestRepo.rollup_slot(document["session_start"])
+        increments = {
+            "visits": 1,
+            "bounces": counts.get("bounce_counts", 0),
+            "session_duration_sum": counts.get("session_duration_sum", 0),
+            "page_views": len(document.get("path_history") or []),
+        }
+        for referrer, value in referrers.items():
+            increments[f"referrers.{encode_counter_key(referrer)}"] = value
+        return {slot: increments}
+
+    @staticmethod
+    def build_geo_bins(session_data: SessionData) -> Dict[Tuple[int, float, float], int]:
+        """Snap the session's location to one grid cell per resolution, keyed by (resolution, cell center)."""
+        location = session_data.location
+        if not location or location.latitude is None or location.longitude is None:
+            return {}
+        if not (-90 <= location.latitude <= 90 and -180 <= location.longitude <= 180):
+            return {}
+        return {
+            (resolution, *WebsocketService.geo_cell(location.latitude, location.longitude, size)): 1
+            for resolution, size in enumerate(GEO_BIN_SIZES)
+        }
 
-        await mongodb.collections["counts"].update_one(
-            {"domain_name": domain_name},
-            update_query,
-            upsert=True
+    @staticmethod
+    def geo_cell(latitude: float, longitude: float, size: float) -> Tuple[float, float]:
+        # Rounded so the same cell always produces the same key despite float noise
+        return (
+            round((math.floor(latitude / size) + 0.5) * size, 6),
+            round((math.floor(longitude / size) + 0.5) * size, 6)
         )
 
+    @staticmethod
+    def session_duration(session_data: SessionData) -> float:
+        """Duration in seconds, with a missing start or end taken as now like in the stored document."""
+        now = datetime.now(timezone.utc)
+        session_start = WebsocketService.to_naive_utc(session_data.session_start or now)
+        session_end = WebsocketService.to_naive_utc(session_data.session_end or now)
+        return (session_end - session_start).total_seconds()
+
     @staticmethod
     def calculate_content_completion_rate(
         word_count: Optional[int],
@@ -362,9 +288,10 @@ class WebsocketService:
                     elif child_button.content_title == "SUBSCRIBE" and (child_button.click or 0) % 2 != 0:
                         subscribers += 1
                     else:
-                        # Add to child_buttons dictionary for unmatched content types
-                        child_buttons[child_button.content_title] = (
-                            child_buttons.get(child_button.content_title, 0) + (child_button.click or 0)
-                        )
+                        # Add to child_buttons dictionary for unmatched content types; the
+                        # button name becomes a field name, so it is encoded
+                        button_name = encode_field_name(child_button.content_title)
+                        if button_name is not None:
+                            child_buttons[button_name] = child_buttons.get(button_name, 0) + (child_button.click or 0)
         return cta_clicks, likes, subscribers, child_buttons
 
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from typing import Hashable, List, Optional, Tuple, Union
+from fastapi import WebSocket
+from app.config.ingest_config import ACK_BATCH_SIZE, ACK_INTERVAL, DEDUP_MAX_CLIENTS, DEDUP_WINDOW
+from app.utils.frame_codec import send_frame
+from app.utils.lru_cache import LRUCache
+
+# Recently written idempotency keys per scope; kept across reconnects
+dedup_windows = LRUCache(DEDUP_MAX_CLIENTS)
+
+
+def dedup_key(
+    domain_name: str,
+    user_id: str,
+    stream_id: str,
+    seq: Optional[int],
+    event_id: Optional[str]
+) -> Optional[Tuple[Hashable, Union[int, str]]]:
+    """
+    Return (scope, key) for a frame, or None if it carries no idempotency key.
+    An `event_id` is unique per user, so it is deduped across all of the user's
+    connections; a `seq` only orders the frames of one stream (a client session id,
+    or the connection itself), so it is deduped within that stream only.
+    """
+    if event_id is not None:
+        return (domain_name, user_id), event_id
+    if seq is not None:
+        return (domain_name, user_id, stream_id), seq
+    return None
+
+
+def is_duplicate(scope: Hashable, key: Hashable) -> bool:
+    """True if the key was already written within its scope."""
+    window = dedup_windows.get(scope)
+    return window is not None and key in window
+
+
+def record_key(scope: Hashable, key: Hashable):
+    """Remember a key once its frame has been written (or durably handed off)."""
+    window = dedup_windows.get(scope)
+    if window is None:
+        window = LRUCache(DEDUP_WINDOW)
+        dedup_windows.put(scope, window)
+    window.put(key)
+
+
+class AckTracker:
+    """
+    Batches acknowledgements for one connection. Acks are sent as
+    {"type": "ack", "ids": [...], "duplicates": n} once `batch_size` keys are
+    pending or every `interval` seconds, whichever comes first.
+
+    Frames are acknowledged through written(), called by the ingest path once
+    the frame's data is durable, which can be after the connection closed.
+    """
+
+    def __init__(self, websocket: WebSocket, encoding: str, batch_size: int = ACK_BATCH_SIZE, interval: float = ACK_INTERVAL):
+        self.websocket = websocket
+        self.encoding = encoding
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pending: List[Union[int, str]] = []
+        self.duplicates = 0
+        self.last_sent = time.monotonic()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def ack(self, key: Union[int, str], duplicate: bool = False):
+        self.pending.append(key)
+        if duplicate:
+            self.duplicates += 1
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+
+    def written(self, scope: Hashable, key: Union[int, str]):
+        """Remember a frame's key once its data is durable, and acknowledge it with the next batch."""
+        record_key(scope, key)
+        if self._task is None:
+            return  # the connection is gone; a resend is acknowledged as a duplicate
+        self.pending.append(key)
+        if len(self.pending) >= self.batch_size:
+            self._full.set()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        ids, self.pending = self.pending, []
+        duplicates, self.duplicates = self.duplicates, 0
+        self.last_sent = time.monotonic()
+        await send_frame(self.websocket, self.encoding, {"type": "ack", "ids": ids, "duplicates": duplicates})
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            if self.pending and (len(self.pending) >= self.batch_size or time.monotonic() - self.last_sent >= self.interval):
+                try:
+                    await self.flush()
+                except Exception:
+                    # The socket is closing; the receive loop handles the disconnect
+                    return
@@ -0,0 +1,101 @@
+import asyncio
+import json
+from typing import Union
+from fastapi import WebSocket
+from app.config.websocket_config import WS_IDLE_TIMEOUT, WS_MAX_FRAME_BYTES, WS_MAX_RETAINED_BYTES
+from app.utils.frame_codec import receive_raw
+
+# Close codes
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TOO_BIG = 1009
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class ConnectionClosed(Exception):
+    """Raised when the guard decides to close the connection."""
+
+    def __init__(self, code: int, reason: str):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+
+
+class ConnectionStats:
+    """Process-wide counters for /ws/session connections."""
+
+    def __init__(self):
+        self.open_connections = 0
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.retained_bytes = 0
+        self.reaped_idle = 0
+        self.rejected_oversize = 0
+        self.rejected_capacity = 0
+        self.rejected_frames = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "open_connections": self.open_connections,
+            "frames_received": self.frames_received,
+            "bytes_received": self.bytes_received,
+            "retained_bytes": self.retained_bytes,
+            "retained_bytes_per_connection": self.retained_bytes / self.open_connections if self.open_connections else 0,
+            "reaped_idle": self.reaped_idle,
+            "rejected_oversize": self.rejected_oversize,
+            "rejected_capacity": self.rejected_capacity,
+            "rejected_frames": self.rejected_frames,
+        }
+
+
+connection_stats = ConnectionStats()
+
+
+class ConnectionGuard:
+    """
+    Enforces idle timeout, maximum frame size and a retained-state budget for one
+    connection, and accounts its traffic and retained bytes in `connection_stats`.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.retained_bytes = 0
+        self._retained_estimate = 0
+        connection_stats.open_connections += 1
+
+    async def receive(self) -> Union[str, bytes]:
+        try:
+            raw = await asyncio.wait_for(receive_raw(self.websocket), timeout=WS_IDLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            connection_stats.reaped_idle += 1
+            raise ConnectionClosed(CLOSE_GOING_AWAY, "Idle timeout")
+
+        size = len(raw)
+        if size > WS_MAX_FRAME_BYTES:
+            connection_stats.rejected_oversize += 1
+            raise ConnectionClosed(CLOSE_TOO_BIG, f"Frame exceeds {WS_MAX_FRAME_BYTES} bytes")
+
+        connection_stats.frames_received += 1
+        connection_stats.bytes_received += size
+        return raw
+
+    def retain(self, state: dict, frame_size: int):
+        """
+        Account the delta state kept between frames. The merged state is at most the sum
+        of the frames merged into it, so it is only re-measured once that bound doubles.
+        """
+        self._retained_estimate += frame_size
+        if self._retained_estimate > 2 * self.retained_bytes:
+            self._set_retained(len(json.dumps(state, default=str)))
+            self._retained_estimate = self.retained_bytes
+        if self.retained_bytes > WS_MAX_RETAINED_BYTES:
+            connection_stats.rejected_oversize += 1
+            raise ConnectionClosed(CLOSE_TOO_BIG, f"Delta state exceeds {WS_MAX_RETAINED_BYTES} bytes")
+
+    def close(self):
+        self._set_retained(0)
+        connection_stats.open_connections -= 1
+
+    def _set_retained(self, size: int):
+        connection_stats.retained_bytes += size - self.retained_bytes
+        self.retained_bytes = size
@@ -0,0 +1,53 @@
+from typing import Dict, Iterator, Tuple
+
+
+class ConnectionRegistry:
+    """
+    Active WebSocket connections per domain, with a reference count per user so a
+    user with several tabs stays active until the last one closes. Every operation
+    is O(1); memory is one dict entry per active user.
+    """
+
+    def __init__(self):
+        self._domains: Dict[str, Dict[str, int]] = {}
+        self.total_connections = 0
+
+    def connect(self, domain_name: str, user_id: str) -> bool:
+        """Register a connection. Returns True if it is the user's first open connection."""
+        users = self._domains.get(domain_name)
+        if users is None:
+            users = self._domains[domain_name] = {}
+        count = users.get(user_id, 0)
+        users[user_id] = count + 1
+        self.total_connections += 1
+        return count == 0
+
+    def disconnect(self, domain_name: str, user_id: str) -> bool:
+        """Release a connection. Returns True if it was the user's last open connection."""
+        users = self._domains.get(domain_name)
+        if not users or user_id not in users:
+            return False
+        self.total_connections -= 1
+        if users[user_id] > 1:
+            users[user_id] -= 1
+            return False
+        del users[user_id]
+        if not users:  # Remove domain if no users are left
+            del self._domains[domain_name]
+        return True
+
+    def active_users(self, domain_name: str) -> int:
+        return len(self._domains.get(domain_name, ()))
+
+    def is_active(self, domain_name: str, user_id: str) -> bool:
+        return user_id in self._domains.get(domain_name, ())
+
+    def snapshot(self) -> Dict[str, int]:
+        """Active user count per domain."""
+        return {domain_name: len(users) for domain_name, users in self._domains.items()}
+
+    def iter_users(self) -> Iterator[Tuple[str, str]]:
+        """Iterate (domain_name, user_id) pairs over a point-in-time copy of the keys."""
+        for domain_name, users in list(self._domains.items()):
+            for user_id in list(users):
+                yield domain_name, user_id
@@ -0,0 +1,36 @@
+from typing import Iterable, List, Optional
+from urllib.parse import quote, unquote
+
+# Counter maps use arbitrary values as Mongo field names, which must not contain "."
+# or start with "$". Parts are percent-encoded (including ".") and joined with "|".
+
+
+def encode_counter_key(parts: Iterable[str]) -> str:
+    return "|".join(quote(part, safe="").replace(".", "%2E") for part in parts)
+
+
+def decode_counter_key(key: str) -> List[str]:
+    return [unquote(part) for part in key.split("|")]
+
+
+def encode_field_name(value: Optional[str]) -> Optional[str]:
+    """
+    Make a single value (a path, a button name, a browser) usable as a field name.
+    Only "%", ".", NUL and a leading "$" are escaped, so ordinary values stay readable.
+    Returns None for an empty value, which cannot be a field name.
+    """
+    if not value:
+        return None
+    name = value.replace("%", "%25").replace(".", "%2E").replace("\x00", "%00")
+    if name.startswith("$"):
+        name = "%24" + name[1:]
+    return name
+
+
+def decode_field_name(name: str) -> str:
+    return unquote(name)
+
+
+def decode_field_names(counts: dict) -> dict:
+    """Decode the keys of a counter map read back from Mongo."""
+    return {decode_field_name(name): value for name, value in counts.items()}
@@ -0,0 +1,21 @@
+import json
+import os
+from datetime import datetime
+
+
+class DeadLetterFile:
+    """
+    Append-only JSON lines file of ingest data that could not be written, set aside
+    for inspection and re-ingest once the cause is fixed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+
+    def write(self, entry: dict):
+        self.count += 1
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        line = json.dumps({"failed_at": datetime.utcnow().isoformat(), **entry}, default=str)
+        with open(self.path, "a") as dead_letter_file:
+            dead_letter_file.write(line + "\n")
@@ -0,0 +1,92 @@
+import json
+from typing import Iterable, Optional, Tuple, Union
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic import TypeAdapter
+from app.model.session_data import SessionData
+
+# Binary codecs are optional; without them only JSON framing is offered
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+BINARY_ENCODINGS = {"msgpack": msgpack, "cbor": cbor2}
+
+# Raised for a frame that cannot be decoded or validated. JSON, msgpack and pydantic
+# errors are ValueErrors; cbor2's decode errors are not in every version
+FRAME_ERRORS = (ValueError, TypeError) + ((cbor2.CBORDecodeError,) if cbor2 is not None else ())
+
+# Built once: validates raw frame bytes straight into SessionData without an intermediate dict
+session_data_adapter = TypeAdapter(SessionData)
+
+
+def available_encodings() -> list:
+    return ["json"] + [name for name, codec in BINARY_ENCODINGS.items() if codec is not None]
+
+
+def negotiate_encoding(requested: Optional[str], subprotocols: Iterable[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Pick the frame encoding for a connection.
+    A supported binary subprotocol offered by the client wins and is echoed back on accept;
+    otherwise the `encoding` query parameter is used, defaulting to JSON.
+    Returns (encoding, subprotocol), or (None, None) if the requested encoding is unavailable.
+    """
+    supported = available_encodings()
+    for subprotocol in subprotocols:
+        if subprotocol in supported and subprotocol != "json":
+            return subprotocol, subprotocol
+
+    encoding = requested or "json"
+    if encoding not in supported:
+        return None, None
+    return encoding, None
+
+
+async def receive_raw(websocket: WebSocket) -> Union[str, bytes]:
+    """Receive the next text or binary frame payload as-is."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("text") is not None:
+        return message["text"]
+    return message.get("bytes") or b""
+
+
+def decode_frame(raw: Union[str, bytes], encoding: str) -> dict:
+    if encoding == "json":
+        return json.loads(raw)
+    if encoding == "msgpack":
+        return msgpack.unpackb(raw, raw=False)
+    return cbor2.loads(raw)
+
+
+def parse_session_data(raw: Union[str, bytes], encoding: str) -> SessionData:
+    """Fast path for full (non-delta) frames: JSON bytes are validated directly into the model."""
+    if encoding == "json":
+        return session_data_adapter.validate_json(raw)
+    return session_data_adapter.validate_python(decode_frame(raw, encoding))
+
+
+async def send_frame(websocket: WebSocket, encoding: str, data: dict):
+    if encoding == "json":
+        await websocket.send_json(data)
+    elif encoding == "msgpack":
+        await websocket.send_bytes(msgpack.packb(data))
+    else:
+        await websocket.send_bytes(cbor2.dumps(data))
+
+
+def merge_delta(previous: dict, delta: dict) -> dict:
+    """Apply a delta frame on top of the last full frame. Nested objects merge, everything else is replaced."""
+    merged = dict(previous)
+    for key, value in delta.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_delta(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
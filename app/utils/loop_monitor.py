@@ -0,0 +1,48 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class LoopLagMonitor:
+    """Measures event-loop latency as the oversleep of a short periodic timer."""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.samples = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - started - self.interval, 0.0)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+            self.samples += 1
+
+    def stats(self) -> dict:
+        return {
+            "event_loop_lag_ms": self.last_lag * 1000,
+            "event_loop_lag_avg_ms": (self.total_lag / self.samples) * 1000 if self.samples else 0,
+            "event_loop_lag_max_ms": self.max_lag * 1000,
+        }
+
+
+loop_monitor = LoopLagMonitor()
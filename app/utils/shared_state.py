@@ -1,3 +1,8 @@
-from typing import Dict, List
+from app.config.ingest_config import DOMAIN_USER_CACHE_SIZE
+from app.utils.connection_registry import ConnectionRegistry
+from app.utils.lru_cache import LRUCache
 
-active_connections: Dict[str, List[str]] = {}
+active_connections = ConnectionRegistry()
+
+# (domain_name, user_id) pairs already written to the domain_users collection
+registered_domain_users = LRUCache(DOMAIN_USER_CACHE_SIZE)
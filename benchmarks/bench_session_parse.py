@@ -0,0 +1,85 @@
+import io
+import json
+import sys
+import timeit
+from contextlib import redirect_stdout
+from pathlib import Path
+from pydantic import TypeAdapter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.model.session_data import SessionData
+
+# Compares the original per-message parsing (receive_json -> SessionData(**data) ->
+# print(data) -> .dict()) with the fast path (TypeAdapter.validate_json on the raw
+# frame -> one model_dump).
+# Usage: python benchmarks/bench_session_parse.py [iterations]
+
+FRAME = json.dumps({
+    "event": "session_update",
+    "user_id": "67515854bfea3e4a63ee5021",
+    "username": "visitor",
+    "session_start": "2024-12-05T10:00:00Z",
+    "session_end": "2024-12-05T10:05:30Z",
+    "path_history": ["/home", "/about", "/blog/impact", "/contact"],
+    "bounce": False,
+    "domain_name": "www.spandan.com",
+    "location": {"latitude": 27.7172, "longitude": 85.3240},
+    "device_stats": {"deviceType": "Mobile", "browser": "Chrome", "os": "Android"},
+    "interaction": {
+        "video_data": [{
+            "content_type": "video",
+            "title": "Impact Video",
+            "started_watching": "2024-12-05T10:01:00Z",
+            "last_interaction": "2024-12-05T10:03:00Z",
+            "total_watch_time": 120.5,
+            "session_information": [
+                {"start_time": "2024-12-05T10:01:00Z", "end_time": "2024-12-05T10:03:00Z", "duration": 120.5, "completed": True}
+            ],
+            "ended": True
+        }],
+        "button_data": [{"content_type": "button", "click": 2, "content_title": "Sign up", "contents_type": "button"}],
+        "contents_data": [{
+            "content_type": "article",
+            "content_title": "Our Achievements",
+            "word_count": 800,
+            "start_watch_time": "2024-12-05T10:03:00Z",
+            "ended_watch_time": "2024-12-05T10:05:00Z",
+            "scrolled_depth": 85.0,
+            "isactive": False
+        }],
+        "child_buttons_data": [
+            {"content_type": "button", "click": 1, "content_title": "LIKE", "contents_type": "button", "parent_content_title": "Impact Video"}
+        ]
+    },
+    "referrer": {"utm_source": "twitter", "utm_medium": "social", "utm_campaign": "launch"}
+})
+
+adapter = TypeAdapter(SessionData)
+sink = io.StringIO()
+
+
+def original_path():
+    data = json.loads(FRAME)
+    session_data = SessionData(**data)
+    with redirect_stdout(sink):
+        print(f"Received message from user on domain: {data}")
+    sink.seek(0)
+    sink.truncate()
+    return session_data.model_dump(exclude={"username"})
+
+
+def fast_path():
+    return adapter.validate_json(FRAME).model_dump(exclude={"username"})
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    assert original_path() == fast_path()
+
+    original = min(timeit.repeat(original_path, number=iterations, repeat=5)) / iterations
+    fast = min(timeit.repeat(fast_path, number=iterations, repeat=5)) / iterations
+
+    print(f"original path: {original * 1e6:8.2f} us/message")
+    print(f"fast path:     {fast * 1e6:8.2f} us/message")
+    print(f"saved:         {(original - fast) * 1e6:8.2f} us/message ({(1 - fast / original) * 100:.1f}%)")
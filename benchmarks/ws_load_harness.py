@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import resource
+import sys
+import time
+import urllib.request
+from typing import Optional
+
+import websockets
+from bson import ObjectId
+
+# Opens N concurrent /ws/session connections, has each send a frame every few seconds,
+# and reports the server's resident memory per connection and its event-loop lag.
+# Usage:
+#   python benchmarks/ws_load_harness.py --url ws://localhost:8000/ws/session \
+#       --connections 10000 --server-pid <uvicorn pid> [--token <super admin JWT>]
+
+FRAME = {
+    "event": "session_update",
+    "username": "visitor",
+    "session_start": "2024-12-05T10:00:00Z",
+    "path_history": ["/home", "/about"],
+    "bounce": False,
+    "domain_name": "www.spandan.com",
+    "device_stats": {"deviceType": "Mobile", "browser": "Chrome", "os": "Android"},
+}
+
+
+def raise_fd_limit(connections: int):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, connections + 1024)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+
+def server_rss_kb(pid: Optional[int]) -> Optional[int]:
+    if pid is None:
+        return None
+    with open(f"/proc/{pid}/status") as status_file:
+        for line in status_file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return None
+
+
+def server_stats(http_url: Optional[str], token: Optional[str]) -> Optional[dict]:
+    if not http_url or not token:
+        return None
+    request = urllib.request.Request(http_url, headers={"Authorization": f"Bearer {token}"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+async def drain(websocket):
+    """Read and discard what the server sends (acks), so it never fills max_queue and stalls ping handling."""
+    try:
+        async for _ in websocket:
+            pass
+    except websockets.ConnectionClosed:
+        pass  # The sender sees the close too and reports it
+
+
+async def client(url: str, domain_name: str, index: int, interval: float, stop: asyncio.Event, opened: list):
+    user_id = str(ObjectId())
+    uri = f"{url}?domain_name={domain_name}&user_id={user_id}"
+    try:
+        async with websockets.connect(uri, max_queue=4) as websocket:
+            opened[0] += 1
+            reader = asyncio.create_task(drain(websocket))
+            try:
+                seq = 0
+                while not stop.is_set():
+                    seq += 1
+                    await websocket.send(json.dumps({**FRAME, "user_id": user_id, "seq": seq}))
+                    try:
+                        await asyncio.wait_for(stop.wait(), timeout=interval)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                reader.cancel()
+    except Exception as e:
+        opened[1] += 1
+        if opened[1] <= 5:
+            print(f"Connection {index} failed: {e}", file=sys.stderr)
+
+
+async def main(args):
+    raise_fd_limit(args.connections)
+    stats_url = args.url.replace("ws://", "http://").replace("wss://", "https://").replace("/ws/session", "/ws/connection_stats")
+
+    baseline_kb = server_rss_kb(args.server_pid)
+    stop = asyncio.Event()
+    opened = [0, 0]  # opened, failed
+    tasks = []
+    started = time.monotonic()
+    for index in range(args.connections):
+        tasks.append(asyncio.create_task(client(args.url, args.domain, index, args.interval, stop, opened)))
+        if index % args.ramp_batch == args.ramp_batch - 1:
+            await asyncio.sleep(0.05)
+    print(f"Spawned {args.connections} clients in {time.monotonic() - started:.1f}s")
+
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        await asyncio.sleep(min(args.report_every, max(deadline - time.monotonic(), 0)))
+        line = f"open={opened[0]} failed={opened[1]}"
+        rss_kb = server_rss_kb(args.server_pid)
+        if rss_kb is not None and baseline_kb is not None:
+            per_connection = (rss_kb - baseline_kb) * 1024 / opened[0] if opened[0] else 0
+            line += f" server_rss={rss_kb / 1024:.1f}MiB per_connection={per_connection:.0f}B"
+        # urllib blocks; keep it off the loop the clients run on
+        stats = await asyncio.to_thread(server_stats, stats_url, args.token)
+        if stats:
+            line += (
+                f" loop_lag={stats['event_loop_lag_ms']:.1f}ms"
+                f" loop_lag_max={stats['event_loop_lag_max_ms']:.1f}ms"
+                f" retained_per_connection={stats['retained_bytes_per_connection']:.0f}B"
+            )
+        print(line)
+
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent WebSocket load harness for /ws/session")
+    parser.add_argument("--url", default="ws://localhost:8000/ws/session")
+    parser.add_argument("--domain", default="www.spandan.com")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between frames per client")
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--ramp-batch", type=int, default=200, help="connections opened per 50ms")
+    parser.add_argument("--report-every", type=float, default=5.0)
+    parser.add_argument("--server-pid", type=int, help="uvicorn worker pid, for VmRSS")
+    parser.add_argument("--token", help="super admin JWT, for /ws/connection_stats")
+    asyncio.run(main(parser.parse_args()))
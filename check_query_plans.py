@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from bson import ObjectId
+from app.config.db_config import mongodb
+from app.repo.admin_repo import AdminRepo
+from app.repo.dashboard_repo import DashboardRepo
+from app.repo.index_registry import INDEXES, ensure_indexes
+from app.repo.ingest_repo import IngestRepo
+from app.repo.user_repo import UserRepo
+
+# Query-plan regression check. Builds the registered indexes in a scratch database on a
+# local mongod, runs every DashboardRepo / UserRepo / AdminRepo query with the profiler
+# on, and exits non-zero if any of them was planned as a collection scan or left no plan
+# in the profiler (a query the check cannot see is not a query it has checked).
+# Usage: python check_query_plans.py [--uri mongodb://localhost:27017]
+
+DATABASE_NAME = "query_plan_check"
+DOMAIN_NAME = "www.example.com"
+ADMIN_ID = ObjectId()
+USER_ID = ObjectId()
+
+
+async def seed():
+    now = datetime.utcnow()
+    collections = mongodb.collections
+    await collections["admin"].insert_one({"_id": ADMIN_ID, "username": "admin", "domain_name": DOMAIN_NAME, "status": "ACTIVE"})
+    await collections["user"].insert_one({"_id": USER_ID, "username": "visitor", "domain_name": DOMAIN_NAME, "date_joined": now, "session_count": 1})
+    await collections["session_data"].insert_one({
+        "user_id": str(USER_ID), "domain_name": DOMAIN_NAME,
+        "session_start": now - timedelta(minutes=5), "session_end": now, "path_history": ["/"]
+    })
+    await collections["counts"].insert_one({"domain_name": DOMAIN_NAME, "page_counts": {"/": 1}, "session_count": 1, "session_duration_sum": 300})
+    await collections["content"].insert_one({"domain_name": DOMAIN_NAME, "metrics": []})
+    await collections["content_metrics"].insert_one({"domain_name": DOMAIN_NAME, "type": "VIDEO", "title": "intro", "views": 1})
+    await collections["rollups"].insert_many([
+        {"domain_name": DOMAIN_NAME, "granularity": granularity, "bucket": bucket, "visits": 1}
+        for granularity, bucket in IngestRepo.rollup_buckets({IngestRepo.rollup_slot(now): {}})
+    ])
+    await collections["geo_bins"].insert_one({"domain_name": DOMAIN_NAME, "resolution": 1, "latitude": 27.5, "longitude": 85.5, "count": 1})
+    await collections["referrer_counts"].insert_one({"domain_name": DOMAIN_NAME, "utm_source": "news", "utm_medium": "email", "utm_campaign": "launch", "count": 1})
+
+
+def queries():
+    now = datetime.utcnow()
+    admin_id = str(ADMIN_ID)
+    return {
+        "DashboardRepo.get_main_counts": DashboardRepo.get_main_counts(DOMAIN_NAME),
+        "DashboardRepo.get_session_duration_stats": DashboardRepo.get_session_duration_stats(DOMAIN_NAME),
+        "DashboardRepo.get_session_duration_stats (range)": DashboardRepo.get_session_duration_stats(DOMAIN_NAME, now - timedelta(days=30), now),
+        "DashboardRepo.get_count_data": DashboardRepo.get_count_data(DOMAIN_NAME),
+        "DashboardRepo.get_content_page": DashboardRepo.get_content_page(DOMAIN_NAME, None, "views", True, 51),
+        "DashboardRepo.get_content_page (cursor)": DashboardRepo.get_content_page(DOMAIN_NAME, None, "views", True, 51, (1, "VIDEO", "intro")),
+        "DashboardRepo.get_content_page (type, cursor)": DashboardRepo.get_content_page(DOMAIN_NAME, "VIDEO", "like_rate", True, 51, (0.5, "VIDEO", "intro")),
+        "DashboardRepo.get_geo_heatmap": DashboardRepo.get_geo_heatmap(DOMAIN_NAME, 1, None, 100),
+        "DashboardRepo.get_geo_heatmap (bbox)": DashboardRepo.get_geo_heatmap(DOMAIN_NAME, 1, (20.0, 80.0, 30.0, 90.0), 100),
+        "DashboardRepo.get_top_referrers": DashboardRepo.get_top_referrers(DOMAIN_NAME, 20),
+        "DashboardRepo.get_rollup_series": DashboardRepo.get_rollup_series(DOMAIN_NAME, "day", now - timedelta(days=30), now, "week", "Europe/Berlin"),
+        "DashboardRepo.get_rollup_series (quarter_hour)": DashboardRepo.get_rollup_series(DOMAIN_NAME, "quarter_hour", now - timedelta(days=1), now, "hour", "Asia/Kathmandu"),
+        "UserRepo.find_users": UserRepo.find_users(DOMAIN_NAME),
+        "UserRepo.find_session_by_user_id": UserRepo.find_session_by_user_id(str(USER_ID), None, None),
+        "UserRepo.find_session_by_user_id (month)": UserRepo.find_session_by_user_id(str(USER_ID), now.year, now.month),
+        "AdminRepo.find_admin": AdminRepo.find_admin("admin"),
+        "AdminRepo.find_admin_by_id": AdminRepo.find_admin_by_id(admin_id),
+        "AdminRepo.update_admin_status": AdminRepo.update_admin_status(admin_id, "ACTIVE"),
+        "AdminRepo.update_admin": AdminRepo.update_admin(admin_id, {"status": "ACTIVE"}),
+    }
+
+
+async def main(uri: str) -> int:
+    await mongodb.connect(uri, DATABASE_NAME)
+    await mongodb.client.drop_database(DATABASE_NAME)
+    try:
+        await ensure_indexes()
+        await seed()
+
+        failures = []
+        for name, query in queries().items():
+            await mongodb.database.command("profile", 2)
+            await query
+            await mongodb.database.command("profile", 0)
+            plans = await mongodb.database["system.profile"].find(
+                {"ns": {"$in": [f"{DATABASE_NAME}.{collection}" for collection in INDEXES]}, "planSummary": {"$exists": True}},
+                {"ns": 1, "planSummary": 1}
+            ).to_list(length=None)
+            await mongodb.database["system.profile"].drop()
+
+            for plan in plans:
+                status = "FAIL" if "COLLSCAN" in plan["planSummary"] else "ok"
+                print(f"{status:4} {name}: {plan['ns'].split('.', 1)[1]} {plan['planSummary']}")
+                if status == "FAIL":
+                    failures.append(name)
+            if not plans:
+                print(f"FAIL {name}: no plan recorded")
+                failures.append(name)
+
+        if failures:
+            print(f"{len(failures)} queries use a collection scan or recorded no plan: {', '.join(failures)}")
+            return 1
+        print("No collection scans.")
+        return 0
+    finally:
+        await mongodb.client.drop_database(DATABASE_NAME)
+        await mongodb.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if a repo query is planned as a collection scan")
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    sys.exit(asyncio.run(main(parser.parse_args().uri)))
@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime, timezone
 from typing import Dict, List, Optional
 from bson import ObjectId
@@ -5,6 +6,10 @@ from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnec
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.concurrency import asynccontextmanager
 from app.config.db_config import mongodb, MONGO_URI, DATABASE_NAME
+from app.config.ingest_config import (
+    INGEST_BATCH_ENABLED, INGEST_QUEUE_ENABLED, PRESENCE_BACKEND, SESSION_STITCHING_ENABLED, SPOOL_ENABLED
+)
+from app.config.websocket_config import WS_MAX_FRAME_BYTES, WS_PING_INTERVAL, WS_PING_TIMEOUT
 from app.model.admin_model import Admin
 from app.model.session_data import SessionData
 from app.config.db_config import mongodb
@@ -12,9 +17,18 @@ from app.controller.user_controller import user_route
 from app.controller.dashboard_controller import dashboard_route
 from app.controller.admin_controller import admin_route
 from app.controller.websocket_controller import websocket_route
+from app.controller.ingest_controller import ingest_route
 from app.repo.admin_repo import AdminRepo
+from app.repo.index_registry import ensure_indexes
+from app.service.domain_change_feed import domain_change_feed
+from app.service.ingest_buffer import ingest_buffer
+from app.service.ingest_queue import ingest_queue
+from app.service.ingest_spool import ingest_spool
+from app.service.live_dashboard_service import live_dashboard
+from app.service.presence_service import presence
+from app.service.session_stitcher import session_stitcher
+from app.utils.loop_monitor import loop_monitor
 from app.utils.password_utils import hash_password
-from app.utils.shared_state import active_connections
 
 app = FastAPI()
 
@@ -31,6 +45,7 @@ app.include_router(user_route, tags=["User"])
 app.include_router(dashboard_route, tags=["Dashboard"])
 app.include_router(admin_route, tags=["Admin"])
 app.include_router(websocket_route, tags=["WEBSOCKET"])
+app.include_router(ingest_route, tags=["Ingest"])
 
 
 @asynccontextmanager
@@ -38,8 +53,39 @@ async def lifespan(app: FastAPI):
     await mongodb.connect(MONGO_URI, DATABASE_NAME)  # Connect to MongoDB
 
     await initialize_superadmin()
+    # Upserts rely on the unique indexes to not create duplicates, so wait for them
+    failed_indexes = await ensure_indexes(unique=True)
+    if failed_indexes:
+        raise RuntimeError(f"Could not create unique indexes on: {', '.join(failed_indexes)}")
+    index_task = asyncio.create_task(ensure_indexes(unique=False))  # Built in the background; startup does not wait
+    await presence.start()  # Start publishing presence for this worker
+    live_dashboard.start()  # Start pushing live dashboard deltas
+    if PRESENCE_BACKEND == "mongo":
+        domain_change_feed.start()  # Several workers: share which domains each one's ingest changed
+    loop_monitor.start()  # Track event-loop latency
+
+    if INGEST_BATCH_ENABLED:
+        ingest_buffer.start()  # Start the write-behind flusher
+    if INGEST_QUEUE_ENABLED:
+        ingest_queue.start()  # Start the ingest worker pool
+    if SPOOL_ENABLED:
+        ingest_spool.start()  # Replays anything spooled before the last shutdown
+    else:
+        await ingest_spool.replay_spilled()  # Sessions the ingest queue spilled at the last shutdown
+    if SESSION_STITCHING_ENABLED:
+        await session_stitcher.recover()  # Replay sessions checkpointed before a crash
+        session_stitcher.start()
 
     yield
+    index_task.cancel()
+    await loop_monitor.stop()
+    await domain_change_feed.stop()
+    await live_dashboard.stop()
+    await session_stitcher.stop()  # Persist in-progress sessions
+    await ingest_queue.stop()  # Finish queued sessions before draining the buffer; spills the rest to the spool
+    await ingest_spool.stop()  # Replay what the database can take; the rest waits on disk
+    await ingest_buffer.stop()  # Drain buffered sessions before disconnecting
+    await presence.stop()  # Withdraw this worker's connections
     await mongodb.close()  # Disconnect from MongoDB
 
 
@@ -71,3 +117,15 @@ async def initialize_superadmin():
     
 
 
+if __name__ == "__main__":
+    import uvicorn
+
+    # Protocol pings detect dead peers; frames above the limit are refused before they are buffered
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        ws_ping_interval=WS_PING_INTERVAL,
+        ws_ping_timeout=WS_PING_TIMEOUT,
+        ws_max_size=WS_MAX_FRAME_BYTES
+    )
@@ -0,0 +1,56 @@
+import sys
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from app.config.db_config import MONGO_URI, DATABASE_NAME
+
+# Converts the legacy `content` documents (one `metrics` array per domain)
+# into one `content_metrics` document per (domain_name, type, title).
+# Numeric fields are added with $inc, so run it once, or pass --drop-legacy to
+# remove the migrated legacy documents and make re-runs a no-op.
+
+NUMERIC_FIELDS = [
+    "views", "likes", "subscribers", "cta_clicks", "clicks",
+    "sum_scroll_depth", "sum_watch_time", "sum_completion_rate"
+]
+
+client = MongoClient(MONGO_URI)
+db = client[DATABASE_NAME]
+
+db.content_metrics.create_index(
+    [("domain_name", ASCENDING), ("type", ASCENDING), ("title", ASCENDING)],
+    unique=True
+)
+
+migrated_documents = 0
+migrated_metrics = 0
+
+for content in db.content.find({}):
+    domain_name = content.get("domain_name")
+    operations = []
+
+    for metric in content.get("metrics", []):
+        inc = {field: metric[field] for field in NUMERIC_FIELDS if metric.get(field)}
+        for button_name, clicks in (metric.get("child_buttons") or {}).items():
+            inc[f"child_buttons.{button_name}"] = clicks
+
+        update_data = {"$setOnInsert": {"referrer": metric.get("referrer", "")}}
+        if inc:
+            update_data["$inc"] = inc
+        if metric.get("type") == "BUTTON":
+            update_data = {"$inc": inc} if inc else {"$setOnInsert": {"clicks": 0}}
+
+        operations.append(UpdateOne(
+            {"domain_name": domain_name, "type": metric.get("type"), "title": metric.get("title")},
+            update_data,
+            upsert=True
+        ))
+
+    if operations:
+        db.content_metrics.bulk_write(operations, ordered=False)
+    migrated_documents += 1
+    migrated_metrics += len(operations)
+
+print(f"Migrated {migrated_metrics} metrics from {migrated_documents} content documents.")
+
+if "--drop-legacy" in sys.argv:
+    db.content.delete_many({})
+    print("Legacy content documents removed.")
@@ -0,0 +1,31 @@
+from datetime import datetime
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from app.config.db_config import MONGO_URI, DATABASE_NAME
+
+# Moves each admin's embedded `users_list` into the `domain_users` collection
+# (one document per domain_name/user_id pair) and removes the array from the admin document.
+
+client = MongoClient(MONGO_URI)
+db = client[DATABASE_NAME]
+
+db.domain_users.create_index([("domain_name", ASCENDING), ("user_id", ASCENDING)], unique=True)
+
+migrated_users = 0
+
+for admin in db.admin.find({"users_list": {"$exists": True}}, {"domain_name": 1, "users_list": 1}):
+    domain_name = admin.get("domain_name")
+    operations = [
+        UpdateOne(
+            {"domain_name": domain_name, "user_id": user_id},
+            {"$setOnInsert": {"first_seen": datetime.utcnow()}},
+            upsert=True
+        )
+        for user_id in admin.get("users_list") or []
+    ]
+    if domain_name and operations:
+        db.domain_users.bulk_write(operations, ordered=False)
+        migrated_users += len(operations)
+
+    db.admin.update_one({"_id": admin["_id"]}, {"$unset": {"users_list": ""}})
+
+print(f"Migrated {migrated_users} domain users.")
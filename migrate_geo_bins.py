@@ -0,0 +1,47 @@
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from app.config.db_config import MONGO_URI, DATABASE_NAME
+from app.config.ingest_config import GEO_BIN_SIZES
+
+# Builds the geo heatmap cells from the locations of sessions stored before they were
+# maintained at ingest time. Run it before deploying the ingest change (or while ingest
+# is paused): cells that already exist are left untouched so nothing is counted twice.
+
+client = MongoClient(MONGO_URI)
+db = client[DATABASE_NAME]
+
+db.geo_bins.create_index(
+    [("domain_name", ASCENDING), ("resolution", ASCENDING), ("latitude", ASCENDING), ("longitude", ASCENDING)],
+    unique=True
+)
+
+
+def cell_center(field, size):
+    return {"$round": [{"$multiply": [{"$add": [{"$floor": {"$divide": [field, size]}}, 0.5]}, size]}, 6]}
+
+
+for resolution, size in enumerate(GEO_BIN_SIZES):
+    pipeline = [
+        {"$match": {
+            "location.latitude": {"$gte": -90, "$lte": 90},
+            "location.longitude": {"$gte": -180, "$lte": 180}
+        }},
+        {"$group": {
+            "_id": {
+                "domain_name": "$domain_name",
+                "latitude": cell_center("$location.latitude", size),
+                "longitude": cell_center("$location.longitude", size)
+            },
+            "count": {"$sum": 1}
+        }}
+    ]
+    operations = [
+        UpdateOne(
+            {"domain_name": row["_id"]["domain_name"], "resolution": resolution, "latitude": row["_id"]["latitude"], "longitude": row["_id"]["longitude"]},
+            {"$setOnInsert": {"count": row["count"]}},
+            upsert=True
+        )
+        for row in db.session_data.aggregate(pipeline, allowDiskUse=True)
+        if row["_id"]["domain_name"] is not None
+    ]
+    created = db.geo_bins.bulk_write(operations, ordered=False).upserted_count if operations else 0
+    print(f"Created {created} heatmap cells at resolution {resolution} ({size} degrees).")
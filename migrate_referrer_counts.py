@@ -0,0 +1,78 @@
+from pymongo import MongoClient, UpdateOne
+from app.config.db_config import MONGO_URI, DATABASE_NAME
+from app.utils.counter_keys import encode_counter_key
+
+# Backfills the referrer_counts collection (one document per domain and
+# utm_source/utm_medium/utm_campaign) and `referrers` on the daily and monthly rollups
+# from the referrers of stored sessions, and removes the `referrer_counts` map earlier
+# versions kept on counts documents. Run it before deploying the ingest change (or
+# while ingest is paused): counters that already exist are left untouched so nothing
+# is counted twice.
+
+client = MongoClient(MONGO_URI)
+db = client[DATABASE_NAME]
+
+formats = {"day": "%Y-%m-%d", "month": "%Y-%m-01"}
+complete_referrer = {
+    "referrer.utm_source": {"$ne": None},
+    "referrer.utm_medium": {"$ne": None},
+    "referrer.utm_campaign": {"$ne": None},
+}
+
+
+def referrer_rows(bucket_format=None):
+    group_id = {
+        "domain_name": "$domain_name",
+        "utm_source": "$referrer.utm_source",
+        "utm_medium": "$referrer.utm_medium",
+        "utm_campaign": "$referrer.utm_campaign",
+    }
+    if bucket_format:
+        group_id["bucket"] = {"$dateFromString": {"dateString": {"$dateToString": {"format": bucket_format, "date": "$session_start"}}}}
+    return db.session_data.aggregate([
+        {"$match": complete_referrer},
+        {"$group": {"_id": group_id, "count": {"$sum": 1}}}
+    ], allowDiskUse=True)
+
+
+def counters_by(rows, *fields):
+    counters = {}
+    for row in rows:
+        group = row["_id"]
+        if group["domain_name"] is None:
+            continue
+        key = encode_counter_key((group["utm_source"], group["utm_medium"], group["utm_campaign"]))
+        counters.setdefault(tuple(group[field] for field in fields), {})[key] = row["count"]
+    return counters
+
+
+operations = [
+    UpdateOne(
+        {
+            "domain_name": row["_id"]["domain_name"],
+            "utm_source": row["_id"]["utm_source"],
+            "utm_medium": row["_id"]["utm_medium"],
+            "utm_campaign": row["_id"]["utm_campaign"],
+        },
+        {"$setOnInsert": {"count": row["count"]}},
+        upsert=True
+    )
+    for row in referrer_rows()
+    if row["_id"]["domain_name"] is not None
+]
+inserted = db.referrer_counts.bulk_write(operations, ordered=False).upserted_count if operations else 0
+print(f"Backfilled {inserted} referrer_counts documents.")
+
+removed = db.counts.update_many({"referrer_counts": {"$exists": True}}, {"$unset": {"referrer_counts": ""}}).modified_count
+print(f"Removed the referrer_counts map from {removed} counts documents.")
+
+for granularity, bucket_format in formats.items():
+    operations = [
+        UpdateOne(
+            {"domain_name": domain_name, "granularity": granularity, "bucket": bucket, "referrers": {"$exists": False}},
+            {"$set": {"referrers": referrers}}
+        )
+        for (domain_name, bucket), referrers in counters_by(referrer_rows(bucket_format), "domain_name", "bucket").items()
+    ]
+    updated = db.rollups.bulk_write(operations, ordered=False).modified_count if operations else 0
+    print(f"Backfilled referrers on {updated} {granularity} rollups.")
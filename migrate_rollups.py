@@ -0,0 +1,91 @@
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from app.config.db_config import MONGO_URI, DATABASE_NAME
+
+# Backfills the quarter-hour, hourly, daily and monthly rollups (visits, bounces, session_duration_sum,
+# page_views, new_users) from session_data and user. Run it before deploying the ingest change
+# (or while ingest is paused): buckets that already exist are left untouched so
+# nothing is counted twice.
+
+client = MongoClient(MONGO_URI)
+db = client[DATABASE_NAME]
+
+db.rollups.create_index(
+    [("domain_name", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)],
+    unique=True
+)
+
+formats = {"hour": "%Y-%m-%dT%H:00:00", "day": "%Y-%m-%d", "month": "%Y-%m-01"}
+
+
+def bucket_of(granularity, date_field):
+    if granularity == "quarter_hour":
+        return {"$dateTrunc": {"date": f"${date_field}", "unit": "minute", "binSize": 15}}
+    return {"$dateFromString": {"dateString": {"$dateToString": {"format": formats[granularity], "date": f"${date_field}"}}}}
+
+
+def backfill(collection, granularity, date_field, fields):
+    pipeline = [
+        {"$match": {date_field: {"$type": "date"}}},
+        {"$group": {
+            "_id": {
+                "domain_name": "$domain_name",
+                "bucket": bucket_of(granularity, date_field)
+            },
+            **fields
+        }}
+    ]
+    operations = []
+    for row in collection.aggregate(pipeline, allowDiskUse=True):
+        if row["_id"]["domain_name"] is None:
+            continue
+        values = {field: row[field] for field in fields}
+        operations.append(UpdateOne(
+            {"domain_name": row["_id"]["domain_name"], "granularity": granularity, "bucket": row["_id"]["bucket"]},
+            {"$setOnInsert": values},
+            upsert=True
+        ))
+    if not operations:
+        return 0
+    return db.rollups.bulk_write(operations, ordered=False).upserted_count
+
+
+session_fields = {
+    "visits": {"$sum": 1},
+    "bounces": {"$sum": {"$cond": ["$bounce", 1, 0]}},
+    "session_duration_sum": {"$sum": {"$divide": [{"$subtract": ["$session_end", "$session_start"]}, 1000]}},
+    "page_views": {"$sum": {"$size": {"$ifNull": ["$path_history", []]}}},
+}
+user_fields = {"new_users": {"$sum": 1}}
+
+for granularity in ("quarter_hour", "hour", "day", "month"):
+    created = backfill(db.session_data, granularity, "session_start", session_fields)
+    print(f"Created {created} {granularity} rollups from session_data.")
+
+    # Buckets created from sessions have no new_users yet; days with sign-ups but no sessions get their own bucket
+    user_rows = db.user.aggregate([
+        {"$match": {"date_joined": {"$type": "date"}}},
+        {"$group": {
+            "_id": {
+                "domain_name": "$domain_name",
+                "bucket": bucket_of(granularity, "date_joined")
+            },
+            "new_users": {"$sum": 1}
+        }}
+    ], allowDiskUse=True)
+    operations = [
+        UpdateOne(
+            {
+                "domain_name": row["_id"]["domain_name"],
+                "granularity": granularity,
+                "bucket": row["_id"]["bucket"],
+                "new_users": {"$exists": False}
+            },
+            {"$set": {"new_users": row["new_users"]}},
+            upsert=False
+        )
+        for row in user_rows
+        if row["_id"]["domain_name"] is not None
+    ]
+    updated = db.rollups.bulk_write(operations, ordered=False).modified_count if operations else 0
+    created = backfill(db.user, granularity, "date_joined", user_fields)
+    print(f"Set new_users on {updated} and created {created} {granularity} rollups from user.")
@@ -0,0 +1,30 @@
+from pymongo import MongoClient
+from app.config.db_config import MONGO_URI, DATABASE_NAME
+
+# Backfills `session_count` and `session_duration_sum` on counts documents written
+# before the running totals were maintained at ingest time. Run it before deploying
+# the ingest change (or while ingest is paused): domains that already have the
+# fields are skipped so the totals are never counted twice.
+
+client = MongoClient(MONGO_URI)
+db = client[DATABASE_NAME]
+
+pipeline = [
+    {"$group": {
+        "_id": "$domain_name",
+        "session_count": {"$sum": 1},
+        "session_duration_sum": {"$sum": {"$divide": [{"$subtract": ["$session_end", "$session_start"]}, 1000]}}
+    }}
+]
+
+updated = 0
+for row in db.session_data.aggregate(pipeline, allowDiskUse=True):
+    if row["_id"] is None:
+        continue
+    updated += db.counts.update_one(
+        {"domain_name": row["_id"], "session_count": {"$exists": False}},
+        {"$set": {"session_count": row["session_count"], "session_duration_sum": row["session_duration_sum"]}},
+        upsert=False
+    ).modified_count
+
+print(f"Backfilled session duration totals on {updated} counts documents.")
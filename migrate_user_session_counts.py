@@ -0,0 +1,36 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from app.config.db_config import MONGO_URI, DATABASE_NAME
+
+# Backfills `session_count` (and `last_seen` from the latest session) on users created
+# before the counter was maintained at ingest time.
+
+client = MongoClient(MONGO_URI)
+db = client[DATABASE_NAME]
+
+db.user.create_index([("domain_name", ASCENDING), ("session_count", DESCENDING)])
+
+result = db.user.update_many(
+    {"session_count": {"$exists": False}},
+    [{"$set": {"session_count": {"$size": {"$ifNull": ["$session_ids", []]}}}}]
+)
+print(f"Backfilled session_count on {result.modified_count} users.")
+
+last_seen_pipeline = [
+    {"$group": {"_id": "$user_id", "last_seen": {"$max": "$session_end"}}}
+]
+updated = 0
+for row in db.session_data.aggregate(last_seen_pipeline, allowDiskUse=True):
+    if row["_id"] is None:
+        continue
+    try:
+        user_id = ObjectId(row["_id"])
+    except (InvalidId, TypeError):
+        continue
+    updated += db.user.update_one(
+        {"_id": user_id, "last_seen": {"$exists": False}},
+        {"$set": {"last_seen": row["last_seen"]}}
+    ).modified_count
+
+print(f"Backfilled last_seen on {updated} users.")